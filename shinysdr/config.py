@@ -56,6 +56,7 @@ class Config(object):
         
         # these are to be read by main
         self._state_filename = None
+        self._filter_cache_filename = None
         self._service_makers = []
         
         # private: config state
@@ -102,6 +103,11 @@ class Config(object):
             raise ConfigException('config.persist_to_file has already been done once')
         self._state_filename = str(filename)
 
+    def set_filter_cache_file(self, filename):
+        """Store computed filter designs in the given file to speed up later startups."""
+        self._not_finished()
+        self._filter_cache_filename = str(filename)
+
     def serve_web(self, http_endpoint, ws_endpoint, root_cap=None, title=u'ShinySDR'):
         self._not_finished()
         # TODO: See if we're reinventing bits of Twisted service stuff here
@@ -238,7 +244,10 @@ class _ConfigDbs(object):
 class _ConfigFeatures(object):
     def __init__(self, config):
         self._state = {
+            'device_partitions': False,
+            'poller_diagnostics': False,
             'reboot': False,
+            'receiver_workers': False,
             'stereo': True,
             '_test_disabled_feature': False,
             '_test_enabled_feature': True,
@@ -21,8 +21,16 @@ GNU Radio blocks which automatically compute appropriate filter designs.
 
 from __future__ import absolute_import, division, unicode_literals
 
+from collections import OrderedDict
 from fractions import gcd
+import json
+import math
 from math import pi, sin, cos
+import os
+
+from twisted.internet import reactor
+from twisted.python import log
+from zope.interface import implementer  # available via Twisted
 
 from gnuradio import gr
 from gnuradio.fft import window
@@ -31,8 +39,8 @@ from gnuradio.filter import pfb
 from gnuradio.filter import firdes
 from gnuradio.filter import rational_resampler
 
-from shinysdr.interfaces import BandShape
-from shinysdr.i.math import factorize, small_factor_at_least
+from shinysdr.interfaces import BandShape, ITunableDemodulator
+from shinysdr.i.math import divisors
 
 
 __all__ = []  # appended later
@@ -40,6 +48,127 @@ __all__ = []  # appended later
 # Use rational_resampler_ccf rather than arb_resampler_ccf. This is less efficient, but avoids the bug <http://gnuradio.org/redmine/issues/713> where the latter block will hang the flowgraph if it is reused. When that is fixed, turn this flag off and maybe ditch the code for it.
 _use_rational_resampler = True
 
+# Stopband attenuation in dB which firdes associates with the windows we use, which determines how many taps it designs. The Kaiser value is for rational_resampler.design_filter's beta of 7.
+_HAMMING_ATTENUATION = 53
+_KAISER_ATTENUATION = 7.0 / 0.1102 + 8.7
+_BLACKMAN_HARRIS_ATTENUATION = 92
+
+
+def _estimate_ntaps(attenuation, sampling_freq, transition_width):
+    """Return the number of taps firdes designs for a low-pass filter (cf. firdes::compute_ntaps)."""
+    return int(attenuation * sampling_freq / (22.0 * transition_width)) | 1
+
+
+def _fir_filter_cost(ntaps, decimation):
+    """Estimated multiply-accumulates per input sample of a direct-form decimating FIR filter."""
+    return ntaps / decimation
+
+
+def _fft_filter_cost(ntaps):
+    """Estimated multiply-accumulates per input sample of fft_filter_ccc, which computes every output even when decimating."""
+    fft_size = 2 * 2 ** int(math.ceil(math.log(ntaps, 2)))  # as chosen by fft_filter
+    # a forward and an inverse FFT, and the spectrum product, per block of new input samples
+    return (fft_size * math.log(fft_size, 2) + fft_size) / (fft_size - ntaps + 1)
+
+
+def _prefer_fft_filter(ntaps, decimation):
+    return _fft_filter_cost(ntaps) < _fir_filter_cost(ntaps, decimation)
+
+
+# Number of filter designs kept in memory for reuse.
+_TAP_CACHE_SIZE = 256
+
+
+class _TapCache(object):
+    """
+    Memoizes filter designs, keyed by a tuple of the design function's name and all of its parameters.
+    
+    Designs are kept in memory with least-recently-used eviction, and optionally also in a file so that they survive restarts.
+    """
+    def __init__(self, size):
+        self.__size = size
+        self.__entries = OrderedDict()
+        self.__filename = None
+        self.__dirty = False
+    
+    def get(self, key, design):
+        """Return the taps for key, calling design() to compute them if they are not cached."""
+        taps = self.__entries.pop(key, None)
+        if taps is None:
+            taps = tuple(design())
+            self.__dirty = True
+        self.__entries[key] = taps
+        while len(self.__entries) > self.__size:
+            self.__entries.popitem(last=False)
+        # a fresh list because callers may modify it
+        return list(taps)
+    
+    def clear(self):
+        self.__entries.clear()
+    
+    def use_file(self, filename):
+        """Load designs from filename, if it exists, and write them there on save()."""
+        self.__filename = filename
+        try:
+            if os.path.isfile(filename):
+                with open(filename, 'r') as f:
+                    loaded = [(tuple(key), tuple(taps)) for key, taps in json.load(f)]
+                # the file is in least-recently-used order, so keep the end
+                for key, taps in loaded[-self.__size:]:
+                    self.__entries[key] = taps
+                while len(self.__entries) > self.__size:
+                    self.__entries.popitem(last=False)
+        except (IOError, OSError, ValueError, TypeError) as e:
+            log.err(e, 'Loading filter cache file {!r}'.format(filename))
+    
+    def save(self):
+        if self.__filename is None or not self.__dirty:
+            return
+        try:
+            temp_filename = self.__filename + '.new'
+            with open(temp_filename, 'w') as f:
+                json.dump(list(self.__entries.iteritems()), f)
+            os.rename(temp_filename, self.__filename)  # TODO: use os.replace() if we ever get to Python 3
+            self.__dirty = False
+        except (IOError, OSError) as e:
+            log.err(e, 'Writing filter cache file {!r}'.format(self.__filename))
+
+
+_tap_cache = _TapCache(_TAP_CACHE_SIZE)
+
+
+def use_filter_cache_file(filename):
+    """Keep filter designs in the given file, so that constructing filters is faster after restarting. Call save_filter_cache to update the file."""
+    _tap_cache.use_file(filename)
+
+
+__all__.append('use_filter_cache_file')
+
+
+def save_filter_cache():
+    """Write filter designs to the file specified by use_filter_cache_file, if any."""
+    _tap_cache.save()
+
+
+__all__.append('save_filter_cache')
+
+
+def _low_pass_taps(gain, sampling_freq, cutoff_freq, transition_width, window=firdes.WIN_HAMMING):
+    """Memoized firdes.low_pass."""
+    return _tap_cache.get(
+        ('low_pass', gain, sampling_freq, cutoff_freq, transition_width, int(window)),
+        lambda: firdes.low_pass(gain, sampling_freq, cutoff_freq, transition_width, window))
+
+
+def _rational_resampler_taps(interpolation, decimation, fractional_bw):
+    """Memoized rational_resampler.design_filter."""
+    return _tap_cache.get(
+        ('rational_resampler', interpolation, decimation, fractional_bw),
+        lambda: rational_resampler.design_filter(
+            interpolation=interpolation,
+            decimation=decimation,
+            fractional_bw=fractional_bw))
+
 
 class _MultistageChannelFilterPlan(object):
     """
@@ -47,9 +176,9 @@ class _MultistageChannelFilterPlan(object):
     an array of taps for a single-stage filter.
     """
     
-    def __init__(self, stage_designs, freq_xlate_stage, cutoff_freq, transition_width, taps=None):
+    def __init__(self, stage_designs, freq_xlate_stage, cutoff_freq, transition_width):
         self.__stage_designs = stage_designs
-        self.__taps = taps if taps is not None else [None for _ in stage_designs]
+        self.__taps = None  # computed on demand
         self.__freq_xlate_stage = freq_xlate_stage
         self.__cutoff_freq = float(cutoff_freq)
         self.__transition_width = float(transition_width)
@@ -61,6 +190,12 @@ class _MultistageChannelFilterPlan(object):
         return self.__stage_designs
     
     def get_stage_designs_and_taps(self):
+        if self.__taps is None:
+            self.__taps = [
+                design.calculate_taps(
+                    final_cutoff=self.__cutoff_freq,
+                    final_transition=self.__transition_width)
+                for design in self.__stage_designs]
         return zip(self.__stage_designs, self.__taps)
     
     def get_freq_xlate_stage(self):
@@ -75,6 +210,13 @@ class _MultistageChannelFilterPlan(object):
     def get_shape(self):
         return self.__band_shape
     
+    def get_cost(self):
+        """Return the estimated number of multiply-accumulate operations per input sample."""
+        input_rate = self.__stage_designs[0].input_rate
+        return sum(
+            design.estimate_cost(self.__cutoff_freq, self.__transition_width) * design.input_rate / input_rate
+            for design in self.__stage_designs)
+    
     def replace(self, cutoff_freq=None, transition_width=None):
         if cutoff_freq is None:
             cutoff_freq = self.__cutoff_freq
@@ -84,11 +226,6 @@ class _MultistageChannelFilterPlan(object):
         assert transition_width > 0
         return _MultistageChannelFilterPlan(
             stage_designs=self.__stage_designs,
-            taps=[
-                design.calculate_taps(
-                    final_cutoff=cutoff_freq,
-                    final_transition=transition_width)
-                for design in self.__stage_designs],
             freq_xlate_stage=self.__freq_xlate_stage,
             cutoff_freq=cutoff_freq,
             transition_width=transition_width)
@@ -113,6 +250,9 @@ class _FilterPlanCommentStage(_FilterPlanStage):
     def calculate_taps(self, final_cutoff, final_transition):
         return None
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        return 0
+    
     def explain(self):
         return self.comment
 
@@ -134,14 +274,22 @@ class _FilterPlanXlateStage(_FilterPlanStage):
     def calculate_taps(self, final_cutoff, final_transition):
         return [1]
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        return 1
+    
     def explain(self):
         return 'freq xlation only'
 
 
 class _FilterPlanDecimatingStage(_FilterPlanStage):
-    def __init__(self, freq_xlating, decimation, **kwargs):
+    """A decimating stage before the final filter.
+    
+    It passes frequencies up to protected_freq, which is the Nyquist frequency of the whole filter's output, so that its taps do not depend on the final filter's cutoff and need not change when that is changed.
+    """
+    def __init__(self, freq_xlating, decimation, protected_freq=None, **kwargs):
         self.freq_xlating = freq_xlating
         self.decimation = decimation
+        self.protected_freq = protected_freq
         _FilterPlanStage.__init__(self,
             **kwargs)
     
@@ -154,22 +302,35 @@ class _FilterPlanDecimatingStage(_FilterPlanStage):
                 0,
                 self.input_rate)
         else:
-            if len(taps) > 10:
+            if _prefer_fft_filter(len(taps), self.decimation):
                 return grfilter.fft_filter_ccc(self.decimation, taps, 1)
             else:
                 return grfilter.fir_filter_ccc(self.decimation, taps)
     
-    def calculate_taps(self, final_cutoff, final_transition):
-        # TODO check for collision with user filter
-        user_inner = final_cutoff - final_transition / 2
+    def _design_parameters(self, final_cutoff, final_transition):
+        """Return the (cutoff, transition width) of this stage's filter."""
+        inner = self.protected_freq
         limit = self.output_rate / 2
-        return firdes.low_pass(
+        assert inner < limit
+        return (inner + limit) / 2, limit - inner
+    
+    def calculate_taps(self, final_cutoff, final_transition):
+        cutoff, transition = self._design_parameters(final_cutoff, final_transition)
+        return _low_pass_taps(
             1.0,
             self.input_rate,
-            (user_inner + limit) / 2,
-            limit - user_inner,
+            cutoff,
+            transition,
             firdes.WIN_HAMMING)
     
+    def estimate_cost(self, final_cutoff, final_transition):
+        _, transition = self._design_parameters(final_cutoff, final_transition)
+        ntaps = _estimate_ntaps(_HAMMING_ATTENUATION, self.input_rate, transition)
+        if self.freq_xlating:
+            return _fir_filter_cost(ntaps, self.decimation)
+        else:
+            return min(_fir_filter_cost(ntaps, self.decimation), _fft_filter_cost(ntaps))
+    
     def explain(self):
         fx = 'freq xlate and ' if self.freq_xlating else ''
         return '%sdecimate by %i' % (fx, self.decimation,)
@@ -179,18 +340,16 @@ class _FilterPlanFinalDecimatingStage(_FilterPlanDecimatingStage):
     def __init__(self, **kwargs):
         _FilterPlanDecimatingStage.__init__(self, **kwargs)
 
-    def calculate_taps(self, final_cutoff, final_transition):
-        return firdes.low_pass(
-            1.0,
-            self.input_rate,
-            final_cutoff,
-            final_transition,
-            firdes.WIN_HAMMING)
+    def _design_parameters(self, final_cutoff, final_transition):
+        return final_cutoff, final_transition
     
     def explain(self):
         return 'final filter and ' + super(_FilterPlanFinalDecimatingStage, self).explain()
 
 
+_RATIONAL_RESAMPLER_FRACTIONAL_BW = 0.4
+
+
 class _FilterPlanRationalResamplerStage(_FilterPlanStage):
     def __init__(self, decimation, interpolation, **kwargs):
         self.decimation = decimation
@@ -207,15 +366,26 @@ class _FilterPlanRationalResamplerStage(_FilterPlanStage):
     
     def calculate_taps(self, final_cutoff, final_transition):
         # TODO: This might be internal, and we eventually want to integrate it in the plan anyway
-        return rational_resampler.design_filter(
+        return _rational_resampler_taps(
             interpolation=self.interpolation,
             decimation=self.decimation,
-            fractional_bw=0.4)
+            fractional_bw=_RATIONAL_RESAMPLER_FRACTIONAL_BW)
+    
+    def estimate_cost(self, final_cutoff, final_transition):
+        # transition width as computed by rational_resampler.design_filter
+        rate = self.interpolation / self.decimation
+        transition = (0.5 - _RATIONAL_RESAMPLER_FRACTIONAL_BW) * min(1, rate)
+        ntaps = _estimate_ntaps(_KAISER_ATTENUATION, self.interpolation, transition)
+        # the taps are divided among interpolation filters, padded to equal length, and each output uses one filter
+        return int(math.ceil(ntaps / self.interpolation)) * self.interpolation / self.decimation
     
     def explain(self):
         return 'rational_resampler by %s/%s (stage rates %s/%s)' % (self.interpolation, self.decimation, self.output_rate, self.input_rate)
 
 
+_PFB_RESAMPLER_FILTERS = 32
+
+
 class _FilterPlanPfbResamplerStage(_FilterPlanStage):
     def __init__(self, resample_rate, **kwargs):
         self.resample_rate = resample_rate
@@ -223,65 +393,82 @@ class _FilterPlanPfbResamplerStage(_FilterPlanStage):
             **kwargs)
     
     def create_block(self, taps):
-        return pfb.arb_resampler_ccf(self.resample_rate)  # TODO explicitly compute taps
+        assert taps is not None
+        return pfb.arb_resampler_ccf(self.resample_rate, taps, _PFB_RESAMPLER_FILTERS)
+    
+    def __design_parameters(self):
+        # Like arb_resampler's default design: pass 80% of the narrower of the input and output bands. The filter is designed at the rate of the filter bank, where the input rate is 1 per filter.
+        half_band = 0.5 * min(1, self.resample_rate)
+        return half_band, 0.4 * half_band
     
     def calculate_taps(self, final_cutoff, final_transition):
-        return None
+        cutoff, transition = self.__design_parameters()
+        return _low_pass_taps(
+            _PFB_RESAMPLER_FILTERS,
+            _PFB_RESAMPLER_FILTERS,
+            cutoff,
+            transition,
+            firdes.WIN_BLACKMAN_HARRIS)
+    
+    def estimate_cost(self, final_cutoff, final_transition):
+        _, transition = self.__design_parameters()
+        ntaps = _estimate_ntaps(_BLACKMAN_HARRIS_ATTENUATION, _PFB_RESAMPLER_FILTERS, transition)
+        # the taps are divided among the filters, and each output uses one filter and its derivative
+        return 2 * ntaps / _PFB_RESAMPLER_FILTERS * self.resample_rate
     
     def explain(self):
         return 'arb_resampler %s/%s = %s' % (self.output_rate, self.input_rate, float(self.output_rate) / self.input_rate)
 
 
-def _make_filter_plan_1(input_rate, output_rate):
+def _make_filter_plan_1(input_rate, output_rate, cutoff_freq, transition_width):
+    """Choose the _MultistageChannelFilterPlan with the least estimated cost (get_cost) for the given parameters.
+    
+    The stage structure of the plan depends on cutoff_freq and transition_width only for cost purposes; the returned plan has no taps yet and may be used with others via replace().
+    """
     assert input_rate > 0
     assert output_rate > 0
     
-    total_decimation = max(1, int(input_rate // output_rate))
-    
     using_rational_resampler = _use_rational_resampler and input_rate % 1 == 0 and output_rate % 1 == 0
     if using_rational_resampler:
-        # If using rational resampler, don't decimate to the point that we get a fractional rate, if possible.
+        # Decimate to any rate which is an integer (so that the rational resampler can take it), and not less than the output rate.
         input_rate = int(input_rate)
         output_rate = int(output_rate)
         if input_rate > output_rate:
-            total_decimation = input_rate // small_factor_at_least(input_rate, output_rate)
-        # print input_rate / total_decimation, total_decimation, input_rate, output_rate, input_rate // gcd(input_rate, output_rate)
-        # TODO: Don't re-factorize unnecessarily
-    
-    stage_decimations = factorize(total_decimation)
-    stage_decimations.reverse()
+            candidate_decimations = [input_rate // rate for rate in divisors(input_rate) if rate >= output_rate]
+        else:
+            candidate_decimations = [1]
+    else:
+        candidate_decimations = [max(1, int(input_rate // output_rate))]
     
-    # loop variables
+    plans = [
+        _make_filter_plan_with_decimation(
+            input_rate=input_rate,
+            output_rate=output_rate,
+            total_decimation=total_decimation,
+            using_rational_resampler=using_rational_resampler,
+            cutoff_freq=cutoff_freq,
+            transition_width=transition_width)
+        for total_decimation in candidate_decimations]
+    return min(plans, key=lambda plan: plan.get_cost())
+
+
+def _make_filter_plan_with_decimation(input_rate, output_rate, total_decimation, using_rational_resampler, cutoff_freq, transition_width):
     stage_designs = []
-    stage_input_rate = input_rate
-    last_index = len(stage_decimations) - 1
     
-    if len(stage_decimations) == 0:
+    if total_decimation == 1:
         # interpolation or nothing -- don't put it in the stages
-        freq_xlate_stage = len(stage_designs)
         stage_designs.append(_FilterPlanXlateStage(
-            rate=stage_input_rate))
+            rate=input_rate))
+        stage_input_rate = input_rate
     else:
-        # decimation
-        for i, stage_decimation in enumerate(stage_decimations):
-            next_rate = stage_input_rate / stage_decimation
-        
-            stage_type = _FilterPlanFinalDecimatingStage if i == last_index else _FilterPlanDecimatingStage
-            if i == 0:
-                freq_xlate_stage = len(stage_designs)
-                stage_designs.append(stage_type(
-                    freq_xlating=True,
-                    decimation=stage_decimation,
-                    input_rate=stage_input_rate,
-                    output_rate=next_rate))
-            else:
-                stage_designs.append(stage_type(
-                    freq_xlating=False,
-                    decimation=stage_decimation,
-                    input_rate=stage_input_rate,
-                    output_rate=next_rate))
-        
-            stage_input_rate = next_rate
+        stage_designs.extend(_best_decimating_stages(
+            input_rate=input_rate,
+            total_decimation=total_decimation,
+            protected_freq=output_rate / 2,
+            cutoff_freq=cutoff_freq,
+            transition_width=transition_width))
+        stage_input_rate = stage_designs[-1].output_rate
+    freq_xlate_stage = 0
     
     # final connection and resampling
     if stage_input_rate == output_rate:
@@ -304,19 +491,54 @@ def _make_filter_plan_1(input_rate, output_rate):
                 input_rate=stage_input_rate,
                 output_rate=output_rate))
         else:
-            # TODO: cache filter computation as optfir is used and takes a noticeable time
             stage_designs.append(_FilterPlanPfbResamplerStage(
                 resample_rate=float(output_rate) / stage_input_rate,
                 input_rate=stage_input_rate,
                 output_rate=output_rate))
     
-    plan = _MultistageChannelFilterPlan(
+    return _MultistageChannelFilterPlan(
         stage_designs=stage_designs,
         freq_xlate_stage=freq_xlate_stage,
-        cutoff_freq=-1,
-        transition_width=-1)
+        cutoff_freq=cutoff_freq,
+        transition_width=transition_width)
+
+
+def _best_decimating_stages(input_rate, total_decimation, protected_freq, cutoff_freq, transition_width):
+    """Return the list of decimating stage designs, with decimations multiplying to total_decimation, which has the least estimated cost."""
+    # Dynamic programming over the decimation remaining to be done; the cheapest way to do the rest does not depend on how we got there.
+    memo = {}
+    
+    def best(remaining, stage_input_rate):
+        """Return (cost per sample at stage_input_rate, stage designs)."""
+        if remaining in memo:
+            return memo[remaining]
+        result = None
+        for decimation in divisors(remaining)[1:]:
+            final = decimation == remaining
+            next_rate = stage_input_rate / decimation
+            stage_type = _FilterPlanFinalDecimatingStage if final else _FilterPlanDecimatingStage
+            design = stage_type(
+                freq_xlating=remaining == total_decimation,
+                decimation=decimation,
+                protected_freq=protected_freq,
+                input_rate=stage_input_rate,
+                output_rate=next_rate)
+            cost = design.estimate_cost(cutoff_freq, transition_width)
+            designs = [design]
+            if not final:
+                rest_cost, rest_designs = best(remaining // decimation, next_rate)
+                cost += rest_cost / decimation
+                designs += rest_designs
+            if result is None or cost < result[0]:
+                result = (cost, designs)
+        memo[remaining] = result
+        return result
     
-    return plan
+    return best(total_decimation, input_rate)[1]
+
+
+# Minimum seconds between retappings of a MultistageChannelFilter for changed parameters; see MultistageChannelFilter.__set_plan.
+_RETAP_INTERVAL = 0.05
 
 
 class MultistageChannelFilter(gr.hier_block2):
@@ -342,11 +564,13 @@ class MultistageChannelFilter(gr.hier_block2):
     
         plan = _make_filter_plan_1(
             input_rate=input_rate,
-            output_rate=output_rate)
-        plan = plan.replace(
+            output_rate=output_rate,
             cutoff_freq=cutoff_freq,
             transition_width=transition_width)
         self.__plan = plan
+        self.__stage_taps = []
+        self.__last_retap_time = None
+        self.__delayed_retap = None
         
         gr.hier_block2.__init__(
             self, str(name),
@@ -361,6 +585,7 @@ class MultistageChannelFilter(gr.hier_block2):
             stage_filter = stage_design.create_block(taps)
             
             self.stages.append(stage_filter)
+            self.__stage_taps.append(taps)
             if stage_filter is not None:
                 self.connect(prev_block, stage_filter)
                 prev_block = stage_filter
@@ -372,24 +597,45 @@ class MultistageChannelFilter(gr.hier_block2):
         assert self.freq_filter_block is not None
         self.freq_filter_block.set_center_freq(center_freq)
     
+    def __set_plan(self, plan):
+        """Switch to plan, which must have the same stage designs as the current plan.
+        
+        Retapping is rate-limited: changes arriving less than _RETAP_INTERVAL after the last retap are collected and applied together at the end of the interval, so that dragging a filter edge in the UI does not redesign the filter for every intermediate value.
+        """
+        self.__plan = plan
+        if self.__delayed_retap is not None:
+            return
+        if reactor.running and self.__last_retap_time is not None:
+            delay = self.__last_retap_time + _RETAP_INTERVAL - reactor.seconds()
+            if delay > 0:
+                self.__delayed_retap = reactor.callLater(delay, self.__do_taps)
+                return
+        self.__do_taps()
+    
     def __do_taps(self):
-        """Re-assign taps for all stages."""
-        # TODO: sanity check types:
-        #   plan has matching stage types
-        #   plan has same decimations
-        for stage_filter, (_stage_design, taps) in zip(self.stages, self.__plan.get_stage_designs_and_taps()):
-            if hasattr(stage_filter, 'set_taps'):
+        """Re-assign taps for the stages whose taps are changed by the current plan."""
+        if self.__delayed_retap is not None:
+            if self.__delayed_retap.active():
+                self.__delayed_retap.cancel()
+            self.__delayed_retap = None
+        self.__last_retap_time = reactor.seconds()
+        for i, (stage_filter, (_stage_design, taps)) in enumerate(zip(self.stages, self.__plan.get_stage_designs_and_taps())):
+            if taps != self.__stage_taps[i]:
                 stage_filter.set_taps(taps)
+                self.__stage_taps[i] = taps
     
     def explain(self):
         """Return a description of the filter design."""
+        if self.__delayed_retap is not None:
+            self.__do_taps()
         stages = self.stages
         stage_designs = self.__plan.get_stage_designs()
-        s = '%s stages from %i to %i' % (
+        s = '%s stages from %i to %i, estimated %.1f MACs per input sample' % (
             # TODO use polymorphism instead
             sum(1 for stage_design in stage_designs if not isinstance(stage_design, _FilterPlanCommentStage)),
             stage_designs[0].input_rate,
-            stage_designs[-1].output_rate)
+            stage_designs[-1].output_rate,
+            self.__plan.get_cost())
         for (stage_filter, stage_design) in zip(stages, stage_designs):
             # TODO once we have pfb converted, stop introspecting on the filter objects and start just using the data from the design
             if hasattr(stage_filter, 'taps'):
@@ -413,16 +659,18 @@ class MultistageChannelFilter(gr.hier_block2):
     
     def set_cutoff_freq(self, value):
         value = float(value)
-        self.__plan = self.__plan.replace(cutoff_freq=value)
-        self.__do_taps()
+        if value == self.__plan.get_cutoff_freq():
+            return
+        self.__set_plan(self.__plan.replace(cutoff_freq=value))
     
     def get_transition_width(self):
         return self.__plan.get_transition_width()
     
     def set_transition_width(self, value):
         value = float(value)
-        self.__plan = self.__plan.replace(transition_width=value)
-        self.__do_taps()
+        if value == self.__plan.get_transition_width():
+            return
+        self.__set_plan(self.__plan.replace(transition_width=value))
     
     def get_center_freq(self):
         return self.freq_filter_block.center_freq()
@@ -441,8 +689,27 @@ class MultistageChannelFilter(gr.hier_block2):
 __all__.append('MultistageChannelFilter')
 
 
+@implementer(ITunableDemodulator)
+class TunableChannelFilterMixin(object):
+    """
+    Makes a demodulator whose input goes first into a MultistageChannelFilter an ITunableDemodulator, by tuning the filter's frequency translation.
+    
+    The receiver then does not need to shift the demodulator's input to zero frequency, which would be a second full-rate multiplication of every sample.
+    
+    channel_filter may also be any other block with a set_center_freq method, such as a block containing a MultistageChannelFilter.
+    """
+    def __init__(self, channel_filter):
+        self.__tuned_channel_filter = channel_filter
+    
+    def set_rec_freq(self, freq):
+        """Implements ITunableDemodulator."""
+        self.__tuned_channel_filter.set_center_freq(freq)
+
+
+__all__.append('TunableChannelFilterMixin')
+
+
 # TODO: Rename for consistency. Document.
-# TODO: Add the ability to memoize/precompute filter taps, particularly because pfb uses optfir internally which is slow. Maybe we can express this using the same 'plan' type as MultistageChannelFilter.
 # TODO: I think there are places where we are _not_ using make_resampler because it didn't have a complex mode before.
 def make_resampler(in_rate, out_rate, complex=False):
     # pylint: disable=redefined-builtin
@@ -466,7 +733,7 @@ def make_resampler(in_rate, out_rate, complex=False):
         return (rational_resampler.rational_resampler_ccf if complex else rational_resampler.rational_resampler_fff)(
             interpolation=interpolation,
             decimation=decimation,
-            taps=firdes.low_pass(
+            taps=_low_pass_taps(
                 interpolation,  # gain compensates for interpolation
                 interpolation,  # rational resampler filter runs at the interpolated rate
                 in_relative_cutoff,
@@ -476,7 +743,7 @@ def make_resampler(in_rate, out_rate, complex=False):
         pfbsize = 32  # TODO: justify magic number (taken from gqrx)
         return (pfb.arb_resampler_ccf if complex else pfb.arb_resampler_fff)(
             resample_ratio,
-            firdes.low_pass(
+            _low_pass_taps(
                 pfbsize,
                 pfbsize,
                 in_relative_cutoff,
@@ -153,13 +153,18 @@ class BusPlumber(object):
         self.__nchannels = nchannels
         self.__channels = xrange(nchannels)
         self.__bus_rate = 0.0
+        # Blocks from the previous connect(), reused where possible so that an incremental reconnect (see FlowgraphEdges) can leave their connections alone.
+        self.__bus_sum = None
+        self.__bus_sum_inputs = 0
+        self.__null_sink = None
+        self.__resamplers = {}
     
     def get_current_rate(self):
         return self.__bus_rate
     
     def connect(self, inputs, outputs):
         """
-        Make all new connections (graph.disconnect_all() must have been done) between inputs and outputs.
+        Make all connections between inputs and outputs, as part of recording a complete set of connections with a FlowgraphEdges.
         
         inputs and outputs must be iterables of (sample_rate, block) tuples.
         """
@@ -180,39 +185,48 @@ class BusPlumber(object):
         elif new_bus_rate != self.__bus_rate:
             self.__bus_rate = new_bus_rate
         
-        # recreated each time because reusing an add_ff w/ different
+        # recreated when the input count changes because reusing an add_ff w/ different
         # input counts fails; TODO: report/fix bug
-        bus_sum = blocks.add_ff(vlen=self.__nchannels)
+        if self.__bus_sum is None or self.__bus_sum_inputs != len(inputs):
+            self.__bus_sum = blocks.add_ff(vlen=self.__nchannels)
+            self.__bus_sum_inputs = len(inputs)
+        bus_sum = self.__bus_sum
+        
+        old_resamplers = self.__resamplers
+        self.__resamplers = {}
         
         in_index = 0
         for in_rate, in_block in inputs:
-            self.__connect_maybe_with_resampler(in_block, in_rate, self.__bus_rate, (bus_sum, in_index))
+            self.__connect_maybe_with_resampler(in_block, in_rate, self.__bus_rate, (bus_sum, in_index), old_resamplers)
             in_index += 1
         
         if in_index > 0:
             # connect output only if there is at least one input
             if len(outputs) > 0:
-                resampler_table = {}
                 for out_rate, out_block in outputs:
-                    self.__connect_maybe_with_resampler(bus_sum, self.__bus_rate, out_rate, out_block, resampler_table=resampler_table)
+                    self.__connect_maybe_with_resampler(bus_sum, self.__bus_rate, out_rate, out_block, old_resamplers)
             else:
                 # gnuradio requires at least one connected output
-                self.__graph.connect(bus_sum, blocks.null_sink(gr.sizeof_float * self.__nchannels))
+                if self.__null_sink is None:
+                    self.__null_sink = blocks.null_sink(gr.sizeof_float * self.__nchannels)
+                self.__graph.connect(bus_sum, self.__null_sink)
     
-    def __connect_maybe_with_resampler(self, in_endpoint, in_rate, out_rate, out_endpoint, resampler_table=None):
+    def __connect_maybe_with_resampler(self, in_endpoint, in_rate, out_rate, out_endpoint, old_resamplers):
         """Connect in_endpoint, a source of vectors of size self.__nchannels, to out_endpoint, inserting per-channel resamplers if needed.
         
-        If resampler_table (a dict) is provided then it is used to record resamplers already created that can be shared. in_endpoint and in_rate are assumed to be the same."""
+        Resamplers are shared among all outputs from the same in_endpoint at the same rate, and reused from old_resamplers (the table from the previous connect()) if present there."""
         if in_rate == out_rate:
             self.__graph.connect(in_endpoint, out_endpoint)
         else:
-            if resampler_table is not None and out_rate in resampler_table:
-                self.__graph.connect(resampler_table[out_rate], out_endpoint)
+            key = (in_endpoint, in_rate, out_rate)
+            if key in self.__resamplers:
+                self.__graph.connect(self.__resamplers[key], out_endpoint)
             else:
-                resampler = VectorResampler(in_rate, out_rate, vlen=self.__nchannels)
+                resampler = old_resamplers.get(key)
+                if resampler is None:
+                    resampler = VectorResampler(in_rate, out_rate, vlen=self.__nchannels)
+                self.__resamplers[key] = resampler
                 self.__graph.connect(in_endpoint, resampler, out_endpoint)
-                if resampler_table is not None:
-                    resampler_table[out_rate] = resampler
 
 
 class AudioQueueSink(gr.hier_block2):
@@ -25,9 +25,12 @@ interface.
 
 from __future__ import absolute_import, division, unicode_literals
 
+from collections import OrderedDict
 import math
 import os
+import time
 
+import numpy
 from zope.interface import Interface, implementer
 
 from gnuradio import gr
@@ -35,9 +38,10 @@ from gnuradio import blocks
 from gnuradio.fft import fft_vfc, fft_vcc, window as windows
 
 from shinysdr.filters import make_resampler
+from shinysdr.gr_ext import safe_delete_head_nowait
 from shinysdr.math import to_dB
 from shinysdr.signals import SignalType
-from shinysdr.types import BulkDataT, EnumT, RangeT
+from shinysdr.types import BulkDataT, EnumRow, EnumT, RangeT
 from shinysdr import units
 from shinysdr.values import ExportedState, InterestTracker, LooseCell, ElementQueueCell, exported_value, setter
 
@@ -64,6 +68,109 @@ class RecursiveLockBlockMixin(object):
             self.unlock()
 
 
+# Apply only the difference between the old and new connections when reconnecting, rather than disconnecting everything and connecting everything again. Turn this off to compare (see shinysdr/test/manual/reconnect_benchmark.py).
+_use_incremental_reconnect = True
+
+
+class FlowgraphEdges(object):
+    """
+    Maintains the connections of a top block, for those which are recomputed from scratch upon any change.
+    
+    Between begin() and apply(), connect() (which takes the same arguments as gr.top_block.connect) records the desired connections; apply() then makes only the changes needed to get from the previously applied connections to the desired ones, and does not lock the flow graph at all if there are none.
+    """
+    def __init__(self, graph):
+        self.__graph = graph
+        # OrderedDicts used as ordered sets of ((block, port), (block, port)) edges
+        self.__current = OrderedDict()
+        self.__current_blocks = frozenset()
+        self.__desired = None
+    
+    def is_empty(self):
+        """Return whether there are currently no connections."""
+        return not self.__current
+    
+    def get_blocks(self):
+        """Return the set of blocks currently connected."""
+        return self.__current_blocks
+    
+    def get_desired_blocks(self):
+        """Return the set of blocks connected so far since begin()."""
+        return _blocks_of(self.__desired)
+    
+    def begin(self):
+        self.__desired = OrderedDict()
+    
+    def connect(self, *endpoints):
+        if len(endpoints) < 2:
+            raise TypeError('connect() needs at least two endpoints')
+        endpoints = [_normalize_endpoint(endpoint) for endpoint in endpoints]
+        for i in xrange(len(endpoints) - 1):
+            self.__desired[(endpoints[i], endpoints[i + 1])] = None
+    
+    def apply(self, lock, unlock):
+        """Make the recorded connections, using lock and unlock (e.g. RecursiveLockBlockMixin's) around any changes.
+        
+        Returns the number of edges connected or disconnected.
+        """
+        graph = self.__graph
+        current = self.__current
+        desired = self.__desired
+        self.__desired = None
+        if _use_incremental_reconnect:
+            to_remove = [edge for edge in current if edge not in desired]
+            to_add = [edge for edge in desired if edge not in current]
+            changed = bool(to_remove or to_add)
+        else:
+            to_remove = list(current)
+            to_add = list(desired)
+            changed = True
+        if changed:
+            lock()
+            try:
+                if _use_incremental_reconnect:
+                    for source, destination in to_remove:
+                        graph.disconnect(source, destination)
+                else:
+                    graph.disconnect_all()
+                for source, destination in to_add:
+                    graph.connect(source, destination)
+            finally:
+                unlock()
+        self.__current = desired
+        self.__current_blocks = _blocks_of(desired)
+        return len(to_remove) + len(to_add)
+    
+    def retract(self, blocks, lock, unlock):
+        """Disconnect all current connections involving any of the given blocks, without waiting for apply().
+        
+        This is for moving blocks into another flow graph, which must not be done while they are still connected in this one.
+        """
+        graph = self.__graph
+        current = self.__current
+        to_remove = [edge for edge in current if edge[0][0] in blocks or edge[1][0] in blocks]
+        if not to_remove:
+            return
+        lock()
+        try:
+            for source, destination in to_remove:
+                graph.disconnect(source, destination)
+                del current[(source, destination)]
+        finally:
+            unlock()
+        self.__current_blocks = _blocks_of(current)
+
+
+def _blocks_of(edges):
+    return frozenset(endpoint[0] for edge in edges for endpoint in edge)
+
+
+def _normalize_endpoint(endpoint):
+    if isinstance(endpoint, tuple):
+        return endpoint
+    else:
+        return (endpoint, 0)
+
+
 class Context(object):
     """
     Client facet for RecursiveLockBlockMixin.
@@ -87,6 +194,67 @@ def make_sink_to_process_stdin(process, itemsize=gr.sizeof_char):
     return blocks.file_descriptor_sink(itemsize, fd_owned_by_sink)
 
 
+# Seconds a PacedMessageSource's queue must be empty before it outputs silence, so that ordinary irregularity in message arrival does not insert gaps.
+_SILENCE_DELAY = 0.1
+# Seconds a PacedMessageSource waits, when it has nothing to output, before checking again.
+_SILENCE_POLL_INTERVAL = 0.01
+
+
+class PacedMessageSource(gr.sync_block):
+    """
+    Like gnuradio.blocks.message_source for float vectors, but when the queue has been empty for a while it outputs zeros (silence) in real time at sample_rate instead of blocking.
+    
+    This allows a block combining several of these (such as an audio sum) to keep running when some of them are not receiving messages.
+    """
+    def __init__(self, channels, queue, sample_rate):
+        gr.sync_block.__init__(
+            self,
+            name=type(self).__name__,
+            in_sig=None,
+            out_sig=[(numpy.float32, channels) if channels > 1 else numpy.float32])
+        self.__channels = channels
+        self.__queue = queue
+        self.__sample_rate = float(sample_rate)
+        self.__leftover = numpy.zeros(0, dtype=numpy.float32)  # of the last message, not yet output
+        self.__time = time.time()  # real time corresponding to the end of the output so far
+        self.__message_time = self.__time  # when a message was last output
+    
+    def work(self, input_items, output_items):
+        channels = self.__channels
+        out_items = output_items[0]
+        out_floats = out_items.reshape(-1)
+        count = 0
+        while count < len(out_items):
+            if not len(self.__leftover):
+                message = safe_delete_head_nowait(self.__queue)
+                if message is None:
+                    break
+                self.__leftover = numpy.frombuffer(message.to_string(), dtype=numpy.float32)
+            take = min(len(self.__leftover) // channels, len(out_items) - count)
+            out_floats[count * channels:(count + take) * channels] = self.__leftover[:take * channels]
+            self.__leftover = self.__leftover[take * channels:]
+            count += take
+        now = time.time()
+        if count:
+            self.__time = self.__message_time = now
+            return count
+        if now - self.__message_time < _SILENCE_DELAY:
+            time.sleep(_SILENCE_POLL_INTERVAL)
+            return 0
+        elapsed = now - self.__time
+        if elapsed > 2 * _SILENCE_DELAY:
+            # e.g. the flow graph was not running; there is no need to make up for all of that time at once
+            self.__time = now - _SILENCE_DELAY
+            elapsed = _SILENCE_DELAY
+        count = min(len(out_items), int(elapsed * self.__sample_rate))
+        if not count:
+            time.sleep(_SILENCE_POLL_INTERVAL)
+            return 0
+        out_items[:count] = 0
+        self.__time += count / self.__sample_rate
+        return count
+
+
 class _NoContext(object):
     def lock(self):
         pass
@@ -95,47 +263,164 @@ class _NoContext(object):
         pass
 
 
+# Maximum number of FFTs per second a MonitorSink computes, whether or not they are integrated into fewer frames.
 _maximum_fft_rate = 500
 
 
-class _OverlappedStreamToVector(gr.hier_block2):
-    """
-    Block which is like gnuradio.blocks.stream_to_vector, but generates vectors which are overlapping segments of the input, multiplying the overall number of samples by a specified factor.
+# numpy types of the stream items _OverlappedStreamToVector handles, by size. Stereo audio is treated as complex, as the FFT does.
+_overlap_item_types = {
+    gr.sizeof_float: numpy.float32,
+    gr.sizeof_gr_complex: numpy.complex64,
+}
+
+
+class _OverlappedStreamToVector(gr.basic_block):
     """
+    Block which is like gnuradio.blocks.stream_to_vector, but generates vectors which are segments of the input starting every hop samples, which overlap if hop is less than size.
     
-    # A disadvantage of our implementation strategy is that, because blocks.interleave does, we will always generate output vectors in bursts (of size = factor) rather than smoothly.
+    Each output vector is copied directly from the input, so the output is smooth rather than in bursts and there is no other copying. Input between vectors is discarded without being copied, so this also serves to decimate to a frame rate.
+    """
     
-    def __init__(self, size, factor, itemsize=gr.sizeof_gr_complex):
+    def __init__(self, size, hop, itemsize=gr.sizeof_gr_complex):
         """
         size: (int) vector size (FFT size) of next block
-        factor: (int) output will have this many more samples than input
-        
-        If size is not divisible by factor, then the output will necessarily have jitter.
+        hop: (int) number of input samples from the start of one output vector to the start of the next
         """
-        size = int(size)
-        factor = int(factor)
-        # assert size % factor == 0
-        offset = size // factor
-
-        gr.hier_block2.__init__(
-            self, type(self).__name__,
-            gr.io_signature(1, 1, itemsize),
-            gr.io_signature(1, 1, itemsize * size),
-        )
-        
-        if factor == 1:
-            # No duplication needed; simplify flowgraph
-            self.connect(self, blocks.stream_to_vector(itemsize, size), self)
+        item_type = _overlap_item_types[itemsize]
+        gr.basic_block.__init__(
+            self,
+            name=type(self).__name__,
+            in_sig=[item_type],
+            out_sig=[(item_type, int(size))])
+        self.__size = int(size)
+        self.__hop = max(1, int(hop))
+        self.__skip = 0  # input samples to discard before the next vector, if hop > size
+    
+    def hop(self):
+        return self.__hop
+    
+    def set_hop(self, hop):
+        self.__hop = max(1, int(hop))
+    
+    def forecast(self, noutput_items, ninput_items_required):
+        if self.__skip:
+            # general_work discards skipped input as it arrives, so only ask for what it can consume now; the skip may be much larger than the input buffer.
+            ninput_items_required[0] = 1
         else:
-            interleave = blocks.interleave(itemsize * size)
-            self.connect(interleave, self)
-        
-            for i in xrange(0, factor):
-                self.connect(
-                    self,
-                    blocks.delay(itemsize, (factor - 1 - i) * offset),
-                    blocks.stream_to_vector(itemsize, size),
-                    (interleave, i))
+            # Enough for one vector; general_work produces as many more as the input allows. Asking for noutput_items vectors would, for a large hop, exceed the input buffer.
+            ninput_items_required[0] = self.__size
+    
+    def general_work(self, input_items, output_items):
+        size = self.__size
+        hop = self.__hop
+        skip = self.__skip
+        in_items = input_items[0]
+        out_items = output_items[0]
+        available = len(in_items) - skip
+        if available < size:
+            # only discarding
+            discard = min(skip, len(in_items))
+            self.__skip -= discard
+            self.consume(0, discard)
+            return 0
+        count = min(len(out_items), (available - size) // hop + 1)
+        (stride,) = in_items.strides
+        out_items[:count] = numpy.lib.stride_tricks.as_strided(
+            in_items[skip:],
+            shape=(count, size),
+            strides=(stride * hop, stride))
+        advance = skip + count * hop
+        consumed = min(advance, len(in_items))
+        self.__skip = advance - consumed
+        self.consume(0, consumed)
+        return count
+
+
+_integration_enum = EnumT({
+    u'none': EnumRow(label=u'None', description=u'Each frame is a single FFT.', sort_key=u'0'),
+    u'average': EnumRow(label=u'Average', description=u'Exponential moving average with a time constant of one frame.', sort_key=u'1'),
+    u'mean': EnumRow(label=u'Mean', description=u'Each frame is the mean of the FFTs since the previous frame.', sort_key=u'2'),
+    u'peak': EnumRow(label=u'Peak hold', description=u'Each frame is the maximum of all FFTs since the spectrum settings or tuning last changed.', sort_key=u'3'),
+    u'min': EnumRow(label=u'Min hold', description=u'Each frame is the minimum of all FFTs since the spectrum settings or tuning last changed.', sort_key=u'4'),
+})
+
+
+class _SpectrumIntegrator(gr.basic_block):
+    """
+    Combines every count input power spectrum vectors into one output vector as specified by mode, which is one of the values of _integration_enum.
+    
+    In 'none' mode count is ignored and the input is passed through. In the hold modes ('peak' and 'min') the result is held across output vectors until reset() is called or the settings change.
+    """
+    
+    def __init__(self, vlen, mode=u'none', count=1):
+        gr.basic_block.__init__(
+            self,
+            name=type(self).__name__,
+            in_sig=[(numpy.float32, int(vlen))],
+            out_sig=[(numpy.float32, int(vlen))])
+        self.__settings = None
+        self.__applied_settings = None
+        self.__resets = 0  # incremented by reset() so that general_work notices
+        self.__accumulator = None
+        self.__accumulated = 0
+        self.set_integration(mode, count)
+    
+    def set_integration(self, mode, count):
+        """Change the mode and count. This is safe to call while the flowgraph is running; the change takes effect with the next vector."""
+        mode = _integration_enum(mode)
+        count = 1 if mode == u'none' else max(1, int(count))
+        # single assignment so that general_work sees consistent settings
+        self.__settings = (mode, count, self.__resets)
+    
+    def reset(self):
+        """Discard accumulated input, such as a held peak. This is safe to call while the flowgraph is running."""
+        self.__resets += 1
+        mode, count, _ = self.__settings
+        self.__settings = (mode, count, self.__resets)
+    
+    def forecast(self, noutput_items, ninput_items_required):
+        # general_work accumulates one vector at a time, so any input is useful; asking for count vectors per output could exceed the input buffer when the vectors are large.
+        ninput_items_required[0] = 1
+    
+    def general_work(self, input_items, output_items):
+        settings = self.__settings
+        if settings != self.__applied_settings:
+            self.__applied_settings = settings
+            self.__accumulator = None
+            self.__accumulated = 0
+        mode, count, _ = settings
+        in_vectors = input_items[0]
+        out_vectors = output_items[0]
+        consumed = 0
+        produced = 0
+        for vector in in_vectors:
+            if produced >= len(out_vectors):
+                break
+            consumed += 1
+            accumulator = self.__accumulator
+            if accumulator is None:
+                accumulator = self.__accumulator = numpy.array(vector)
+            elif mode == u'average':
+                accumulator += (vector - accumulator) * (1 / count)
+            elif mode == u'mean':
+                accumulator += vector
+            elif mode == u'peak':
+                numpy.maximum(accumulator, vector, out=accumulator)
+            elif mode == u'min':
+                numpy.minimum(accumulator, vector, out=accumulator)
+            self.__accumulated += 1
+            if self.__accumulated >= count:
+                if mode == u'mean':
+                    out_vectors[produced] = accumulator * (1 / count)
+                else:
+                    out_vectors[produced] = accumulator
+                produced += 1
+                self.__accumulated = 0
+                if mode == u'mean':
+                    # the moving average and the holds carry over; the mean starts afresh
+                    self.__accumulator = None
+        self.consume(0, consumed)
+        return produced
 
 
 class IMonitor(Interface):
@@ -158,6 +443,105 @@ _window_type_enum = EnumT({
 }, base_type=int)
 
 
+# Number of _SpectrumChains, for different resolutions, a MonitorSink keeps for reuse.
+_SPECTRUM_CHAIN_CACHE_SIZE = 3
+
+
+class _SpectrumChain(gr.hier_block2):
+    """
+    The part of a MonitorSink which depends on the FFT size: takes the input signal and puts spectrum frames in queue.
+    
+    Everything else about the spectrum is set with methods and may be changed while the flowgraph is running.
+    """
+    def __init__(self, itemsize, freq_resolution, analytic, power_offset, queue):
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(1, 1, itemsize),
+            gr.io_signature(0, 0, 0),
+        )
+        
+        if analytic:
+            input_length = freq_resolution
+        else:
+            # use vector_to_streams to cut the output in half and discard the redundant part
+            input_length = freq_resolution * 2
+        self.__input_length = input_length
+        self.__power_offset = power_offset
+        self.__window_power = input_length  # of the rectangular window the FFT is constructed with
+        self.__sample_rate = 1
+        
+        # Only the vectors which will be transformed are assembled; they overlap if the frame rate is high enough.
+        self.__overlapper = _OverlappedStreamToVector(
+            size=input_length,
+            hop=input_length,
+            itemsize=itemsize)
+        
+        # the actual FFT logic, which is similar to GR's logpwrfft_c
+        self.__fft_block = (fft_vcc if itemsize == gr.sizeof_gr_complex else fft_vfc)(
+            fft_size=input_length,
+            forward=True,
+            window=[1.0] * input_length)
+        mag_squared = blocks.complex_to_mag_squared(input_length)
+        # Integration is done on linear power, before the logarithm.
+        self.__integrator = _SpectrumIntegrator(vlen=input_length)
+        logarithmizer = blocks.nlog10_ff(
+            n=10,  # the "deci" in "decibel"
+            vlen=input_length,
+            k=0)
+        # separate from the logarithm because nlog10_ff's constant cannot be changed
+        self.__compensation = blocks.add_const_vff([0.0] * input_length)
+        
+        # It would make slightly more sense to use unsigned chars, but blocks.float_to_uchar does not support vlen.
+        fft_converter = blocks.float_to_char(vlen=freq_resolution, scale=1.0)
+        fft_sink = blocks.message_sink(freq_resolution * gr.sizeof_char, queue, True)
+        
+        self.connect(
+            self,
+            self.__overlapper,
+            self.__fft_block,
+            mag_squared,
+            self.__integrator,
+            logarithmizer,
+            self.__compensation)
+        if analytic:
+            self.connect(self.__compensation, fft_converter, fft_sink)
+        else:
+            after_fft = blocks.vector_to_streams(itemsize=freq_resolution * gr.sizeof_float, nstreams=2)
+            self.connect(self.__compensation, after_fft)
+            self.connect(after_fft, fft_converter, fft_sink)
+            self.connect((after_fft, 1), blocks.null_sink(gr.sizeof_float * freq_resolution))
+    
+    def set_hop(self, hop):
+        self.__overlapper.set_hop(hop)
+    
+    def set_window_type(self, window_type):
+        window = windows.build(window_type, self.__input_length, 6.76)
+        self.__fft_block.set_window(window)
+        self.__window_power = sum(x * x for x in window)
+        self.__update_compensation()
+        # held values were computed with the old window
+        self.__integrator.reset()
+    
+    def set_sample_rate(self, sample_rate):
+        self.__sample_rate = sample_rate
+        self.__update_compensation()
+        self.__integrator.reset()
+    
+    def set_integration(self, mode, count):
+        self.__integrator.set_integration(mode, count)
+    
+    def reset_integration(self):
+        self.__integrator.reset()
+    
+    def __update_compensation(self):
+        k = (
+            -to_dB(self.__window_power) +  # compensate for window
+            -to_dB(self.__sample_rate) +  # convert from power-per-sample to power-per-Hz
+            self.__power_offset  # offset for packing into bytes
+        )
+        self.__compensation.set_k([k] * self.__input_length)
+
+
 @implementer(IMonitor)
 class MonitorSink(gr.hier_block2, ExportedState):
     """Convenience wrapper around all the bits and pieces to display the signal spectrum to the client.
@@ -171,6 +555,8 @@ class MonitorSink(gr.hier_block2, ExportedState):
             time_length=2048,
             window_type=windows.WIN_BLACKMAN_HARRIS,
             frame_rate=30.0,
+            integration=u'none',
+            integration_frames=4,
             input_center_freq=0.0,
             paused=False,
             context=None):
@@ -196,6 +582,8 @@ class MonitorSink(gr.hier_block2, ExportedState):
         self.__time_length = int(time_length)
         self.__window_type = _window_type_enum(window_type)
         self.__frame_rate = float(frame_rate)
+        self.__integration = _integration_enum(integration)
+        self.__integration_frames = int(integration_frames)
         self.__input_center_freq = float(input_center_freq)
         self.__paused = bool(paused)
         
@@ -208,12 +596,14 @@ class MonitorSink(gr.hier_block2, ExportedState):
         self.__fft_queue = gr.msg_queue()
         self.__scope_queue = gr.msg_queue()
         
+        self.__gate = blocks.copy(itemsize)
+        self.__gate.set_enabled(not self.__paused)
+        
         # stuff created by __do_connect
-        self.__gate = None
-        self.__fft_sink = None
-        self.__scope_sink = None
-        self.__frame_dec = None
-        self.__frame_rate_to_decimation_conversion = 0.0
+        self.__chains = OrderedDict()  # (freq_resolution, analytic) -> _SpectrumChain, least recently used first
+        self.__chain = None
+        self.__scope_parameters = None
+        self.__scope_blocks = None
         
         self.__do_connect()
     
@@ -234,67 +624,46 @@ class MonitorSink(gr.hier_block2, ExportedState):
             interest_tracker=self.__interest,
             label='Scope')
 
-    def __do_connect(self):
-        itemsize = self.__itemsize
-        
-        if self.__signal_type.is_analytic():
-            input_length = self.__freq_resolution
-            output_length = self.__freq_resolution
-            self.__after_fft = None
-        else:
-            # use vector_to_streams to cut the output in half and discard the redundant part
-            input_length = self.__freq_resolution * 2
-            output_length = self.__freq_resolution
-            self.__after_fft = blocks.vector_to_streams(itemsize=output_length * gr.sizeof_float, nstreams=2)
-        
-        sample_rate = self.__signal_type.get_sample_rate()
-        overlap_factor = int(math.ceil(_maximum_fft_rate * input_length / sample_rate))
-        # sanity limit -- OverlapGimmick is not free
-        overlap_factor = min(16, overlap_factor)
-        
-        self.__frame_rate_to_decimation_conversion = sample_rate * overlap_factor / input_length
+    def __get_chain(self):
+        """Return the _SpectrumChain for the current resolution, reusing one if possible, and configure it."""
+        key = (self.__freq_resolution, self.__signal_type.is_analytic())
+        chain = self.__chains.pop(key, None)
+        if chain is None:
+            chain = _SpectrumChain(
+                itemsize=self.__itemsize,
+                freq_resolution=self.__freq_resolution,
+                analytic=self.__signal_type.is_analytic(),
+                power_offset=self.__power_offset,
+                queue=self.__fft_queue)
+        self.__chains[key] = chain
+        while len(self.__chains) > _SPECTRUM_CHAIN_CACHE_SIZE:
+            self.__chains.popitem(last=False)
         
-        self.__gate = blocks.copy(itemsize)
-        self.__gate.set_enabled(not self.__paused)
-        
-        overlapper = _OverlappedStreamToVector(
-            size=input_length,
-            factor=overlap_factor,
-            itemsize=itemsize)
-        
-        self.__frame_dec = blocks.keep_one_in_n(
-            itemsize=itemsize * input_length,
-            n=max(1, int(round(self.__frame_rate_to_decimation_conversion / self.__frame_rate))))
-        
-        # the actual FFT logic, which is similar to GR's logpwrfft_c
-        window = windows.build(self.__window_type, input_length, 6.76)
-        window_power = sum(x * x for x in window)
-        # TODO: use fft_vfc when applicable
-        fft_block = (fft_vcc if itemsize == gr.sizeof_gr_complex else fft_vfc)(
-            fft_size=input_length,
-            forward=True,
-            window=window)
-        mag_squared = blocks.complex_to_mag_squared(input_length)
-        logarithmizer = blocks.nlog10_ff(
-            n=10,  # the "deci" in "decibel"
-            vlen=input_length,
-            k=(
-                -to_dB(window_power) +  # compensate for window
-                -to_dB(sample_rate) +  # convert from power-per-sample to power-per-Hz
-                self.__power_offset  # offset for packing into bytes
-            ))
-        
-        # It would make slightly more sense to use unsigned chars, but blocks.float_to_uchar does not support vlen.
-        self.__fft_converter = blocks.float_to_char(vlen=self.__freq_resolution, scale=1.0)
+        chain.set_sample_rate(self.__signal_type.get_sample_rate())
+        chain.set_window_type(self.__window_type)
+        chain.set_hop(self.__hop_for_frame_rate(self.__frame_rate))
+        chain.set_integration(self.__integration, self.__integration_frames)
+        return chain
+    
+    def __do_connect(self):
+        """Update the flowgraph for the current resolution, scope length, and signal type, reconnecting only if needed."""
+        old_chain = self.__chain
+        old_scope_parameters = self.__scope_parameters
+        self.__chain = self.__get_chain()
+        if self.__enable_scope:
+            sample_rate = self.__signal_type.get_sample_rate()
+            self.__scope_parameters = (sample_rate, self.__time_length)
+            if self.__scope_parameters != old_scope_parameters:
+                self.__scope_blocks = (
+                    blocks.stream_to_vector_decimator(
+                        item_size=gr.sizeof_gr_complex,
+                        sample_rate=sample_rate,
+                        vec_rate=self.__frame_rate,  # TODO doesn't need to be coupled
+                        vec_len=self.__time_length),
+                    blocks.message_sink(self.__time_length * gr.sizeof_gr_complex, self.__scope_queue, True))
+        if self.__chain is old_chain and self.__scope_parameters == old_scope_parameters:
+            return
         
-        self.__fft_sink = blocks.message_sink(output_length * gr.sizeof_char, self.__fft_queue, True)
-        self.__scope_sink = blocks.message_sink(self.__time_length * gr.sizeof_gr_complex, self.__scope_queue, True)
-        scope_chunker = blocks.stream_to_vector_decimator(
-            item_size=gr.sizeof_gr_complex,
-            sample_rate=sample_rate,
-            vec_rate=self.__frame_rate,  # TODO doesn't need to be coupled
-            vec_len=self.__time_length)
-
         # connect everything
         self.__context.lock()
         try:
@@ -302,22 +671,9 @@ class MonitorSink(gr.hier_block2, ExportedState):
             self.connect(
                 self,
                 self.__gate,
-                overlapper,
-                self.__frame_dec,
-                fft_block,
-                mag_squared,
-                logarithmizer)
-            if self.__after_fft is not None:
-                self.connect(logarithmizer, self.__after_fft)
-                self.connect(self.__after_fft, self.__fft_converter, self.__fft_sink)
-                self.connect((self.__after_fft, 1), blocks.null_sink(gr.sizeof_float * self.__freq_resolution))
-            else:
-                self.connect(logarithmizer, self.__fft_converter, self.__fft_sink)
+                self.__chain)
             if self.__enable_scope:
-                self.connect(
-                    self.__gate,
-                    scope_chunker,
-                    self.__scope_sink)
+                self.connect(self.__gate, *self.__scope_blocks)
         finally:
             self.__context.unlock()
     
@@ -339,7 +695,6 @@ class MonitorSink(gr.hier_block2, ExportedState):
     
     # non-exported
     def set_signal_type(self, value):
-        # TODO: don't rebuild if the rate did not change and the spectrum-sidedness of the type did not change
         assert self.__signal_type.compatible_items(value)
         self.__signal_type = value
         self.__do_connect()
@@ -347,7 +702,11 @@ class MonitorSink(gr.hier_block2, ExportedState):
     
     # non-exported
     def set_input_center_freq(self, value):
-        self.__input_center_freq = float(value) 
+        value = float(value)
+        if value != self.__input_center_freq:
+            # a held spectrum would show signals at the wrong frequencies
+            self.__chain.reset_integration()
+        self.__input_center_freq = value
     
     @exported_value(
         type=RangeT([(2, 4096)], logarithmic=True, integer=True),
@@ -381,9 +740,8 @@ class MonitorSink(gr.hier_block2, ExportedState):
     
     @setter
     def set_window_type(self, value):
-        self.__window_type = value
-        # Updating window requires a reconnect because the nlog10 block does not allow changing its parameters. This could be fixed by using a separate regular add block.
-        self.__do_connect()
+        self.__window_type = _window_type_enum(value)
+        self.__chain.set_window_type(self.__window_type)
 
     @exported_value(
         type=RangeT([(1, _maximum_fft_rate)],
@@ -398,10 +756,50 @@ class MonitorSink(gr.hier_block2, ExportedState):
 
     @setter
     def set_frame_rate(self, value):
-        n = int(round(self.__frame_rate_to_decimation_conversion / value))
-        self.__frame_dec.set_n(n)
+        hop = self.__hop_for_frame_rate(value)
+        self.__chain.set_hop(hop)
         # derive effective value by calculating inverse
-        self.__frame_rate = self.__frame_rate_to_decimation_conversion / n
+        self.__frame_rate = self.__signal_type.get_sample_rate() / (hop * self.__ffts_per_frame())
+    
+    def __ffts_per_frame(self):
+        return 1 if self.__integration == u'none' else self.__integration_frames
+    
+    def __hop_for_frame_rate(self, frame_rate):
+        sample_rate = self.__signal_type.get_sample_rate()
+        # limit the FFT rate, which integration multiplies, rather than only the frame rate
+        minimum_hop = max(1, int(math.ceil(sample_rate / _maximum_fft_rate)))
+        return max(minimum_hop, int(round(sample_rate / (frame_rate * self.__ffts_per_frame()))))
+    
+    @exported_value(
+        type=_integration_enum,
+        changes='this_setter',
+        label='Integration',
+        description='How successive FFTs are combined into each frame sent.')
+    def get_integration(self):
+        return self.__integration
+    
+    @setter
+    def set_integration(self, value):
+        self.__integration = _integration_enum(value)
+        self.__update_integration()
+    
+    @exported_value(
+        type=RangeT([(1, 64)], logarithmic=True, integer=True),
+        changes='this_setter',
+        label='Integrated FFTs',
+        description='Number of FFTs combined into each frame sent, if integrating.')
+    def get_integration_frames(self):
+        return self.__integration_frames
+    
+    @setter
+    def set_integration_frames(self, value):
+        self.__integration_frames = int(value)
+        self.__update_integration()
+    
+    def __update_integration(self):
+        self.__chain.set_integration(self.__integration, self.__integration_frames)
+        # keep the same frame rate, with more or fewer FFTs per frame
+        self.set_frame_rate(self.__frame_rate)
     
     @exported_value(type=bool, changes='this_setter', label='Pause')
     def get_paused(self):
@@ -0,0 +1,272 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shared front-end filtering of a device's signal for receivers.
+
+Instead of each receiver filtering and decimating the device's full-rate signal itself, a ChannelizerBank splits it into evenly spaced, overlapping channels once, and each receiver whose demodulator is narrow enough takes the channel nearest its frequency as input. The cost of an additional such receiver is then independent of the device's sample rate.
+
+Receivers too wide for a channel are instead grouped by frequency, and each group shares a SubbandFilter which performs the first, full-rate, translation and decimation that each receiver's own filter would otherwise do.
+
+This module is not an external API and not guaranteed to have a stable
+interface.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+from gnuradio import gr
+from gnuradio import blocks
+from gnuradio import filter as grfilter  # don't shadow builtin
+from gnuradio.filter import firdes
+from gnuradio.filter import pfb
+
+
+# Set to False to give every receiver the device's full-rate signal, as before channelizers existed.
+_use_channelizer = True
+# Likewise for subband filters.
+_use_subbands = True
+
+_CHANNEL_SPACING = 50e3
+# Each channel's sample rate is this multiple of the spacing, so that channels overlap and any frequency is well inside some channel.
+_OVERSAMPLE = 2
+# Fraction of the spacing, on each side of the channel center, which is free of aliasing.
+_CLEAN_FRACTION = 0.8
+# Below this many channels, a receiver's own filter is cheap enough that there is no point.
+_MIN_CHANNELS = 8
+# Subbands are decimated from the device rate by an integer factor to no lower than this rate, which is well above any channel's, so that fairly wide receivers fit and nearby receivers can share a subband.
+_MIN_SUBBAND_RATE = 500e3
+
+
+class ChannelPlan(object):
+    """Describes how a ChannelizerBank divides its input into channels.
+
+    Channel i is centered at i times the channel spacing relative to the input's center frequency, with the upper half of the channel numbers being negative frequencies as usual for FFTs.
+    """
+    def __init__(self, input_rate, channel_count):
+        if channel_count % _OVERSAMPLE != 0:
+            raise ValueError('channel_count (%s) must be a multiple of %s' % (channel_count, _OVERSAMPLE))
+        self.__input_rate = input_rate
+        self.__channel_count = channel_count
+
+    def __eq__(self, other):
+        return (
+            type(self) == type(other) and
+            self.__input_rate == other.__input_rate and
+            self.__channel_count == other.__channel_count)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}(input_rate={1!r}, channel_count={2!r})'.format(type(self).__name__, self.__input_rate, self.__channel_count)
+
+    def get_input_rate(self):
+        return self.__input_rate
+
+    def get_channel_count(self):
+        return self.__channel_count
+
+    def get_channel_spacing(self):
+        return self.__input_rate / self.__channel_count
+
+    def get_output_rate(self):
+        return self.get_channel_spacing() * _OVERSAMPLE
+
+    def get_usable_half_bandwidth(self):
+        """Return how far from its own frequency a receiver's signal may extend and still be within the alias-free part of the channel used for it, whatever that frequency is."""
+        # A receiver may be up to half a spacing away from the center of its channel.
+        return self.get_channel_spacing() * (_CLEAN_FRACTION - 0.5)
+
+    def locate(self, freq_relative):
+        """Return (channel, offset) where channel is the channel to use for a receiver at freq_relative (relative to the input's center frequency) and offset is the receiver's frequency relative to that channel's center."""
+        spacing = self.get_channel_spacing()
+        signed_channel = int(round(freq_relative / spacing))
+        return signed_channel % self.__channel_count, freq_relative - signed_channel * spacing
+
+    def fits(self, band_shape):
+        """Return whether a demodulator with the given shinysdr.interfaces.BandShape can use a channel of this plan as its input."""
+        return max(-band_shape.stop_low, band_shape.stop_high) <= self.get_usable_half_bandwidth()
+
+
+def plan_channels(input_rate):
+    """Return the ChannelPlan to use for a device with the given sample rate, or None if it should not be channelized."""
+    if not _use_channelizer:
+        return None
+    channel_count = int(round(input_rate / _CHANNEL_SPACING / _OVERSAMPLE)) * _OVERSAMPLE
+    if channel_count < _MIN_CHANNELS:
+        return None
+    return ChannelPlan(input_rate=input_rate, channel_count=channel_count)
+
+
+class ChannelizerBank(gr.hier_block2):
+    """
+    Splits its input into the channels described by a ChannelPlan, one per output port.
+
+    All outputs must be connected; use connect_outputs to do so.
+    """
+    def __init__(self, plan):
+        channel_count = plan.get_channel_count()
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(channel_count, channel_count, gr.sizeof_gr_complex))
+        self.__plan = plan
+
+        spacing = plan.get_channel_spacing()
+        taps = firdes.low_pass(
+            1.0,
+            plan.get_input_rate(),
+            spacing * (_CLEAN_FRACTION + 1) / 2,
+            spacing * (1 - _CLEAN_FRACTION),
+            firdes.WIN_HAMMING)
+        channelizer = pfb.channelizer_ccf(channel_count, taps, _OVERSAMPLE)
+        self.connect(self, channelizer)
+        for i in xrange(channel_count):
+            self.connect((channelizer, i), (self, i))
+
+        # outside consumers for channels nobody is using
+        self.__null_sinks = [blocks.null_sink(gr.sizeof_gr_complex) for _ in xrange(channel_count)]
+
+    def get_plan(self):
+        return self.__plan
+
+    def connect_outputs(self, graph, consumers):
+        """Connect the outputs of this block in graph (a gr.top_block or FlowgraphEdges).
+
+        consumers is a dict from channel numbers to lists of endpoints to connect to that channel's output.
+        """
+        for i in xrange(self.__plan.get_channel_count()):
+            endpoints = consumers.get(i)
+            if endpoints:
+                for endpoint in endpoints:
+                    graph.connect((self, i), endpoint)
+            else:
+                graph.connect((self, i), self.__null_sinks[i])
+
+
+class SubbandPlan(object):
+    """Describes the decimation and usable bandwidth of a device's SubbandFilters."""
+    def __init__(self, input_rate, decimation):
+        self.__input_rate = input_rate
+        self.__decimation = int(decimation)
+
+    def __eq__(self, other):
+        return (
+            type(self) == type(other) and
+            self.__input_rate == other.__input_rate and
+            self.__decimation == other.__decimation)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{0}(input_rate={1!r}, decimation={2!r})'.format(type(self).__name__, self.__input_rate, self.__decimation)
+
+    def get_input_rate(self):
+        return self.__input_rate
+
+    def get_decimation(self):
+        return self.__decimation
+
+    def get_output_rate(self):
+        return self.__input_rate / self.__decimation
+
+    def get_usable_half_bandwidth(self):
+        """Return how far from the subband's center frequency signals are free of aliasing."""
+        return self.get_output_rate() / 2 * _CLEAN_FRACTION
+
+    def fits(self, band_shape):
+        """Return whether a demodulator with the given shinysdr.interfaces.BandShape can use a subband of this plan as its input (when it is centered appropriately)."""
+        return band_shape.stop_high - band_shape.stop_low <= 2 * self.get_usable_half_bandwidth()
+
+    def fits_at(self, offset, band_shape):
+        """Return whether a demodulator with the given band shape, tuned to offset from a subband's center, is within the usable part of the subband."""
+        half = self.get_usable_half_bandwidth()
+        return -half <= offset + band_shape.stop_low and offset + band_shape.stop_high <= half
+
+    def group(self, receivers):
+        """Divide receivers among as few subbands as possible.
+
+        receivers is a list of (freq_relative, band_shape, value) tuples; the result is a list of (subband center frequency, list of values) tuples. Frequencies are relative to the input's center frequency.
+        """
+        # Greedy in order of frequency; subbands are wide compared to receivers, so this is not far from optimal.
+        width = 2 * self.get_usable_half_bandwidth()
+        groups = []
+        low = high = None
+        values = None
+        for freq, band_shape, value in sorted(receivers, key=lambda r: r[0]):
+            r_low = freq + band_shape.stop_low
+            r_high = freq + band_shape.stop_high
+            if values is not None and max(high, r_high) - low <= width:
+                high = max(high, r_high)
+                values.append(value)
+            else:
+                if values is not None:
+                    groups.append(((low + high) / 2, values))
+                low, high = r_low, r_high
+                values = [value]
+        if values is not None:
+            groups.append(((low + high) / 2, values))
+        return groups
+
+
+def plan_subbands(input_rate):
+    """Return the SubbandPlan to use for a device with the given sample rate, or None if it should not use subbands."""
+    if not _use_subbands:
+        return None
+    decimation = int(input_rate // _MIN_SUBBAND_RATE)
+    if decimation < 2:
+        return None
+    return SubbandPlan(input_rate=input_rate, decimation=decimation)
+
+
+class SubbandFilter(gr.hier_block2):
+    """Translates and decimates its input to one subband as described by a SubbandPlan."""
+    def __init__(self, plan, center_freq=0.0):
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(1, 1, gr.sizeof_gr_complex))
+        self.__plan = plan
+
+        half = plan.get_usable_half_bandwidth()
+        nyquist = plan.get_output_rate() / 2
+        taps = firdes.low_pass(
+            1.0,
+            plan.get_input_rate(),
+            (half + nyquist) / 2,
+            nyquist - half,
+            firdes.WIN_HAMMING)
+        self.__filter = grfilter.freq_xlating_fir_filter_ccc(
+            plan.get_decimation(),
+            taps,
+            center_freq,
+            plan.get_input_rate())
+        self.connect(self, self.__filter, self)
+
+    def get_plan(self):
+        return self.__plan
+
+    def get_center_freq(self):
+        return self.__filter.center_freq()
+
+    def set_center_freq(self, freq):
+        self.__filter.set_center_freq(freq)
@@ -58,6 +58,24 @@ def factorize(n):
 __all__.append('factorize')
 
 
+def divisors(n):
+    """
+    Return a list of all positive integers which divide an integer, in ascending order.
+    """
+    result = [1]
+    for prime in set(factorize(n)):
+        power = 1
+        powers = []
+        while n % (power * prime) == 0:
+            power *= prime
+            powers.append(power)
+        result = [d * p for d in result for p in [1] + powers]
+    return sorted(result)
+
+
+__all__.append('divisors')
+
+
 # pylint: disable=inconsistent-return-statements
 # (apparent false positive)
 def small_factor_at_least(n, limit, _force_approx=False):
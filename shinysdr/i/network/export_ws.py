@@ -19,27 +19,42 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from collections import OrderedDict, namedtuple
 import json
 import struct
 import time
 import urllib
+import zlib
 
 from twisted.internet import reactor as the_reactor  # TODO fix
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol
 from twisted.python import log
 from zope.interface import implementer, providedBy
 
 from gnuradio import gr
+import numpy
 
 from shinysdr.i.json import serialize
 from shinysdr.i.network.base import CAP_OBJECT_PATH_ELEMENT
 from shinysdr.signals import SignalType
-from shinysdr.types import BulkDataT, ReferenceT
-from shinysdr.values import BaseCell, ExportedState, IDeltaSubscriber, PollingCell
+from shinysdr.types import BulkDataElement, BulkDataT, ReferenceT
+from shinysdr.values import BaseCell, ExportedState, IDeltaSubscriber, IPausableSubscriber, PollingCell
 
 
 _NOT_A_VALUE = object()
 
+# Binary state stream messages are "frames" consisting of a sequence of records. Each record is a little-endian uint32 byte length followed by that many bytes; the first 4 bytes of the record are a little-endian uint32 serial identifying the cell, and the rest is the BulkDataT-packed element. A record whose serial is _JSON_RECORD_SERIAL instead contains a UTF-8 JSON array of ordinary (text) messages, which are to be processed in order with the other records.
+_RECORD_HEADER = struct.Struct(b'<II')
+_JSON_RECORD_SERIAL = 0xFFFFFFFF
+
+# If the client has requested the 'delta-deflate' bulk encoding, then binary frames are instead sent as the 4 bytes of _COMPRESSED_FRAME_MARKER followed by the zlib-compressed frame, and the element part of each bulk data record begins with a flag byte: _LITERAL_ELEMENT if the rest is the element as usual, or _DELTA_ELEMENT if the rest is the bytewise difference (modulo 256) between the element and the previous element sent for the same cell, which will be of the same length.
+_COMPRESSED_FRAME_MARKER = struct.pack(b'<I', 0xFFFFFFFE)
+_LITERAL_ELEMENT = b'\x00'
+_DELTA_ELEMENT = b'\x01'
+_DEFLATE_LEVEL = 1  # see shinysdr/test/manual/spectrum_compression_benchmark.py
+_BULK_ENCODINGS = frozenset([None, 'delta-deflate'])
+
 
 class _StateStreamObjectRegistration(object):
     # TODO messy
@@ -51,9 +66,11 @@ class _StateStreamObjectRegistration(object):
         self.__previous_references = []
         self.__previous_value_message = _NOT_A_VALUE
         self.__dead = False
+        self.__clock = subscription_context.reactor
+        self.__bulk_view = None
         if isinstance(obj, BaseCell):
             self.__obj_is_cell = True
-            subscriber = _StateStreamSubscriber(self.__listen_cell, self.__listen_cell_patch)
+            subscriber = _StateStreamSubscriber(self.__listen_cell, self.__listen_cell_patch, ssi.is_flow_paused)
             initial_value, self.__subscription = obj.subscribe2(subscriber, subscription_context)
         elif isinstance(obj, ExportedState):
             self.__obj_is_cell = False
@@ -70,16 +87,16 @@ class _StateStreamObjectRegistration(object):
             if isinstance(obj, BaseCell):
                 if obj.type().is_reference():
                     # TODO refactor so we can send a reference as the initial value and do the right things
-                    ssi._send1(False, ('register_cell', serial, url, obj.description(), None))
+                    ssi._send1(('register_cell', serial, url, obj.description(), None))
                     self.__listen_cell(initial_value)
                 else:
-                    ssi._send1(False, ('register_cell', serial, url, obj.description(), initial_value))
+                    ssi._send1(('register_cell', serial, url, obj.description(), initial_value))
             elif isinstance(obj, ExportedState):
-                ssi._send1(False, ('register_block', serial, url, _get_interfaces(obj)))
+                ssi._send1(('register_block', serial, url, _get_interfaces(obj)))
                 self.__listen_state(initial_value)
             else:
                 # TODO: not implemented on client (but shouldn't happen)
-                ssi._send1(False, ('register', serial, url))
+                ssi._send1(('register', serial, url))
     
     def __str__(self):
         return self.url
@@ -102,6 +119,36 @@ class _StateStreamObjectRegistration(object):
             raise Exception('This object is not a cell')
         return self.obj
     
+    def set_bulk_view(self, max_rate, max_bins):
+        """Limit the rate and size of elements sent for this BulkDataT cell. None means no limit."""
+        if not self.__obj_is_cell or not isinstance(self.obj.type(), BulkDataT):
+            raise ValueError('This object is not a bulk data cell')
+        if max_rate is None and max_bins is None:
+            new_view = None
+        else:
+            new_view = _BulkDataView(self.__clock, self.__send_bulk_elements, max_rate=max_rate, max_bins=max_bins)
+        self.__close_bulk_view()
+        self.__bulk_view = new_view
+    
+    def __close_bulk_view(self):
+        if self.__bulk_view is not None:
+            self.__bulk_view.close()
+    
+    def __send_bulk(self, value_type, elements):
+        view = self.__bulk_view
+        if view is not None:
+            elements = view.select(elements)
+        self.__send_bulk_elements(elements)
+    
+    def __send_bulk_elements(self, elements):
+        if self.__dead:
+            return
+        view = self.__bulk_view
+        max_bins = None if view is None else view.max_bins
+        value_type = self.obj.type()
+        for bulk in elements:
+            self.__ssi._send_bulk(self.serial, _shared_bulk_encoder.pack(value_type, bulk, max_bins))
+    
     def __listen_cell(self, value):
         if self.__dead:
             return
@@ -110,9 +157,7 @@ class _StateStreamObjectRegistration(object):
             self.__ssi._lookup_or_register(value, self.url)
             self.__send_references_and_update_refcount({u'value': value}, True)
         elif isinstance(value_type, BulkDataT):
-            for bulk in value:
-                # TODO fix private ref to _send1
-                self.__ssi._send1(True, struct.pack('I', self.serial) + value_type.pack(bulk))
+            self.__send_bulk(value_type, value)
         else:
             assert not self.__previous_references  # shouldn't happen, could be handled but unimplemented
             self.__send_value_message(value)
@@ -124,11 +169,9 @@ class _StateStreamObjectRegistration(object):
         if value_type.is_reference():
             raise NotImplementedError()  # shouldn't happen
         elif isinstance(value_type, BulkDataT):
-            for bulk in patch:
-                # TODO fix private ref to _send1
-                self.__ssi._send1(True, struct.pack('I', self.serial) + value_type.pack(bulk))
+            self.__send_bulk(value_type, patch)
         else:
-            self.__ssi._send1(False, (u'value_append', self.serial, patch))
+            self.__ssi._send1((u'value_append', self.serial, patch))
             self.__previous_value_message = _NOT_A_VALUE
     
     def __listen_state(self, state):
@@ -169,12 +212,13 @@ class _StateStreamObjectRegistration(object):
         if self.__previous_value_message == payload:
             return
         self.__previous_value_message = payload
-        self.__ssi._send1(False, ('value', self.serial, payload))
+        self.__ssi._send1(('value', self.serial, payload))
     
     def drop(self):
         # TODO this should go away in refcount world
         if self.__subscription is not None:
             self.__subscription.unsubscribe()
+        self.__close_bulk_view()
     
     def inc_refcount(self):
         if self.__dead:
@@ -187,6 +231,7 @@ class _StateStreamObjectRegistration(object):
         self.__refcount -= 1
         if self.__refcount == 0:
             self.__dead = True
+            self.__close_bulk_view()
             self.__ssi.do_delete(self)
             
             # capture refs to decrement
@@ -201,11 +246,127 @@ class _StateStreamObjectRegistration(object):
                 self.__ssi._registered_objs[obj].dec_refcount_and_maybe_notify()
 
 
-@implementer(IDeltaSubscriber)
+class _BulkDataView(object):
+    """A connection's view of a BulkDataT cell, with a limited frame rate and number of bins per element.
+    
+    This lets clients with less bandwidth or a smaller display receive less data without changing what the cell itself produces for other clients.
+    
+    Of elements arriving faster than max_rate, only the latest is sent, when the rate allows; the others are dropped.
+    """
+    def __init__(self, clock, send, max_rate=None, max_bins=None):
+        """send: called with a list of elements held back by select() when it is time to send them."""
+        self.__clock = clock
+        self.__send = send
+        self.__held = None
+        self.__flush_call = None
+        if max_rate is not None:
+            max_rate = float(max_rate)
+            if not max_rate > 0:
+                raise ValueError('max_rate must be positive')
+        self.__interval = 1.0 / max_rate if max_rate is not None else 0.0
+        self.__next_time = None
+        self.max_bins = int(max_bins) if max_bins is not None else None
+        if self.max_bins is not None and self.max_bins < 1:
+            raise ValueError('max_bins must be at least 1')
+    
+    def select(self, elements):
+        """Return the elements which should be sent now from a newly arrived batch.
+        
+        If it is too soon to send any, the latest is held and given to send when it is time, unless a newer one is sent first. This way the client is not left with a stale element when the cell stops producing.
+        """
+        interval = self.__interval
+        if not interval or not elements:
+            return elements
+        now = self.__clock.seconds()
+        next_time = self.__next_time
+        if next_time is not None and now < next_time:
+            self.__held = elements[-1]
+            if self.__flush_call is None:
+                self.__flush_call = self.__clock.callLater(next_time - now, self.__flush)
+            return []
+        self.close()
+        self.__advance(now)
+        # Only the latest element is of interest.
+        return elements[-1:]
+    
+    def close(self):
+        """Discard any held element."""
+        if self.__flush_call is not None:
+            self.__flush_call.cancel()
+            self.__flush_call = None
+        self.__held = None
+    
+    def __advance(self, now):
+        next_time = self.__next_time
+        interval = self.__interval
+        if next_time is None or next_time + interval < now:
+            # First frame, or we have fallen behind (e.g. the cell is producing slower than our limit); don't try to catch up.
+            self.__next_time = now + interval
+        else:
+            self.__next_time = next_time + interval
+    
+    def __flush(self):
+        self.__flush_call = None
+        element = self.__held
+        self.__held = None
+        self.__advance(self.__clock.seconds())
+        self.__send([element])
+
+
+def _max_pool_element(value_type, element, max_bins):
+    """Reduce the array data of a BulkDataElement to at most max_bins items by taking the maximum of each group of adjacent items.
+    
+    The maximum is used so that narrow signals in a spectrum remain visible.
+    """
+    data = numpy.frombuffer(element.data, dtype=numpy.dtype(value_type.get_array_format()))
+    count = len(data)
+    if count <= max_bins:
+        return element
+    factor = -(-count // max_bins)  # ceiling division
+    padded_count = -(-count // factor) * factor
+    if padded_count != count:
+        # Repeating the last item does not change the maximum of the last group.
+        data = numpy.pad(data, (0, padded_count - count), 'edge')
+    pooled = data.reshape(-1, factor).max(axis=1)
+    return BulkDataElement(info=element.info, data=pooled.tostring())
+
+
+class _SharedBulkEncoder(object):
+    """Packs BulkDataElements for the state stream, sharing the results among all connections.
+    
+    Every subscriber to a cell such as MonitorSink's 'fft' is given the same BulkDataElement objects, so remembering the most recently packed elements means that each element is packed once no matter how many clients are watching; each connection then only adds its own record header.
+    """
+    def __init__(self, capacity=256):
+        self.__capacity = capacity
+        # (id(element), max_bins) -> (element, value_type, packed). The element is retained so that its id is not reused while it is in the cache.
+        self.__cache = OrderedDict()
+    
+    def pack(self, value_type, element, max_bins=None):
+        """Pack element, first reducing it to max_bins bins if not None (see _max_pool_element)."""
+        key = (id(element), max_bins)
+        entry = self.__cache.get(key)
+        if entry is not None and entry[0] is element and entry[1] is value_type:
+            return entry[2]
+        if max_bins is None:
+            packed = value_type.pack(element)
+        else:
+            packed = value_type.pack(_max_pool_element(value_type, element, max_bins))
+        self.__cache[key] = (element, value_type, packed)
+        if len(self.__cache) > self.__capacity:
+            # Elements are requested by all connections within the reactor turn they were delivered in, so discarding the oldest is sufficient.
+            self.__cache.popitem(last=False)
+        return packed
+
+
+_shared_bulk_encoder = _SharedBulkEncoder()
+
+
+@implementer(IDeltaSubscriber, IPausableSubscriber)
 class _StateStreamSubscriber(object):
-    def __init__(self, handle_value, handle_append):
+    def __init__(self, handle_value, handle_append, is_paused):
         self.__handle_value = handle_value
         self.__handle_append = handle_append
+        self.is_paused = is_paused
     
     def __call__(self, value):
         self.__handle_value(value)
@@ -230,6 +391,10 @@ class StateStreamInner(object):
         self.__registered_serials = {root_registration.serial: root_registration}
         self._send_batch = []
         self.__batch_delay = None
+        self.__flow_paused = False
+        self.__held_bulk = OrderedDict()  # serial -> _BulkRecord
+        self.__bulk_encoding = None
+        self.__previous_bulk = {}  # serial -> packed element last sent, for delta encoding
         self.__root_url = root_url
         root_registration.force_send_current_value()
     
@@ -250,10 +415,27 @@ class StateStreamInner(object):
             t0 = time.time()
             cell.set(value)
             registration.force_send_current_value()
-            self._send1(False, ['done', message_id])
+            self._send1(['done', message_id])
             t1 = time.time()
             # TODO: Define self.__str__ or similar such that we can easily log which client is sending the command
             log.msg('set %s to %r (%1.2fs)' % (registration, value, t1 - t0))
+        elif op == 'bulk_view':
+            op, serial, max_rate, max_bins = command
+            registration = self.__registered_serials.get(serial)
+            if registration is None:
+                log.msg('bulk_view for unknown serial received: %r' % (command,))
+            else:
+                try:
+                    registration.set_bulk_view(max_rate, max_bins)
+                except (TypeError, ValueError) as e:
+                    log.msg('Invalid bulk_view received: %r (%s)' % (command, e))
+        elif op == 'bulk_encoding':
+            op, encoding = command
+            if encoding not in _BULK_ENCODINGS:
+                log.msg('Unknown bulk encoding received: %r' % (command,))
+            else:
+                self.__bulk_encoding = encoding
+                self.__previous_bulk.clear()
         else:
             log.msg('Unrecognized state stream op received: %r' % (command,))
     
@@ -261,8 +443,22 @@ class StateStreamInner(object):
         """Accessor for implementing self._cell."""
         return self.__root_object
     
+    def set_flow_paused(self, paused):
+        """Stop or resume sending bulk data, as the transport is or is not keeping up.
+        
+        While paused, bulk data (e.g. spectrum frames) is coalesced so that only the latest element for each cell will be sent once resumed. Other messages continue to be sent normally, so that the client's view of the state stays current, except that continuously changing cells are not polled on our behalf until resumed.
+        """
+        self.__flow_paused = bool(paused)
+        if not paused and self.__held_bulk:
+            self.__schedule_flush()
+    
+    def is_flow_paused(self):
+        return self.__flow_paused
+    
     def do_delete(self, reg):
-        self._send1(False, ('delete', reg.serial))
+        self.__held_bulk.pop(reg.serial, None)
+        self.__previous_bulk.pop(reg.serial, None)
+        self._send1(('delete', reg.serial))
         self.__drop(reg.obj)
     
     def __drop(self, obj):
@@ -284,22 +480,97 @@ class StateStreamInner(object):
     
     def _flush(self):  # exposed for testing
         self.__batch_delay = None
-        if len(self._send_batch) > 0:
-            # unicode() because JSONEncoder does not reliably return a unicode rather than str object
-            self._send(unicode(serialize(self._send_batch)))
-            self._send_batch = []
-    
-    def _send1(self, binary, value):
-        if binary:
-            # preserve order by flushing stored non-binary msgs
-            # TODO: Implement batching for binary messages.
-            self._flush()
-            self._send(value)
+        batch = self._send_batch
+        self._send_batch = []
+        held_bulk = self.__held_bulk
+        if self.__flow_paused:
+            # Keep only the latest bulk element for each cell.
+            unheld = []
+            for item in batch:
+                if isinstance(item, _BulkRecord):
+                    held_bulk.pop(item.serial, None)  # move to end, preserving order of arrival
+                    held_bulk[item.serial] = item
+                else:
+                    unheld.append(item)
+            batch = unheld
+        elif held_bulk:
+            batch = held_bulk.values() + batch
+            held_bulk.clear()
+        
+        if len(batch) > 0:
+            if any(isinstance(item, _BulkRecord) for item in batch):
+                if self.__bulk_encoding == 'delta-deflate':
+                    self._send(_COMPRESSED_FRAME_MARKER + zlib.compress(
+                        _encode_frame(self.__delta_encode(batch)),
+                        _DEFLATE_LEVEL))
+                else:
+                    self._send(_encode_frame(batch))
+            else:
+                # unicode() because JSONEncoder does not reliably return a unicode rather than str object
+                self._send(unicode(serialize(batch)))
+    
+    def __delta_encode(self, batch):
+        previous_bulk = self.__previous_bulk
+        encoded = []
+        for item in batch:
+            if isinstance(item, _BulkRecord):
+                previous = previous_bulk.get(item.serial)
+                previous_bulk[item.serial] = item.packed
+                item = _BulkRecord(item.serial, _delta_encode_element(previous, item.packed))
+            encoded.append(item)
+        return encoded
+    
+    def _send1(self, value):
+        # Messages are batched in order to increase client-side efficiency since each incoming WebSocket message is always a separate JS event.
+        self._send_batch.append(value)
+        self.__schedule_flush()
+    
+    def _send_bulk(self, serial, packed_element):
+        """Send a BulkDataT-packed element for the cell with the given serial.
+        
+        Bulk elements are batched together with the other messages of the same reactor turn into a single binary frame (see _encode_frame).
+        """
+        self._send_batch.append(_BulkRecord(serial, packed_element))
+        self.__schedule_flush()
+    
+    def __schedule_flush(self):
+        if not (self.__batch_delay is not None and self.__batch_delay.active()):
+            self.__batch_delay = self.__subscription_context.reactor.callLater(0, self._flush)
+
+
+class _BulkRecord(namedtuple('_BulkRecord', ['serial', 'packed'])):
+    """A packed bulk data element queued for sending as part of a binary frame."""
+
+
+def _delta_encode_element(previous, packed):
+    """Encode a packed element relative to the previous one for the same cell, as described at _COMPRESSED_FRAME_MARKER."""
+    if previous is None or len(previous) != len(packed):
+        return _LITERAL_ELEMENT + packed
+    difference = numpy.frombuffer(packed, dtype=numpy.uint8) - numpy.frombuffer(previous, dtype=numpy.uint8)
+    return _DELTA_ELEMENT + difference.tostring()
+
+
+def _encode_frame(batch):
+    """Encode a list of JSON messages and _BulkRecords, preserving their order, as a binary frame."""
+    chunks = []
+    json_run = []
+    
+    def flush_json_run():
+        if json_run:
+            json_bytes = unicode(serialize(json_run)).encode('utf-8')
+            chunks.append(_RECORD_HEADER.pack(4 + len(json_bytes), _JSON_RECORD_SERIAL))
+            chunks.append(json_bytes)
+            del json_run[:]
+    
+    for item in batch:
+        if isinstance(item, _BulkRecord):
+            flush_json_run()
+            chunks.append(_RECORD_HEADER.pack(4 + len(item.packed), item.serial))
+            chunks.append(item.packed)
         else:
-            # Messages are batched in order to increase client-side efficiency since each incoming WebSocket message is always a separate JS event.
-            self._send_batch.append(value)
-            if not (self.__batch_delay is not None and self.__batch_delay.active()):
-                self.__batch_delay = self.__subscription_context.reactor.callLater(0, self._flush)
+            json_run.append(item)
+    flush_json_run()
+    return b''.join(chunks)
 
 
 class AudioStreamInner(object):
@@ -326,6 +597,10 @@ class AudioStreamInner(object):
     def dataReceived(self, data):
         pass
     
+    def set_flow_paused(self, paused):
+        # Audio is dropped while paused; see OurStreamProtocol.
+        pass
+    
     def connectionLost(self, reason):
         # pylint: disable=no-member
         self._block.remove_audio_queue(self._queue)
@@ -361,16 +636,26 @@ def _lookup_block(block, path):
     return block
 
 
+# Maximum amount of data we will write to a connection whose transport has asked us to pause, before giving up on it.
+_MAX_BYTES_WHILE_PAUSED = 1000000
+
+
+@implementer(IPushProducer)
 class OurStreamProtocol(Protocol):
     """Protocol implementing ShinySDR's WebSocket service.
     
     This protocol's transport should be a txWS WebSocket transport.
+    
+    The protocol registers itself as a producer with the transport for flow control. While the transport is paused, audio is dropped and the state stream sends bulk data at a reduced rate; if the client still does not catch up, the connection is closed.
     """
     def __init__(self, caps, subscription_context):
         self.__subscription_context = subscription_context
         self._caps = caps
         self._seenValues = {}
         self.inner = None
+        self.__paused = False
+        self.__bytes_while_paused = 0
+        self.__dropped_while_paused = 0
     
     def dataReceived(self, data):
         """Twisted Protocol implementation.
@@ -407,10 +692,13 @@ class OurStreamProtocol(Protocol):
             self.inner = StateStreamInner(self.__send, root_object, loc, self.__subscription_context)  # note reuse of loc as HTTP path; probably will regret this
         else:
             raise Exception('Unknown path: %r' % (path,))
+        if self.__paused:
+            self.inner.set_flow_paused(True)
     
     def connectionMade(self):
         """twisted Protocol implementation"""
         self.transport.setBinaryMode(True)
+        self.transport.registerProducer(self, True)
         # Unfortunately, txWS calls this too soon for transport.location to be available
     
     def connectionLost(self, reason):
@@ -419,18 +707,41 @@ class OurStreamProtocol(Protocol):
         if self.inner is not None:
             self.inner.connectionLost(reason)
     
+    def pauseProducing(self):
+        """IPushProducer implementation"""
+        self.__paused = True
+        if self.inner is not None:
+            self.inner.set_flow_paused(True)
+    
+    def resumeProducing(self):
+        """IPushProducer implementation"""
+        if self.__dropped_while_paused:
+            log.msg('Dropped %i messages while paused on stream %s' % (self.__dropped_while_paused, self.transport.location))
+        self.__paused = False
+        self.__bytes_while_paused = 0
+        self.__dropped_while_paused = 0
+        if self.inner is not None:
+            self.inner.set_flow_paused(False)
+    
+    def stopProducing(self):
+        """IPushProducer implementation"""
+        # connectionLost will follow and take care of cleanup.
+    
     def __send(self, message, safe_to_drop=False):
-        if len(self.transport.transport.dataBuffer) > 1000000:
-            # TODO: condition is horrible implementation-diving kludge
-            # Don't accumulate indefinite buffer if we aren't successfully getting it onto the network.
-            
+        if self.__paused:
             if safe_to_drop:
-                log.err('Dropping data going to stream ' + self.transport.location)
-            else:
+                self.__dropped_while_paused += 1
+                return
+            if self.__bytes_while_paused > _MAX_BYTES_WHILE_PAUSED:
+                # Already closing.
+                return
+            self.__bytes_while_paused += len(message)
+            if self.__bytes_while_paused > _MAX_BYTES_WHILE_PAUSED:
+                # Don't accumulate indefinite buffer if we aren't successfully getting it onto the network.
                 log.err('Dropping connection due to too much data on stream ' + self.transport.location)
                 self.transport.close(reason='Too much data buffered')
-        else:
-            self.transport.write(message)
+                return
+        self.transport.write(message)
 
 
 def _fqn(class_):
@@ -19,58 +19,103 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
-import bisect
+from collections import OrderedDict
+import heapq
+from timeit import default_timer as _timer
+import weakref
 
-from twisted.internet import task, reactor as the_reactor
+from twisted.internet import reactor as the_reactor
 from twisted.logger import Logger
 from zope.interface import implementer
 
-from shinysdr.values import BaseCell, IDeltaSubscriber, ISubscriber, ISubscription, SubscriptionContext, never_subscription
+from shinysdr.values import BaseCell, ExportedState, IDeltaSubscriber, IPausableSubscriber, ISubscriber, ISubscription, SubscriptionContext, exported_value, never_subscription
 
 __all__ = []  # appended later
 
 _log = Logger()
 
 
+# A single poll of one cell taking longer than this many seconds is logged (once per cell).
+_SLOW_POLL_THRESHOLD = 0.01
+
+# Poll intervals, in seconds, used for subscriptions specifying fast=True or fast=False rather than an interval.
+_FAST_INTERVAL = 1.0 / 61
+_SLOW_INTERVAL = 0.5
+
+
+def _interval_for(fast, interval=None):
+    if interval is None:
+        return _FAST_INTERVAL if fast else _SLOW_INTERVAL
+    elif interval > 0:
+        return float(interval)
+    else:
+        raise ValueError('Poll interval must be positive, not {!r}'.format(interval))
+
+
 class Poller(object):
     """
     Polls cells for new values.
     """
     
     def __init__(self):
-        # first level key is polling speed (True=fast)
-        # sorting provides determinism for testing etc.
-        self.__targets = {
-            False: _SortedMultimap(),
-            True: _SortedMultimap()
-        }
+        # interval -> _TargetRegistry
+        self.__targets = {}
         self.__functions = []
+        # cell -> _PollStats
+        self.__stats = weakref.WeakKeyDictionary()
     
-    def subscribe(self, cell, subscriber, fast, delegate_polling_to_me=False):
+    def subscribe(self, cell, subscriber, fast, delegate_polling_to_me=False, interval=None):
+        """Subscribe to cell by polling it.
+        
+        The cell is polled every interval seconds if given, or else at a fast or slow rate according to the boolean fast.
+        """
         if not isinstance(cell, BaseCell):
             # we're not actually against duck typing here; this is a sanity check
             raise TypeError('Poller given a non-cell %r' % (cell,))
+        interval = _interval_for(fast, interval)
+        stats = self.__stats.get(cell)
+        if stats is None:
+            stats = self.__stats[cell] = _PollStats(cell)
+        target_class = _PollerDelegateTarget if delegate_polling_to_me else _PollerValueTarget
+        table = self.__targets.get(interval)
+        target = table.get((target_class, cell)) if table is not None else None
         try:
-            if delegate_polling_to_me:
-                target = _PollerDelegateTarget(cell)
-            else:
-                target = _PollerValueTarget(cell)
-            return _PollerSubscription(self, target, subscriber, fast)
+            if target is None:
+                target = target_class(cell, stats)
+            return _PollerSubscription(self, target, subscriber, interval)
         except _FailureToSubscribe:
             return never_subscription
     
     def _add_subscription(self, target, subscription):
-        self.__targets[subscription.fast].add(target, subscription)
+        table = self.__targets.get(subscription.interval)
+        if table is None:
+            table = self.__targets[subscription.interval] = _TargetRegistry()
+        table.add(target, subscription)
     
     def _remove_subscription(self, target, subscription):
-        table = self.__targets[subscription.fast]
+        table = self.__targets[subscription.interval]
         last_out = table.remove(target, subscription)
         if last_out:
             target.unsubscribe()
+            if table.count_keys() == 0:
+                del self.__targets[subscription.interval]
     
     def poll(self, rate_key):
-        for target, subscriptions in self.__targets[rate_key].iter_snapshot():
-            target.poll(_AggregatedSubscriber(subscriptions))
+        """Poll the targets subscribed with the given interval, or True or False for the fast and slow rates."""
+        if isinstance(rate_key, bool):
+            rate_key = _interval_for(rate_key)
+        table = self.__targets.get(rate_key)
+        if table is not None:
+            for target, subscriptions in table.snapshot():
+                if not target.active:
+                    # unsubscribed by an earlier poll in this loop
+                    continue
+                if target.skippable and target.pausable_count == len(subscriptions) and all(s.is_paused() for s in subscriptions):
+                    continue
+                fire = _AggregatedSubscriber(subscriptions)
+                start = _timer()
+                target.poll(fire)
+                target.stats.record_poll(_timer() - start, fire.fired)
         
         functions = self.__functions
         if len(functions) > 0:
@@ -79,8 +124,9 @@ class Poller(object):
                 function()
     
     def poll_all(self):
-        self.poll(False)
-        self.poll(True)
+        # slowest first, as in the days of exactly two rates
+        for interval in sorted(self.__targets, reverse=True):
+            self.poll(interval)
     
     def queue_function(self, function, *args, **kwargs):
         """Queue a function to be called on the same schedule as the poller would."""
@@ -89,63 +135,148 @@ class Poller(object):
         
         self.__functions.append(thunk)
     
-    def count_subscriptions(self):
-        return sum(multimap.count_values() for multimap in self.__targets.itervalues())
+    def get_stats(self):
+        """Return statistics about the cells which have been polled, most expensive first, in JSON-compatible form."""
+        return [
+            stats.to_json()
+            for stats in sorted(self.__stats.values(), key=lambda stats: stats.total_time, reverse=True)
+        ]
+    
+    def count_subscriptions(self, rate_key=None):
+        if rate_key is None:
+            return sum(multimap.count_values() for multimap in self.__targets.itervalues())
+        else:
+            if isinstance(rate_key, bool):
+                rate_key = _interval_for(rate_key)
+            table = self.__targets.get(rate_key)
+            return 0 if table is None else table.count_values()
 
 
 __all__.append('Poller')
 
 
+class PollerDiagnostics(ExportedState):
+    """Exports a Poller's statistics, for finding the cells whose getters dominate polling time."""
+    
+    def __init__(self, poller):
+        self.__poller = poller
+    
+    @exported_value(type=list, changes='continuous', poll_interval=2, label='Poll statistics')
+    def get_stats(self):
+        return self.__poller.get_stats()
+
+
+__all__.append('PollerDiagnostics')
+
+
 class AutomaticPoller(Poller):
+    """Poller which polls each interval's targets on schedule using the given reactor.
+    
+    All intervals which are due at the same time are polled in one reactor call.
+    """
+    
     def __init__(self, reactor):
         Poller.__init__(self)
-        self.__loop_slow = task.LoopingCall(self.poll, False)
-        self.__loop_slow.clock = reactor
-        self.__loop_fast = task.LoopingCall(self.poll, True)
-        self.__loop_fast.clock = reactor
-        self.__running = False
+        self.__reactor = reactor
+        # heap of [due time, interval, valid] lists; entries are invalidated rather than removed
+        self.__schedule = []
+        # interval -> its entry in __schedule
+        self.__entries = {}
+        self.__delayed_call = None
     
     def _add_subscription(self, target, subscription):
-        # Hook to start call
+        # Hook to start polling this interval
         super(AutomaticPoller, self)._add_subscription(target, subscription)
-        if not self.__running:
-            print 'Poller starting'
-            self.__running = True
-            # using callLater because start() will do the first call _immediately_ :(
-            self.__loop_fast.clock.callLater(0, self.__loop_fast.start, 1.0 / 61)
-            self.__loop_slow.clock.callLater(0, self.__loop_slow.start, 0.5)
+        interval = subscription.interval
+        if interval not in self.__entries:
+            if not self.__entries:
+                print 'Poller starting'
+            # poll on the next reactor turn, as the first poll of a new subscription
+            entry = [self.__reactor.seconds(), interval, True]
+            self.__entries[interval] = entry
+            heapq.heappush(self.__schedule, entry)
+            self.__reschedule()
     
     def _remove_subscription(self, target, subscription):
-        # Hook to stop call
+        # Hook to stop polling this interval
         super(AutomaticPoller, self)._remove_subscription(target, subscription)
-        if self.__running and self.count_subscriptions() == 0:
-            print 'Poller stopping'
-            self.__running = False
-            self.__loop_fast.stop()
-            self.__loop_slow.stop()
+        interval = subscription.interval
+        if interval in self.__entries and self.count_subscriptions(interval) == 0:
+            self.__entries.pop(interval)[2] = False
+            if not self.__entries:
+                print 'Poller stopping'
+            self.__reschedule()
+    
+    def __reschedule(self):
+        schedule = self.__schedule
+        while schedule and not schedule[0][2]:
+            heapq.heappop(schedule)
+        delayed_call = self.__delayed_call
+        if not schedule:
+            if delayed_call is not None:
+                delayed_call.cancel()
+                self.__delayed_call = None
+            return
+        delay = max(0, schedule[0][0] - self.__reactor.seconds())
+        if delayed_call is None:
+            self.__delayed_call = self.__reactor.callLater(delay, self.__poll_due)
+        elif delayed_call.getTime() != schedule[0][0]:
+            delayed_call.reset(delay)
+    
+    def __poll_due(self):
+        self.__delayed_call = None
+        now = self.__reactor.seconds()
+        schedule = self.__schedule
+        due = []
+        while schedule and schedule[0][0] <= now:
+            entry = heapq.heappop(schedule)
+            if entry[2]:
+                due.append(entry)
+        # slowest first, as in the days of exactly two rates
+        due.sort(key=lambda entry: entry[1], reverse=True)
+        for entry in due:
+            due_time, interval, _ = entry
+            # If we have fallen behind, skip the missed polls rather than catching up.
+            entry[0] = max(due_time + interval, now)
+            heapq.heappush(schedule, entry)
+        for entry in due:
+            if entry[2]:  # may have been unsubscribed by a previous poll
+                self.poll(entry[1])
+        self.__reschedule()
 
 
 @implementer(ISubscriber, IDeltaSubscriber)
 class _AggregatedSubscriber(object):
     def __init__(self, subscriptions):
-        self.__plain_subscriptions = []
-        self.__delta_subscriptions = []
-        for s in subscriptions:
-            assert isinstance(s, _PollerSubscription)
-            if IDeltaSubscriber.providedBy(s._subscriber):
-                self.__delta_subscriptions.append(s)
-            else:
-                self.__plain_subscriptions.append(s)
+        self.fired = False
+        self.__subscriptions = subscriptions
+        self.__plain_subscriptions = None
+        self.__delta_subscriptions = None
+    
+    def __split(self):
+        # Done only once something has been fired, since most polls find no change.
+        if self.__plain_subscriptions is None:
+            self.fired = True
+            self.__plain_subscriptions = []
+            self.__delta_subscriptions = []
+            for s in self.__subscriptions:
+                assert isinstance(s, _PollerSubscription)
+                if s.delta:
+                    self.__delta_subscriptions.append(s)
+                else:
+                    self.__plain_subscriptions.append(s)
     
     # TODO: use callLater rather than calling subscribers directly
     
     def __call__(self, value):
+        self.__split()
         for s in self.__plain_subscriptions:
             s._subscriber(value)
         for s in self.__delta_subscriptions:
             s._subscriber(value)
     
     def append(self, patch):
+        self.__split()
         value = patch  # TODO: This does not work in general; we need an actual accumulator
         for s in self.__plain_subscriptions:
             s._subscriber(value)
@@ -153,6 +284,7 @@ class _AggregatedSubscriber(object):
             s._subscriber.append(patch)
     
     def prepend(self, patch):
+        self.__split()
         # No use to plain subscribers
         for s in self.__delta_subscriptions:
             s._subscriber(patch)
@@ -160,44 +292,52 @@ class _AggregatedSubscriber(object):
 
 @implementer(ISubscription)
 class _PollerSubscription(object):
-    def __init__(self, poller, target, subscriber, fast):
+    def __init__(self, poller, target, subscriber, interval):
         self._subscriber = subscriber
         self._target = target
         self._poller = poller
-        self.fast = fast
+        self.interval = interval
+        self.delta = IDeltaSubscriber.providedBy(subscriber)
+        self.pausable = IPausableSubscriber.providedBy(subscriber)
         poller._add_subscription(target, self)
     
+    def is_paused(self):
+        return self.pausable and self._subscriber.is_paused()
+    
     def unsubscribe(self):
         self._poller._remove_subscription(self._target, self)
 
 
 class _PollerCellTarget(object):
-    def __init__(self, cell):
+    def __init__(self, cell, stats):
         self._obj = cell  # TODO: rename to _cell for clarity
+        self.key = (type(self), cell)
+        self.stats = stats
+        self.active = True
+        self.pausable_count = 0  # maintained by _TargetRegistry
         self._subscriptions = []
         self.__interest_token = object()
         cell.interest_tracker.set(self.__interest_token, True)
     
-    def __cmp__(self, other):
-        return cmp(type(self), type(other)) or cmp(self._obj, other._obj)
-    
-    def __hash__(self):
-        return hash(self._obj)
-    
     def poll(self, fire):
         """Call fire (with arbitrary info in args) if the thing polled has changed."""
         raise NotImplementedError()
     
     def unsubscribe(self):
+        self.active = False
         self._obj.interest_tracker.set(self.__interest_token, False)
 
 
 class _PollerValueTarget(_PollerCellTarget):
-    def __init__(self, cell):
-        _PollerCellTarget.__init__(self, cell)
+    # A skipped poll loses nothing, since the next one compares against the last value delivered.
+    skippable = True
+    
+    def __init__(self, cell, stats):
+        _PollerCellTarget.__init__(self, cell, stats)
         try:
             self.__previous_value = self.__get()
         except Exception:
+            stats.exception_count += 1
             _log.failure("Exception in {cell}.get()", cell=cell)
             self.unsubscribe()  # cancel effects of super __init__
             raise _FailureToSubscribe()
@@ -210,6 +350,7 @@ class _PollerValueTarget(_PollerCellTarget):
         try:
             value = self.__get()
         except Exception:  # pylint: disable=broad-except
+            self.stats.exception_count += 1
             if not self.__broken:
                 _log.failure("Exception in {cell}.get()", cell=self._obj)
             self.__broken = True
@@ -221,66 +362,115 @@ class _PollerValueTarget(_PollerCellTarget):
 
 
 class _PollerDelegateTarget(_PollerCellTarget):
-    def __init__(self, cell):
-        _PollerCellTarget.__init__(self, cell)
+    # The cell may need to consume data (e.g. a message queue) whether or not anyone wants it right now.
+    skippable = False
+    
+    def __init__(self, cell, stats):
+        _PollerCellTarget.__init__(self, cell, stats)
 
     def poll(self, fire):
         self._obj._poll_from_poller(fire)
 
 
-class _SortedMultimap(object):
+class _PollStats(object):
+    """Cumulative statistics about polling one cell, kept across its subscriptions."""
+    
+    def __init__(self, cell):
+        self.__cell_name = repr(cell)
+        self.poll_count = 0
+        self.change_count = 0
+        self.exception_count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+    
+    def record_poll(self, elapsed, changed):
+        self.poll_count += 1
+        self.total_time += elapsed
+        if changed:
+            self.change_count += 1
+        if elapsed > self.max_time:
+            if elapsed > _SLOW_POLL_THRESHOLD >= self.max_time:
+                _log.warn("Slow poll: {cell} took {elapsed:.3f} s", cell=self.__cell_name, elapsed=elapsed)
+            self.max_time = elapsed
+    
+    def to_json(self):
+        return {
+            u'cell': self.__cell_name,
+            u'polls': self.poll_count,
+            u'changes': self.change_count,
+            u'exceptions': self.exception_count,
+            u'total_time': self.total_time,
+            u'max_time': self.max_time,
+        }
+
+
+class _TargetRegistry(object):
     """
-    Support for Poller.
-    Properties not explained by the name:
-    * Values must be unique within a given key.
-    * Keys are iterated in sorted order (values are not)
+    Support for Poller: the targets polled at one interval, with their subscriptions.
+    
+    Targets are kept in order of first subscription, which makes polling order deterministic for testing etc. Adding and removing are O(1), and the snapshot used for each poll is rebuilt only when the set of targets has changed.
     """
     def __init__(self):
-        # key -> set(values)
-        self.__dict = {}
-        # keys in sorted order
-        self.__sorted = []
-        # count of values (= count of pairs)
+        # target.key -> target
+        self.__targets = OrderedDict()
+        # target.key -> set of subscriptions
+        self.__subscriptions = {}
+        self.__snapshot = ()
+        self.__snapshot_valid = True
+        # count of subscriptions
         self.__value_count = 0
     
-    def iter_snapshot(self):
-        # TODO: consider not exposing the value sets directly, especially as this allows noticing mutation
-        return ((key, self.__dict[key]) for key in self.__sorted)
+    def get(self, key):
+        return self.__targets.get(key)
     
-    def add(self, key, value):
-        if key in self.__dict:
-            values = self.__dict[key]
-        else:
-            values = set()
-            self.__dict[key] = values
-            bisect.insort(self.__sorted, key)
-        if value in values:
-            raise KeyError('Duplicate add: %r' % ((key, value),))
-        values.add(value)
+    def snapshot(self):
+        """Return a tuple of (target, subscriptions) pairs.
+        
+        The tuple is not affected by later adding or removing targets, but the subscriptions collections are live.
+        """
+        if not self.__snapshot_valid:
+            subscriptions = self.__subscriptions
+            self.__snapshot = tuple(
+                (target, subscriptions[key])
+                for key, target in self.__targets.iteritems())
+            self.__snapshot_valid = True
+        return self.__snapshot
+    
+    def add(self, target, subscription):
+        key = target.key
+        subscriptions = self.__subscriptions.get(key)
+        if subscriptions is None:
+            self.__targets[key] = target
+            subscriptions = self.__subscriptions[key] = set()
+            self.__snapshot_valid = False
+        elif self.__targets[key] is not target:
+            raise KeyError('Conflicting target for %r' % (key,))
+        if subscription in subscriptions:
+            raise KeyError('Duplicate add: %r' % ((target, subscription),))
+        subscriptions.add(subscription)
+        if subscription.pausable:
+            target.pausable_count += 1
         self.__value_count += 1
     
-    def remove(self, key, value):
-        """Returns true if the value was the last value for that key"""
-        if key not in self.__dict:
-            raise KeyError('No key to remove: %r' % ((key, value),))
-        values = self.__dict[key]
-        if value not in values:
-            raise KeyError('No value to remove: %r' % ((key, value),))
-        values.remove(value)
+    def remove(self, target, subscription):
+        """Returns true if the subscription was the last one for that target"""
+        key = target.key
+        subscriptions = self.__subscriptions.get(key)
+        if subscriptions is None or subscription not in subscriptions:
+            raise KeyError('No subscription to remove: %r' % ((target, subscription),))
+        subscriptions.remove(subscription)
+        if subscription.pausable:
+            target.pausable_count -= 1
         self.__value_count -= 1
-        last_out = len(values) == 0
+        last_out = len(subscriptions) == 0
         if last_out:
-            sorted_list = self.__sorted
-            del self.__dict[key]
-            index = bisect.bisect_left(sorted_list, key)
-            if sorted_list[index] != key:
-                # TODO: This has been observed to happen. Need to diagnose.
-                raise Exception("can't happen: while removing last value %r for key %r from %r, %r was found instead of the key at index %r in the sorted list" % (value, key, self, sorted_list[index], index))
-            sorted_list[index:index + 1] = []
+            del self.__targets[key]
+            del self.__subscriptions[key]
+            self.__snapshot_valid = False
         return last_out
     
     def count_keys(self):
-        return len(self.__dict)
+        return len(self.__targets)
     
     def count_values(self):
         return self.__value_count
@@ -18,6 +18,7 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from collections import OrderedDict
 import time
 
 from twisted.python import log
@@ -27,13 +28,15 @@ from gnuradio import analog
 from gnuradio import gr
 from gnuradio import blocks
 
+from shinysdr.i.channelizer import ChannelPlan
 from shinysdr.i.modes import get_modes, lookup_mode
+from shinysdr.i.worker import WorkerDemodulator
 from shinysdr.interfaces import IDemodulator, IDemodulatorContext, IDemodulatorModeChange, ITunableDemodulator
 from shinysdr.math import dB, rotator_inc, to_dB
 from shinysdr.signals import SignalType, no_signal
 from shinysdr.types import EnumT, QuantityT, RangeT, ReferenceT
 from shinysdr import units
-from shinysdr.values import ExportedState, exported_value, setter, unserialize_exported_state
+from shinysdr.values import ExportedState, exported_value, setter, split_exported_state, unserialize_exported_state
 
 
 # arbitrary non-infinite limit
@@ -43,6 +46,9 @@ _audio_power_minimum_amplitude = dB(_audio_power_minimum_dB)
 
 _dummy_audio_rate = 2000
 
+# Number of demodulators, besides the one in use, which each receiver keeps for reuse if it switches back to them.
+_DEMODULATOR_CACHE_SIZE = 4
+
 
 class IReceiver(Interface):
     """
@@ -63,6 +69,7 @@ class Receiver(gr.hier_block2, ExportedState):
             audio_gain=-6,
             audio_pan=0,
             audio_channels=0,
+            worker=False,
             context=None):
         assert audio_channels == 1 or audio_channels == 2
         assert audio_destination is not None
@@ -89,6 +96,7 @@ class Receiver(gr.hier_block2, ExportedState):
         self.audio_gain = audio_gain
         self.audio_pan = min(1, max(-1, audio_pan))
         self.__audio_destination = audio_destination
+        self.__worker = bool(worker)
         
         # Receive frequency.
         self.__freq_linked_to_device = bool(freq_linked_to_device)
@@ -99,8 +107,16 @@ class Receiver(gr.hier_block2, ExportedState):
             self.__freq_absolute = float(freq_absolute)
             self.__freq_relative = self.__freq_absolute - self.__get_device().get_freq()
         
+        # Input: None for the device's full-rate signal, the ChannelPlan of the device's channelizer and which channel of it, or the SubbandPlan of the device's subband filters and the center frequency of the one assigned by the context.
+        self.__input_plan = None
+        self.__input_channel = None
+        self.__input_subband_center = None
+        self.__announced_input_plan = None  # __input_plan as of the last changed_input()
+        
         # Blocks
-        self.__rotator = blocks.rotator_cc()
+        self.__demodulator_cache = _DemodulatorCache(_DEMODULATOR_CACHE_SIZE)
+        self.__demodulator_cache_info = None  # (mode, input rate, facet) of the current demodulator, if it may be cached
+        self.__rotator = None  # only needed for demodulators which are not ITunableDemodulators
         self.__demodulator = self.__make_demodulator(mode, {})
         self.__update_demodulator_info()
         self.__audio_gain_block = blocks.multiply_const_vff([0.0] * audio_channels)
@@ -186,6 +202,25 @@ class Receiver(gr.hier_block2, ExportedState):
     
     def get_output_type(self):
         return self.__output_type
+    
+    def close(self):
+        """Release resources held outside the flow graph, such as a worker process. Call after this receiver has been removed from the flow graph."""
+        _close_demodulator(self.__demodulator)
+        self.__demodulator_cache.clear()
+    
+    def get_input_plan(self):
+        """Return the ChannelPlan or SubbandPlan describing the input this receiver should be connected to, or None if it should be connected to the device's full-rate output."""
+        return self.__input_plan
+    
+    def get_input_channel(self):
+        """Return which channel of its device's ChannelizerBank this receiver should be connected to, or None if it should not."""
+        return self.__input_channel
+    
+    def set_input_subband_center(self, freq):
+        """Called by the context to say that it is connecting this receiver to a SubbandFilter with the given center frequency (relative to the device's)."""
+        if freq != self.__input_subband_center:
+            self.__input_subband_center = freq
+            self.__update_rotator()
 
     def changed_device_freq(self):
         if self.__freq_linked_to_device:
@@ -233,6 +268,7 @@ class Receiver(gr.hier_block2, ExportedState):
                 IDemodulatorModeChange.providedBy(self.__demodulator) and \
                 self.__demodulator.can_set_mode(mode):
             self.__demodulator.set_mode(mode)
+            self.__demodulator_cache_info = None  # no longer matches how it was constructed
             self.mode = mode
         else:
             self._rebuild_demodulator(mode=mode, reason=u'changed mode')
@@ -318,6 +354,23 @@ class Receiver(gr.hier_block2, ExportedState):
             self.__audio_destination = value
             self.context.changed_needed_connections(u'changed destination')
     
+    @exported_value(
+        parameter='worker',
+        type=bool,
+        changes='this_setter',
+        label='Separate process',
+        description='Run the demodulator in a separate process, so that it does not compete with the rest of the server. Has no effect unless the receiver_workers feature is enabled.')
+    def get_worker(self):
+        return self.__worker
+    
+    @setter
+    def set_worker(self, value):
+        value = bool(value)
+        if value != self.__worker:
+            self.__worker = value
+            if self.context.get_workers_enabled():
+                self._rebuild_demodulator(reason=u'changed worker')
+    
     @exported_value(type=bool, changes='explicit')
     def get_is_valid(self):
         if self.__demodulator is None:
@@ -343,21 +396,54 @@ class Receiver(gr.hier_block2, ExportedState):
             return _audio_power_minimum_dB
     
     def __update_rotator(self):
-        device = self.__get_device()
-        sample_rate = device.get_rx_driver().get_output_type().get_sample_rate()
+        plan = self.__input_plan
+        channel = None
+        needs_new_subband = False
+        if plan is None:
+            sample_rate = self.__get_device().get_rx_driver().get_output_type().get_sample_rate()
+            freq_relative = self.__freq_relative
+        elif isinstance(plan, ChannelPlan):
+            sample_rate = plan.get_output_rate()
+            channel, freq_relative = plan.locate(self.__freq_relative)
+        else:
+            sample_rate = plan.get_output_rate()
+            center = self.__input_subband_center
+            freq_relative = self.__freq_relative - (center or 0)
+            needs_new_subband = center is None or not plan.fits_at(freq_relative, self.__demodulator.get_band_shape())
         if self.__demod_tunable:
             # TODO: Method should perhaps be renamed to convey that it is relative
-            self.__demodulator.set_rec_freq(self.__freq_relative)
+            self.__demodulator.set_rec_freq(freq_relative)
+            self.__rotator = None
         else:
-            self.__rotator.set_phase_inc(rotator_inc(rate=sample_rate, shift=-self.__freq_relative))
+            if self.__rotator is None:
+                self.__rotator = blocks.rotator_cc()
+            self.__rotator.set_phase_inc(rotator_inc(rate=sample_rate, shift=-freq_relative))
+        if channel != self.__input_channel or needs_new_subband or plan != self.__announced_input_plan:
+            self.__input_channel = channel
+            self.__announced_input_plan = plan
+            self.context.changed_input()
     
     def __get_device(self):
         return self.context.get_device(self.__device_name)
     
     # called from facet
-    def _rebuild_demodulator(self, mode=None, reason='<unspecified>'):
+    def _rebuild_demodulator(self, mode=None, reason='<unspecified>', reusable=True):
+        """Replace the demodulator with a new one.
+        
+        reusable: whether the old demodulator may be kept to be used again (false if its state no longer matches how it was constructed).
+        """
+        old_demodulator = self.__demodulator
+        old_cache_info = self.__demodulator_cache_info
         self.__rebuild_demodulator_nodirty(mode)
         self.__do_connect(reason=u'demodulator rebuilt: %s' % (reason,))
+        if reusable and old_cache_info is not None:
+            old_mode, old_input_rate, old_facet = old_cache_info
+            old_facet._enabled = False  # an idle demodulator must not affect the receiver
+            self.__demodulator_cache.put(
+                _demodulator_cache_key(old_mode, old_input_rate, old_demodulator.state_to_json()),
+                (old_demodulator, old_facet))
+        else:
+            _close_demodulator(old_demodulator)
         # TODO write a test showing that revalidate is needed and works
         self.context.revalidate(tuning=False)  # in case our bandwidth changed
         self.state_changed('is_valid')
@@ -393,22 +479,91 @@ class Receiver(gr.hier_block2, ExportedState):
         state = state.copy()  # don't modify arg
         if 'mode' in state: del state['mode']  # don't switch back to the mode we just switched from
         
-        facet = ContextForDemodulator(self)
+        device_rate = self.__get_device().get_rx_driver().get_output_type().get_sample_rate()
+        if mode_def.channelizable:
+            subband_plan = self.context.get_subband_plan(self.__device_name)
+            channel_plan = self.context.get_channel_plan(self.__device_name)
+        else:
+            subband_plan = channel_plan = None
+        
+        use_worker = self.__worker and self.context.get_workers_enabled()
+        if use_worker and not mode_def.reusable:
+            # A WorkerDemodulator keeps an idle instance in this process, which would duplicate the external process or timers of such a mode.
+            log.msg('Receiver: %s demodulators cannot run in a worker process; running in the server process instead.' % (mode,))
+            use_worker = False
+        cacheable = mode_def.reusable and not use_worker
+        built = []  # (cache key, demodulator, facet, input rate) of each demodulator constructed
+        
+        def construct(input_rate):
+            cache_key = _demodulator_cache_key(mode, input_rate, state) if cacheable else None
+            cached = self.__demodulator_cache.take(cache_key)
+            if cached is not None:
+                demodulator, facet = cached
+                _, remaining_state = split_exported_state(clas, state)
+                facet._enabled = False
+                demodulator.state_from_json(remaining_state)
+            else:
+                facet = ContextForDemodulator(self)
+                init_kwargs = dict(
+                    mode=mode,
+                    input_rate=input_rate,
+                    context=facet)
+                demodulator = IDemodulator(unserialize_exported_state(
+                    ctor=clas,
+                    state=state,
+                    kwargs=init_kwargs))
+            # until _enabled, ignore any callbacks resulting from unserialization calling setters
+            facet._enabled = True
+            built.append((cache_key, demodulator, facet, input_rate))
+            return demodulator
+        
+        # Use the narrowest input the demodulator fits in. The band shape of a channelizable demodulator does not depend on its input rate, so it is remembered from any earlier demodulator of the same mode and state, or found out by constructing one at the widest candidate rate.
+        plan = None
+        if subband_plan is not None or channel_plan is not None:
+            band_shape_key = _band_shape_key(mode, state)
+            band_shape = _band_shapes.get(band_shape_key)
+            if band_shape is None:
+                band_shape = construct(device_rate if subband_plan is None else subband_plan.get_output_rate()).get_band_shape()
+                _remember_band_shape(band_shape_key, band_shape)
+            if subband_plan is not None and subband_plan.fits(band_shape):
+                plan = subband_plan
+            if channel_plan is not None and channel_plan.fits(band_shape):
+                plan = channel_plan
+        input_rate = device_rate if plan is None else plan.get_output_rate()
+        if built and built[-1][3] == input_rate:
+            demodulator = built[-1][1]
+        else:
+            demodulator = construct(input_rate)
+        self.__input_plan = plan
+        self.__input_subband_center = None
         
-        init_kwargs = dict(
-            mode=mode,
-            input_rate=self.__get_device().get_rx_driver().get_output_type().get_sample_rate(),
-            context=facet)
-        demodulator = IDemodulator(unserialize_exported_state(
-            ctor=clas,
-            state=state,
-            kwargs=init_kwargs))
+        # Demodulators constructed only to find the band shape are as good as any for later use.
+        for cache_key, unused_demodulator, unused_facet, _ in built[:-1]:
+            unused_facet._enabled = False
+            if cache_key is None:
+                _close_demodulator(unused_demodulator)
+            else:
+                self.__demodulator_cache.put(cache_key, (unused_demodulator, unused_facet))
         
-        # until _enabled, ignore any callbacks resulting from unserialization calling setters
-        facet._enabled = True
+        _, _, facet, input_rate = built[-1]
+        if use_worker:
+            facet = ContextForDemodulator(self)
+            facet._enabled = True
+            demodulator = WorkerDemodulator(
+                mode=mode,
+                input_rate=input_rate,
+                shadow=demodulator,
+                context=facet,
+                died=self.__worker_died)
+        self.__demodulator_cache_info = (mode, input_rate, facet) if cacheable else None
         log.msg('Constructed %s demodulator: %i ms.' % (mode, (time.time() - t0) * 1000))
         return demodulator
 
+    def __worker_died(self):
+        # Don't try again with another worker, which would likely die the same way.
+        log.msg('Receiver: demodulator worker process died; running the demodulator in the server process instead.')
+        self.set_worker(False)
+
     def __update_audio_gain(self):
         gain_lin = dB(self.audio_gain)
         if self.__audio_channels == 2:
@@ -422,6 +577,70 @@ class Receiver(gr.hier_block2, ExportedState):
             self.__audio_gain_block.set_k([gain_lin])
 
 
+class _DemodulatorCache(object):
+    """Least-recently-used set of demodulators not currently in use by a receiver, keyed by _demodulator_cache_key."""
+    def __init__(self, size):
+        self.__size = size
+        self.__entries = OrderedDict()
+    
+    def take(self, key):
+        """Remove and return the entry for key, or None."""
+        if key is None:
+            return None
+        return self.__entries.pop(key, None)
+    
+    def put(self, key, entry):
+        if key is None:
+            return
+        self.__entries.pop(key, None)
+        self.__entries[key] = entry
+        while len(self.__entries) > self.__size:
+            self.__entries.popitem(last=False)
+    
+    def clear(self):
+        self.__entries.clear()
+
+
+def _demodulator_cache_key(mode, input_rate, state):
+    """Return what determines whether a demodulator can be reused: its mode, its input rate, and the parts of its state which are constructor parameters rather than settable afterward. Returns None if the state is not hashable."""
+    state_kwargs, _ = split_exported_state(lookup_mode(mode).demod_class, state)
+    state_kwargs.pop('mode', None)
+    key = (mode, input_rate, tuple(sorted(state_kwargs.iteritems())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+# Band shapes of channelizable demodulators, by _band_shape_key; see Receiver.__make_demodulator.
+_band_shapes = {}
+_BAND_SHAPE_MEMO_SIZE = 100
+
+
+def _band_shape_key(mode, state):
+    """Return what determines the band shape of a channelizable demodulator: its mode and state. Returns None if the state is not hashable."""
+    key = (mode, tuple(sorted(state.iteritems())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _remember_band_shape(key, band_shape):
+    if key is None:
+        return
+    if len(_band_shapes) >= _BAND_SHAPE_MEMO_SIZE:
+        _band_shapes.clear()
+    _band_shapes[key] = band_shape
+
+
+def _close_demodulator(demodulator):
+    if isinstance(demodulator, WorkerDemodulator):
+        demodulator.close()
+
+
 @implementer(IDemodulatorContext)
 class ContextForDemodulator(object):
     def __init__(self, receiver):
@@ -431,7 +650,7 @@ class ContextForDemodulator(object):
     def rebuild_me(self):
         print 'rebuild_me'
         assert self._enabled, 'ContextForReceiver({}) is not currently valid'.format(self._receiver)
-        self._receiver._rebuild_demodulator(reason=u'rebuild_me')
+        self._receiver._rebuild_demodulator(reason=u'rebuild_me', reusable=False)
 
     def lock(self):
         self._receiver.context.lock()
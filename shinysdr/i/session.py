@@ -24,9 +24,10 @@ import importlib
 from zope.interface import implementer
 
 from shinysdr.i.network.base import IWebEntryPoint
+from shinysdr.i.poller import PollerDiagnostics, the_poller
 from shinysdr.i.top import Top
 from shinysdr.types import ReferenceT
-from shinysdr.values import ExportedState, exported_value
+from shinysdr.values import ExportedState, LooseCell, exported_value
 
 
 class AppRoot(ExportedState):
@@ -68,6 +69,15 @@ class Session(ExportedState):
         self.__receive_flowgraph = receive_flowgraph
         self.__read_only_dbs = read_only_dbs
         self.__writable_db = writable_db
+        if features.get('poller_diagnostics', False):
+            # Not exported by default, because every client would then be sent the statistics continuously.
+            self.__poller_diagnostics_cell = LooseCell(
+                value=PollerDiagnostics(the_poller),
+                type=ReferenceT(),
+                writable=False,
+                persists=False)
+        else:
+            self.__poller_diagnostics_cell = None
     
     def state_def(self):
         for d in super(Session, self).state_def():
@@ -84,6 +94,8 @@ class Session(ExportedState):
             'clip_warning'
         ]:
             yield name, rxfs[name]
+        if self.__poller_diagnostics_cell is not None:
+            yield 'poller_diagnostics', self.__poller_diagnostics_cell
 
     def get_type(self):
         """implements IEntryPoint"""
@@ -28,7 +28,8 @@ from gnuradio import blocks
 from gnuradio import gr
 
 from shinysdr.i.audiomux import AudioManager
-from shinysdr.i.blocks import MonitorSink, RecursiveLockBlockMixin, Context
+from shinysdr.i.blocks import FlowgraphEdges, MonitorSink, PacedMessageSource, RecursiveLockBlockMixin, Context
+from shinysdr.i.channelizer import ChannelizerBank, ChannelPlan, SubbandFilter, plan_channels, plan_subbands
 from shinysdr.i.poller import the_subscription_context
 from shinysdr.i.receiver import Receiver
 from shinysdr.signals import SignalType
@@ -39,6 +40,14 @@ from shinysdr.values import CellDict, ExportedState, CollectionState, exported_v
 
 _DEBUG_RETUNE = False
 
+# Seconds to wait after a change which needs a reconnect (via Top._schedule_reconnect) before doing it, so that further changes can share the same reconnect. Zero still merges all changes made in the same reactor turn.
+_RECONNECT_DELAY = 0
+
+# Sanity limits to avoid burning arbitrary resources. Receivers using a channelizer are much cheaper than those using the device's full-rate signal; receivers sharing a subband count as one full-rate receiver.
+# TODO: less arbitrary constants; communicate these restrictions to client
+_MAX_FULL_RATE_RECEIVERS = 6
+_MAX_CHANNELIZED_RECEIVERS = 50
+
 
 @implementer(IWritableCollection)
 class ReceiverCollection(CollectionState):
@@ -59,7 +68,10 @@ class ReceiverCollection(CollectionState):
 
 
 # TODO: Figure out how to stop having to 'declare' this here and in config.py
-_STUB_FEATURES = {'stereo': True}
+_STUB_FEATURES = {'stereo': True, 'device_partitions': False, 'receiver_workers': False}
+
+# Maximum number of messages (each one buffer's worth of samples) queued between a _DevicePartition and the audio mixing graph; beyond this, audio is dropped rather than delaying the device's graph.
+_AUDIO_BRIDGE_QUEUE_LIMIT = 8
 
 
 class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
@@ -71,6 +83,7 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         
         gr.top_block.__init__(self, type(self).__name__)
         self.__running = False  # duplicate of GR state we can't reach, see __start_or_stop
+        self.__main_running = False  # whether this top block itself is running, if partitioned
         self.__has_a_useful_receiver = False
 
         # Configuration
@@ -83,9 +96,18 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             break
         self.__rx_device_type = EnumT({k: v.get_name() or k for (k, v) in self._sources.iteritems()})
         
+        # Flow graph partitioning: if enabled, the main graph (this top block) contains only audio mixing, and each device and everything using its signal is in a separate top block.
+        self.__edges = FlowgraphEdges(self)
+        if features.get('device_partitions', False):
+            self.__partitions = {k: _DevicePartition(d) for k, d in self._sources.iteritems()}
+        else:
+            self.__partitions = None
+        self.__audio_bridges = {}  # receiver -> _AudioBridge, if partitioned
+        self.__workers_enabled = features.get('receiver_workers', False)
+        
         # Audio early setup
         self.__audio_manager = AudioManager(  # must be before contexts
-            graph=self,
+            graph=self.__edges,
             audio_config=audio_config,
             stereo=features['stereo'])
 
@@ -94,15 +116,19 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         # TODO: remove legacy no-underscore names, maybe get rid of self.source
         self.source = None
         self.__monitor_rx_driver = None
+        self.monitor = None  # referenced by its context during construction
         self.monitor = MonitorSink(
             signal_type=SignalType(sample_rate=10000, kind='IQ'),  # dummy value will be updated in _do_connect
-            context=Context(self))
+            context=_ContainingGraphContext(self, lambda: self.monitor))
         self.monitor.get_interested_cell().subscribe2(self.__start_or_stop_later, the_subscription_context)
         self.__clip_probe = MaxProbe()
         
         # Receiver blocks (multiple, eventually)
         self._receivers = CellDict(dynamic=True)
         self._receiver_valid = {}
+        self.__receiver_null_sinks = {}  # kept so that reconnecting does not replace them
+        self.__channelizers = {}  # device key -> ChannelizerBank
+        self.__subband_filters = {}  # device key -> list of SubbandFilter
         
         # collections
         # TODO: No longer necessary to have these non-underscore names
@@ -114,6 +140,7 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         # Flags, other state
         self.__needs_reconnect = [u'initialization']
         self.__in_reconnect = False
+        self.__scheduled_reconnect = None
         self.receiver_key_counter = 0
         self.receiver_default_state = {}
         
@@ -191,19 +218,17 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         del self._receiver_valid[key]
         self.__needs_reconnect.append(u'removed receiver ' + key)
         self._do_connect()
+        receiver.close()
 
     # TODO move these methods to a facet of AudioManager
     def add_audio_queue(self, queue, queue_rate):
         self.__audio_manager.add_audio_queue(queue, queue_rate)
-        self.__needs_reconnect.append(u'added audio queue')
-        self._do_connect()
-        self.__start_or_stop()
+        self._schedule_reconnect(u'added audio queue')
     
     def remove_audio_queue(self, queue):
         self.__audio_manager.remove_audio_queue(queue)
         self.__start_or_stop()
-        self.__needs_reconnect.append(u'removed audio queue')
-        self._do_connect()
+        self._schedule_reconnect(u'removed audio queue')
     
     def get_audio_queue_channels(self):
         """
@@ -211,13 +236,33 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         """
         return self.__audio_manager.get_channels()
 
+    def _schedule_reconnect(self, reason):
+        """Arrange for _do_connect to be called soon, together with any other reconnects scheduled meanwhile.
+        
+        Use _do_connect directly instead if the caller depends on the connections having been updated on return.
+        """
+        self.__needs_reconnect.append(reason)
+        if self.__scheduled_reconnect is None:
+            self.__scheduled_reconnect = reactor.callLater(_RECONNECT_DELAY, self.__do_scheduled_reconnect)
+    
+    def __do_scheduled_reconnect(self):
+        self.__scheduled_reconnect = None
+        self._do_connect()
+    
     def _do_connect(self):
-        """Do all reconfiguration operations in the proper order."""
+        """Do all reconfiguration operations in the proper order.
+        
+        This also performs any reconnect scheduled by _schedule_reconnect which has not happened yet.
+        """
 
         if self.__in_reconnect:
             raise Exception('reentrant reconnect or _do_connect crashed')
         self.__in_reconnect = True
         
+        if self.__scheduled_reconnect is not None:
+            self.__scheduled_reconnect.cancel()
+            self.__scheduled_reconnect = None
+        
         t0 = time.time()
         if self.source is not self._sources[self.source_name]:
             log.msg('Flow graph: Switching RF device to %s' % (self.source_name))
@@ -237,20 +282,26 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             log.msg(u'Flow graph: Rebuilding connections because: %s' % (', '.join(self.__needs_reconnect),))
             self.__needs_reconnect = []
             
-            self._recursive_lock()
-            self.disconnect_all()
+            for _graph, graph_edges in self.__all_graphs():
+                graph_edges.begin()
             
-            self.connect(
+            edges = self.__edges_for(self.source_name)
+            edges.connect(
                 self.__monitor_rx_driver,
                 self.monitor)
-            self.connect(
+            edges.connect(
                 self.__monitor_rx_driver,
                 self.__clip_probe)
 
             # Filter receivers
             audio_rs = self.__audio_manager.reconnecting()
-            n_valid_receivers = 0
+            n_full_rate_receivers = 0
+            n_channelized_receivers = 0
             has_non_audio_receiver = False
+            null_sinks = {}
+            connected = set()
+            channel_consumers = {}  # device key -> channel -> receivers
+            subband_members = {}  # device key -> receivers
             for key, receiver in self._receivers.iteritems():
                 self._receiver_valid[key] = receiver.get_is_valid()
                 if not self._receiver_valid[key]:
@@ -258,34 +309,184 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
                 if not self.__audio_manager.validate_destination(receiver.get_audio_destination()):
                     log.err('Flow graph: receiver audio destination %r is not available' % (receiver.get_audio_destination(),))
                     continue
-                n_valid_receivers += 1
-                if n_valid_receivers > 6:
-                    # Sanity-check to avoid burning arbitrary resources
-                    # TODO: less arbitrary constant; communicate this restriction to client
-                    log.err('Flow graph: Refusing to connect more than 6 receivers')
-                    break
-                self.connect(self._sources[receiver.get_device_name()].get_rx_driver(), receiver)
+                device_name = receiver.get_device_name()
+                edges = self.__edges_for(device_name)
+                input_plan = receiver.get_input_plan()
+                if input_plan is None:
+                    n_full_rate_receivers += 1
+                    if n_full_rate_receivers > _MAX_FULL_RATE_RECEIVERS:
+                        log.err('Flow graph: Refusing to connect more than %i full-rate receivers' % (_MAX_FULL_RATE_RECEIVERS,))
+                        continue
+                    edges.connect(self._sources[device_name].get_rx_driver(), receiver)
+                elif isinstance(input_plan, ChannelPlan):
+                    n_channelized_receivers += 1
+                    if n_channelized_receivers > _MAX_CHANNELIZED_RECEIVERS:
+                        log.err('Flow graph: Refusing to connect more than %i channelized receivers' % (_MAX_CHANNELIZED_RECEIVERS,))
+                        continue
+                    channel_consumers.setdefault(device_name, {}).setdefault(receiver.get_input_channel(), []).append(receiver)
+                else:
+                    subband_members.setdefault(device_name, []).append(receiver)
+                    continue  # connected below once grouped
+                connected.add(receiver)
+            
+            subband_filters = {}
+            for device_name, members in subband_members.iteritems():
+                edges = self.__edges_for(device_name)
+                device = self._sources[device_name]
+                plan = self._get_subband_plan(device_name)
+                groups = plan.group([
+                    (receiver.get_rec_freq() - device.get_freq(), receiver.get_demodulator().get_band_shape(), receiver)
+                    for receiver in members])
+                filters = subband_filters[device_name] = []
+                for center, group in groups:
+                    n_full_rate_receivers += 1
+                    if n_full_rate_receivers > _MAX_FULL_RATE_RECEIVERS:
+                        log.err('Flow graph: Refusing to connect more than %i full-rate receivers' % (_MAX_FULL_RATE_RECEIVERS,))
+                        break
+                    subband_filter = self.__get_subband_filter(device_name, plan, len(filters))
+                    subband_filter.set_center_freq(center)
+                    filters.append(subband_filter)
+                    edges.connect(device.get_rx_driver(), subband_filter)
+                    for receiver in group:
+                        receiver.set_input_subband_center(center)
+                        edges.connect(subband_filter, receiver)
+                        connected.add(receiver)
+            
+            for key, receiver in self._receivers.iteritems():
+                if receiver not in connected:
+                    # Whether refused above or left over from a subband group we could not connect, it has no input and is not valid. If it otherwise is, the next revalidation will try again.
+                    self._receiver_valid[key] = False
+            
+            audio_bridges = {}
+            for receiver in self._receivers.itervalues():
+                if receiver not in connected:
+                    continue
+                edges = self.__edges_for(receiver.get_device_name())
                 receiver_output_type = receiver.get_output_type()
                 if receiver_output_type.get_sample_rate() <= 0:
                     # Demodulator has no output, but receiver has a dummy output, so connect it to something to satisfy flow graph structure.
-                    self.connect(receiver, blocks.null_sink(gr.sizeof_float * self.__audio_manager.get_channels()))
+                    null_sink = self.__receiver_null_sinks.get(receiver)
+                    if null_sink is None:
+                        null_sink = blocks.null_sink(gr.sizeof_float * self.__audio_manager.get_channels())
+                    null_sinks[receiver] = null_sink
+                    edges.connect(receiver, null_sink)
                     # Note that we have a non-audio receiver which may be useful even if there is no audio output
                     has_non_audio_receiver = True
                 else:
                     assert receiver_output_type.get_kind() == 'STEREO'
-                    audio_rs.input(receiver, receiver_output_type.get_sample_rate(), receiver.get_audio_destination())
+                    if self.__partitions is None:
+                        audio_source = receiver
+                    else:
+                        bridge = self.__audio_bridges.get(receiver)
+                        if bridge is None or bridge.sample_rate != receiver_output_type.get_sample_rate():
+                            bridge = _AudioBridge(self.__audio_manager.get_channels(), receiver_output_type.get_sample_rate())
+                        audio_bridges[receiver] = bridge
+                        edges.connect(receiver, bridge.sink)
+                        audio_source = bridge.source
+                    audio_rs.input(audio_source, receiver_output_type.get_sample_rate(), receiver.get_audio_destination())
+            
+            channelizers = {}
+            for device_name, consumers in channel_consumers.iteritems():
+                edges = self.__edges_for(device_name)
+                channelizer = self.__get_channelizer(device_name)
+                channelizers[device_name] = channelizer
+                edges.connect(self._sources[device_name].get_rx_driver(), channelizer)
+                channelizer.connect_outputs(edges, consumers)
             
             self.__has_a_useful_receiver = audio_rs.finish_bus_connections() or \
                 has_non_audio_receiver
+            self.__receiver_null_sinks = null_sinks
+            self.__channelizers = channelizers
+            self.__subband_filters = subband_filters
+            self.__audio_bridges = audio_bridges
             
-            self._recursive_unlock()
+            changes = self.__apply_edges()
             # (this is in an if block but it can't not execute if anything else did)
-            log.msg('Flow graph: ...done reconnecting (%i ms).' % ((time.time() - t0) * 1000,))
+            log.msg('Flow graph: ...done reconnecting (%i ms, %i edges changed).' % ((time.time() - t0) * 1000, changes))
             
             self.__start_or_stop_later()
         
         self.__in_reconnect = False
 
+    def _get_channel_plan(self, device_key):
+        """for ContextForReceiver only"""
+        return plan_channels(self._sources[device_key].get_rx_driver().get_output_type().get_sample_rate())
+    
+    def __all_graphs(self):
+        """Return (top block, FlowgraphEdges) pairs for all flow graphs, starting with the main one."""
+        graphs = [(self, self.__edges)]
+        if self.__partitions is not None:
+            graphs.extend((partition, partition.edges) for partition in self.__partitions.itervalues())
+        return graphs
+    
+    def __edges_for(self, device_key):
+        """Return the FlowgraphEdges for the flow graph containing the given device."""
+        if self.__partitions is None:
+            return self.__edges
+        else:
+            return self.__partitions[device_key].edges
+    
+    def __apply_edges(self):
+        graphs = self.__all_graphs()
+        # Blocks moving between partitions (because the monitor or a receiver switched devices) must leave their old flow graph before joining the new one.
+        if len(graphs) > 1:
+            for graph, graph_edges in graphs:
+                elsewhere = frozenset().union(*[
+                    other_edges.get_desired_blocks()
+                    for other_graph, other_edges in graphs
+                    if other_graph is not graph])
+                moving = graph_edges.get_blocks() & elsewhere
+                if moving:
+                    graph_edges.retract(moving, graph._recursive_lock, graph._recursive_unlock)
+        changes = 0
+        for graph, graph_edges in graphs:
+            changes += graph_edges.apply(graph._recursive_lock, graph._recursive_unlock)
+        if self.__partitions is not None:
+            self.__update_partitions_running()
+        return changes
+    
+    def __update_partitions_running(self):
+        # GNU Radio does not allow starting a top block with nothing in it, so each graph runs only while it is nonempty.
+        for graph, graph_edges in self.__all_graphs():
+            should_run = self.__running and not graph_edges.is_empty()
+            if graph is self:
+                if should_run != self.__main_running:
+                    if should_run:
+                        gr.top_block.start(self)
+                    else:
+                        gr.top_block.stop(self)
+                        gr.top_block.wait(self)
+                    self.__main_running = should_run
+            else:
+                graph.set_running(should_run)
+    
+    def _graph_containing(self, block):
+        """for _ContainingGraphContext only
+        
+        Return the top block which the given block is currently connected in, or the main top block if none."""
+        if self.__partitions is not None:
+            for partition in self.__partitions.itervalues():
+                if block in partition.edges.get_blocks():
+                    return partition
+        return self
+    
+    def _get_subband_plan(self, device_key):
+        """for ContextForReceiver only"""
+        return plan_subbands(self._sources[device_key].get_rx_driver().get_output_type().get_sample_rate())
+    
+    def __get_subband_filter(self, device_key, plan, index):
+        existing = self.__subband_filters.get(device_key, [])
+        if index < len(existing) and existing[index].get_plan() == plan:
+            return existing[index]
+        return SubbandFilter(plan)
+    
+    def __get_channelizer(self, device_key):
+        plan = self._get_channel_plan(device_key)
+        channelizer = self.__channelizers.get(device_key)
+        if channelizer is None or channelizer.get_plan() != plan:
+            channelizer = ChannelizerBank(plan)
+        return channelizer
+    
     def __device_vfo_callback(self, device_key):
         reactor.callLater(
             self._sources[device_key].get_rx_driver().get_tune_delay(),
@@ -301,13 +502,11 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
             if receiver.get_device_name() == device_key:
                 receiver.changed_device_freq()
                 self._update_receiver_validity(rec_key)
-            # TODO: If multiple receivers change validity we'll do redundant reconnects in this loop; avoid that.
 
     def _update_receiver_validity(self, key):
         receiver = self._receivers[key]
         if receiver.get_is_valid() != self._receiver_valid[key]:
-            self.__needs_reconnect.append(u'receiver %s validity changed' % (key,))
-            self._do_connect()
+            self._schedule_reconnect(u'receiver %s validity changed' % (key,))
     
     @exported_value(type=ReferenceT(), changes='never')
     def get_monitor(self):
@@ -336,6 +535,11 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
     
     def start(self, **kwargs):
         # pylint: disable=arguments-differ
+        if self.__partitions is not None:
+            self.__running = True
+            self.__update_partitions_running()
+            return
+        
         # trigger reconnect/restart notification
         self._recursive_lock()
         self._recursive_unlock()
@@ -344,8 +548,18 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         self.__running = True
 
     def stop(self):
+        if self.__partitions is not None:
+            self.__running = False
+            self.__update_partitions_running()  # also waits
+            return
+        
         super(Top, self).stop()
         self.__running = False
+    
+    def wait(self):
+        if self.__partitions is not None:
+            return  # stop() already waited
+        super(Top, self).wait()
 
     def __start_or_stop(self):
         # TODO: Improve start/stop conditions:
@@ -373,6 +587,11 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         """Close all devices in preparation for a clean shutdown.
         
         Makes this top block unusable"""
+        if self.__scheduled_reconnect is not None:
+            self.__scheduled_reconnect.cancel()
+            self.__scheduled_reconnect = None
+        for receiver in self._receivers.itervalues():
+            receiver.close()
         for device in self._sources.itervalues():
             device.close()
         for device in self._accessories.itervalues():
@@ -404,19 +623,44 @@ class Top(gr.top_block, ExportedState, RecursiveLockBlockMixin):
         """for ContextForReceiver only"""
         return self.__audio_manager.get_destination_type()
     
+    def _get_workers_enabled(self):
+        """for ContextForReceiver only"""
+        return self.__workers_enabled
+    
     def _trigger_reconnect(self, reason):
         self.__needs_reconnect.append(reason)
         self._do_connect()
     
     def _recursive_lock_hook(self):
+        if self.__partitions is not None:
+            return  # sources are not in this graph; each _DevicePartition notifies its own
         for source in self._sources.itervalues():
             source.notify_reconnecting_or_restarting()
 
 
-class ContextForReceiver(Context):
-    def __init__(self, top, key):
+class _ContainingGraphContext(Context):
+    """
+    Context which locks whichever top block (the Top or one of its partitions) the block returned by get_block is currently in.
+    """
+    def __init__(self, top, get_block):
         Context.__init__(self, top)
         self.__top = top
+        self.__get_block = get_block
+        self.__locked = []
+    
+    def lock(self):
+        graph = self.__top._graph_containing(self.__get_block())
+        graph._recursive_lock()
+        self.__locked.append(graph)
+    
+    def unlock(self):
+        self.__locked.pop()._recursive_unlock()
+
+
+class ContextForReceiver(_ContainingGraphContext):
+    def __init__(self, top, key):
+        _ContainingGraphContext.__init__(self, top, lambda: self._receiver)
+        self.__top = top
         self._key = key
         self._enabled = False  # assigned outside
         self._receiver = None  # assigned outside
@@ -479,6 +723,20 @@ class ContextForReceiver(Context):
         if self._enabled:
             self.__top._trigger_reconnect(u'receiver %s: %s' % (self._key, reason))
     
+    def get_channel_plan(self, device_key):
+        return self.__top._get_channel_plan(device_key)
+    
+    def get_subband_plan(self, device_key):
+        return self.__top._get_subband_plan(device_key)
+    
+    def get_workers_enabled(self):
+        return self.__top._get_workers_enabled()
+    
+    def changed_input(self):
+        # Scheduled rather than immediate because retuning a device moves many receivers to different channels or subbands at once.
+        if self._enabled:
+            self.__top._schedule_reconnect(u'receiver %s: needs different channel or subband' % (self._key,))
+    
     def output_message(self, message):
         self.__top.get_telemetry_store().receive(message)
 
@@ -555,7 +813,7 @@ class MaxProbe(gr.hier_block2, ExportedState):
         # shortcut method implementation
         self.level = self.__sink.level
     
-    @exported_value(type=NoticeT(always_visible=False), changes='continuous')
+    @exported_value(type=NoticeT(always_visible=False), changes='continuous', poll_interval=0.5)
     def get_clip_warning(self):
         if not self.__absurd:
             magnitude_squared = self.level()
@@ -574,3 +832,44 @@ def base26(x):
         return 'abcdefghijklmnopqrstuvwxyz'[x]
     else:
         return base26(x // 26 - 1) + base26(x % 26)
+
+
+class _DevicePartition(gr.top_block, RecursiveLockBlockMixin):
+    """
+    When Top is partitioned (the 'device_partitions' feature), the flow graph containing one device and the receivers and monitor using it.
+    """
+    def __init__(self, device):
+        gr.top_block.__init__(self, type(self).__name__)
+        self.__device = device
+        self.__running = False
+        self.edges = FlowgraphEdges(self)
+    
+    def set_running(self, value):
+        if value == self.__running:
+            return
+        if value:
+            # trigger reconnect/restart notification
+            self._recursive_lock()
+            self._recursive_unlock()
+            self.start()
+        else:
+            self.stop()
+            self.wait()
+        self.__running = value
+    
+    def _recursive_lock_hook(self):
+        self.__device.notify_reconnecting_or_restarting()
+
+
+class _AudioBridge(object):
+    """
+    Carries a receiver's audio from its _DevicePartition to the main flow graph.
+    
+    Neither side blocks the other: the sink drops audio when the queue is full, so a stalled audio graph cannot stall a device's graph, and the source outputs silence when the queue is empty, so a stalled, locked, or stopped device's graph cannot stall the audio of the others.
+    """
+    def __init__(self, channels, sample_rate):
+        itemsize = gr.sizeof_float * channels
+        queue = gr.msg_queue(limit=_AUDIO_BRIDGE_QUEUE_LIMIT)
+        self.sample_rate = sample_rate
+        self.sink = blocks.message_sink(itemsize, queue, True)
+        self.source = PacedMessageSource(channels, queue, sample_rate)
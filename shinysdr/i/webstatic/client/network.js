@@ -161,7 +161,7 @@ define([
   RemoteCommandCell.prototype = Object.create(CommandCell.prototype, {constructor: {value: RemoteCommandCell}});
   //exports.CommandCell = CommandCell;  // not yet needed, params in flux, so not exported yet
   
-  function BulkDataCell(setter, initialElementsJson, metadata) {
+  function BulkDataCell(setter, initialElementsJson, metadata, viewSetter) {
     let type = metadata.value_type;
     
     let currentElements = Array.prototype.map.call(initialElementsJson,
@@ -195,6 +195,11 @@ define([
         callback(element);
       }
     };
+    
+    // Ask the server to send at most maxRate elements per second, each with at most maxBins array items (which it will reduce by taking the maximum of adjacent items). null means no limit.
+    this.setViewLimits = function(maxRate, maxBins) {
+      viewSetter(maxRate, maxBins);
+    };
   }
   BulkDataCell.prototype = Object.create(ReadCell.prototype, {constructor: {value: BulkDataCell}});
   exports.BulkDataCell = BulkDataCell;
@@ -257,6 +262,19 @@ define([
     });
   }
   
+  // Serial used in binary frames for records containing JSON messages rather than bulk data.
+  const JSON_RECORD_ID = 0xFFFFFFFF;
+  // Leading word of a binary frame which is compressed (bulk encoding 'delta-deflate').
+  const COMPRESSED_FRAME_ID = 0xFFFFFFFE;
+  const DELTA_ELEMENT = 1;
+  const jsonDecoder = new TextDecoder('utf-8');
+  const canDecompress = typeof DecompressionStream !== 'undefined';
+  
+  function inflate(buffer) {
+    const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Response(stream).arrayBuffer();
+  }
+  
   const minRetryTime = 1000;
   const maxRetryTime = 20000;
   const backoff = 1.05;
@@ -312,7 +330,7 @@ define([
   }
   
   // TODO: too many args, figure out an object that is a sensible bundle
-  function makeCell(url, setter, id, desc, initialValue, idMap) {
+  function makeCell(url, setter, viewSetter, id, desc, initialValue, idMap) {
     const type = typeFromDesc(desc.metadata.value_type);
     const metadata = {
       value_type: type,
@@ -326,7 +344,7 @@ define([
       cell = new ReadCell(setter, /* dummy */ makeBlock(url, []), metadata, id => idMap[id]);
     } else if (type instanceof BulkDataT) {
       // TODO can we eliminate this special case
-      cell = new BulkDataCell(setter, initialValue, metadata);
+      cell = new BulkDataCell(setter, initialValue, metadata, viewSetter);
     } else if (desc.type === 'command_cell') {
       cell = new RemoteCommandCell(setter, metadata);
     } else if (desc.writable) {
@@ -346,6 +364,9 @@ define([
     retryingConnection(() => new WebSocket(rootURL), connectionStateCallback, ws => {
       ws.addEventListener('open', event => {
         ws.send('');  // dummy required due to server limitation
+        if (canDecompress) {
+          ws.send(JSON.stringify(['bulk_encoding', 'delta-deflate']));
+        }
       }, true);
 
       ws.binaryType = 'arraybuffer';
@@ -358,6 +379,11 @@ define([
       const callbackMap = Object.create(null);
       let nextCallbackId = 0;
       
+      // Last element received per cell id, to which delta-encoded elements are relative.
+      const previousBulk = Object.create(null);
+      // Decompression is asynchronous, so while any is in progress further messages must wait for it to preserve ordering.
+      let pendingDecode = null;
+      
       idMap[0] = rootCell;
       updaterMap[0] = function (id) { rootCell._update(idMap[id]); };
       isCellMap[0] = true;
@@ -380,7 +406,10 @@ define([
                 callbackMap[cbid] = callback;
                 ws.send(JSON.stringify(['set', id, value, cbid]));
               }
-              return makeCell(url, setter, id, desc, initialValue, idMap);
+              function viewSetter(maxRate, maxBins) {
+                ws.send(JSON.stringify(['bulk_view', id, maxRate, maxBins]));
+              }
+              return makeCell(url, setter, viewSetter, id, desc, initialValue, idMap);
             }());
             idMap[id] = pair[0];
             updaterMap[id] = pair[1];
@@ -422,6 +451,7 @@ define([
           }
           case 'delete': {
             // TODO: explicitly invalidate the objects so we catch hanging on to them too long
+            delete previousBulk[id];
             delete idMap[id];
             delete updaterMap[id];
             delete isCellMap[id];
@@ -437,23 +467,74 @@ define([
         }
       }
       
-      function oneBinaryMessage(buffer) {
-        // Currently, BulkDataCell updates are the only type of binary messages.
-        var view = new DataView(buffer);
-        var id = view.getUint32(0, true);
-        var cell_updater = updaterMap[id];
-        // TODO: should go through the 'append' path but that is not properly generalized yet
-        cell_updater(buffer);
+      function decodeDelta(buffer, start, end) {
+        // Convert a record with a flag byte after the id (from a compressed frame) into a plain one.
+        const id = new DataView(buffer).getUint32(start, true);
+        const result = new Uint8Array(end - start - 1);
+        result.set(new Uint8Array(buffer, start, 4), 0);
+        const element = result.subarray(4);
+        element.set(new Uint8Array(buffer, start + 5, end - start - 5));
+        if (new Uint8Array(buffer, start + 4, 1)[0] === DELTA_ELEMENT) {
+          const previous = previousBulk[id];
+          for (let i = 0; i < element.length; i++) {
+            element[i] += previous[i];
+          }
+        }
+        previousBulk[id] = element;
+        return result.buffer;
+      }
+      
+      function oneBinaryMessage(buffer, hasDeltas) {
+        // A binary message is a frame of length-prefixed records, each of which is either a BulkDataCell update (beginning with the cell's id) or a batch of JSON messages. See shinysdr/i/network/export_ws.py for details.
+        const view = new DataView(buffer);
+        let offset = 0;
+        while (offset < buffer.byteLength) {
+          const length = view.getUint32(offset, true);
+          const start = offset + 4;
+          offset = start + length;
+          const id = view.getUint32(start, true);
+          if (id === JSON_RECORD_ID) {
+            JSON.parse(jsonDecoder.decode(new Uint8Array(buffer, start + 4, length - 4)))
+              .forEach(oneMessage);
+          } else {
+            const cell_updater = updaterMap[id];
+            // TODO: should go through the 'append' path but that is not properly generalized yet
+            // slice() because the updater expects the record to begin its buffer
+            cell_updater(hasDeltas ? decodeDelta(buffer, start, offset) : buffer.slice(start, offset));
+          }
+        }
+      }
+      
+      function oneFrame(data) {
+        if (typeof data === 'string') {
+          JSON.parse(data).forEach(oneMessage);
+        } else if (data instanceof ArrayBuffer) {
+          if (data.byteLength >= 4 && new DataView(data).getUint32(0, true) === COMPRESSED_FRAME_ID) {
+            return inflate(data.slice(4)).then(inflated => oneBinaryMessage(inflated, true));
+          } else {
+            oneBinaryMessage(data, false);
+          }
+        } else {
+          console.error('Unknown object from state stream onmessage:', data);
+        }
+        return null;
       }
       
       ws.onmessage = function (event) {
         // TODO: close connection on exception here
-        if (typeof event.data === 'string') {
-          JSON.parse(event.data).forEach(oneMessage);
-        } else if (event.data instanceof ArrayBuffer) {
-          oneBinaryMessage(event.data);
+        const data = event.data;
+        if (pendingDecode) {
+          pendingDecode = pendingDecode.then(() => oneFrame(data));
         } else {
-          console.error('Unknown object from state stream onmessage:', event.data);
+          pendingDecode = oneFrame(data);
+        }
+        if (pendingDecode) {
+          const thisDecode = pendingDecode = pendingDecode.then(() => {
+            if (pendingDecode === thisDecode) pendingDecode = null;
+          }, error => {
+            console.error('Error decoding state stream message:', error);
+            if (pendingDecode === thisDecode) pendingDecode = null;
+          });
         }
       };
       
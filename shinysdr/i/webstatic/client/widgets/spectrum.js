@@ -587,6 +587,8 @@ define([
       ignore('fft');
       ignore('scope');
       ignore('window_type');
+      ignore('integration');  // handled by MonitorDetailedOptions
+      ignore('integration_frames');
       addWidget('frame_rate', LogSlider, 'Rate');
       if (block.freq_resolution && block.freq_resolution.set) {  // for audio monitor
         addWidget('freq_resolution', LogSlider, 'Resolution');
@@ -664,6 +666,7 @@ define([
     var ctx2d = canvas.getContext('2d');
     
     var dataHook = function () {}, drawOuter = function () {};
+    var requestedMaxBins = null;
     
     const draw = config.scheduler.claim(function drawOuterTrampoline() {
       view.n.listen(draw);
@@ -681,6 +684,16 @@ define([
         cleared = true;
       }
       
+      // Ask the server for no more bins than there are pixels across the whole (zoomed) spectrum, so that narrow displays such as phones receive less data. Rounded up to a power of two so that zooming does not send a request every frame. (Local cells such as the audio analyser's have no view limits.)
+      const totalWidth = view.getTotalPixelWidth();
+      if (fftCell.setViewLimits && totalWidth > 0) {
+        const maxBins = Math.pow(2, Math.ceil(Math.log2(totalWidth)));
+        if (maxBins !== requestedMaxBins) {
+          requestedMaxBins = maxBins;
+          fftCell.setViewLimits(null, maxBins);
+        }
+      }
+      
       drawOuter(cleared);
     });
     
@@ -0,0 +1,480 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Running demodulators in separate worker processes.
+
+A WorkerDemodulator stands in for a demodulator in the server's flow graph. The real demodulator runs in a child process (this module's main()); the receiver's input signal is passed to it, and its audio output back, through pipes, while its cells, messages, and settings are passed through the child's stdin and stdout as pickled frames.
+
+Demodulators doing heavy work in Python, or holding the GIL for long periods, then no longer compete with the reactor and with each other.
+
+This module is not an external API and not guaranteed to have a stable
+interface.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import cPickle as pickle
+import errno
+import fcntl
+import os
+import struct
+import sys
+import threading
+import time
+
+from twisted.internet import reactor
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+from zope.interface import alsoProvides, implementer  # available via Twisted
+
+import numpy
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.i.blocks import PacedMessageSource
+from shinysdr.i.modes import lookup_mode
+from shinysdr.i.poller import the_subscription_context
+from shinysdr.interfaces import IDemodulator, IDemodulatorContext, ITunableDemodulator
+from shinysdr.values import ExportedState, LooseCell, PollingCell, unserialize_exported_state
+
+
+__all__ = []  # appended later
+
+
+# Child file descriptors, besides stdin and stdout which carry control frames.
+_IQ_FD = 3
+_AUDIO_FD = 4
+
+# Seconds between the child's checks for changed cell values.
+_POLL_INTERVAL = 0.1
+
+_FRAME_HEADER = struct.Struct(b'>I')
+
+# Maximum number of messages of the worker's audio waiting for the server's flow graph; beyond this, audio is dropped.
+_AUDIO_QUEUE_LIMIT = 8
+_AUDIO_READ_SIZE = 65536
+
+
+def _encode_frame(message):
+    """Encode a control message (any picklable value) as a length-prefixed frame."""
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _FRAME_HEADER.pack(len(data)) + data
+
+
+class _FrameDecoder(object):
+    """Accumulates bytes and returns the control messages encoded by _encode_frame as they are completed."""
+    def __init__(self):
+        self.__buffer = b''
+
+    def feed(self, data):
+        self.__buffer += data
+        messages = []
+        while len(self.__buffer) >= _FRAME_HEADER.size:
+            (length,) = _FRAME_HEADER.unpack_from(self.__buffer)
+            end = _FRAME_HEADER.size + length
+            if len(self.__buffer) < end:
+                break
+            messages.append(pickle.loads(self.__buffer[_FRAME_HEADER.size:end]))
+            self.__buffer = self.__buffer[end:]
+        return messages
+
+
+def _mirrorable_cells(demodulator):
+    """Return the cells of demodulator which a WorkerDemodulator mirrors.
+
+    Nested objects and streaming cells are not mirrored.
+    """
+    return {
+        key: cell
+        for key, cell in demodulator.state().iteritems()
+        if isinstance(cell, (PollingCell, LooseCell)) and not cell.type().is_reference()
+    }
+
+
+def _output_channels(output_type):
+    return 2 if output_type.get_kind() == 'STEREO' else 1
+
+
+def _output_item_size(output_type):
+    return gr.sizeof_float * _output_channels(output_type)
+
+
+class _DroppingFDSink(gr.sync_block):
+    """Writes complex samples to a file descriptor (a pipe) without ever blocking.
+    
+    Samples which the reader is not keeping up with are dropped, as are all samples once the reader has exited, so that a slow or dead worker cannot stall the server's flow graph.
+    """
+    def __init__(self, fd):
+        gr.sync_block.__init__(
+            self,
+            name=type(self).__name__,
+            in_sig=[numpy.complex64],
+            out_sig=None)
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.__fd = fd
+        self.__lock = threading.Lock()  # so that close() cannot close the fd during a write, to be reused by something else
+        self.__partial = b''  # remainder of an item only partly written
+    
+    def work(self, input_items, output_items):
+        in_items = input_items[0]
+        with self.__lock:
+            if self.__fd is None:
+                return len(in_items)
+            try:
+                if self.__partial:
+                    self.__partial = self.__partial[os.write(self.__fd, self.__partial):]
+                if not self.__partial:
+                    data = in_items.tostring()
+                    written = os.write(self.__fd, data)
+                    # The rest of a partly written item must follow so that the reader stays aligned to items; the other unwritten items are dropped.
+                    itemsize = in_items.itemsize
+                    self.__partial = data[written:-(-written // itemsize) * itemsize]
+            except OSError as e:
+                if e.errno == errno.EPIPE:
+                    # reader has exited
+                    self.__close()
+                elif e.errno != errno.EAGAIN:
+                    raise
+        return len(in_items)
+    
+    def close(self):
+        with self.__lock:
+            self.__close()
+    
+    def __close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+
+def _read_audio(fd, itemsize, queue):
+    """Copy audio from fd to queue, as messages of whole items, until EOF (the worker has exited). Audio is dropped when the queue is full.
+    
+    RUNS IN A SEPARATE THREAD.
+    """
+    data = b''
+    try:
+        while True:
+            chunk = os.read(fd, _AUDIO_READ_SIZE)
+            if not chunk:
+                return
+            data += chunk
+            usable = len(data) - len(data) % itemsize
+            if usable and not queue.full_p():
+                queue.insert_tail(gr.message_from_string(data[:usable], 0, itemsize, usable // itemsize))
+            data = data[usable:]
+    finally:
+        os.close(fd)
+
+
+@implementer(IDemodulator)
+class WorkerDemodulator(gr.hier_block2, ExportedState):
+    """Runs a demodulator in a worker process.
+
+    shadow is an instance of the demodulator, constructed as usual but never connected, which supplies the output type and band shape, and to which settings are applied as well as to the worker's instance so that they stay accurate.
+
+    If the shadow is an ITunableDemodulator, so is the WorkerDemodulator.
+    
+    If the worker process exits unexpectedly, this block continues to accept input and outputs silence, and died (if not None) is called with no arguments so that the owner can replace it.
+    """
+    def __init__(self, mode, input_rate, shadow, context, died=None):
+        output_type = shadow.get_output_type()
+        has_output = output_type.get_kind() != 'NONE'
+        gr.hier_block2.__init__(
+            self, type(self).__name__,
+            gr.io_signature(1, 1, gr.sizeof_gr_complex),
+            gr.io_signature(1, 1, _output_item_size(output_type)) if has_output else gr.io_signature(0, 0, 0))
+        self.__shadow = shadow
+        self.__context = context
+        self.__died = died
+        self.__closed = False
+        if ITunableDemodulator.providedBy(shadow):
+            alsoProvides(self, ITunableDemodulator)
+
+        self.__cells = {}
+        for key, cell in _mirrorable_cells(shadow).iteritems():
+            self.__cells[key] = self.__make_mirror_cell(key, cell)
+
+        iq_read, iq_write = os.pipe()
+        audio_read, audio_write = os.pipe()
+        self.__protocol = _WorkerProtocol(self)
+        try:
+            reactor.spawnProcess(
+                self.__protocol,
+                sys.executable,
+                args=[sys.executable, '-m', __name__],
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p)),
+                childFDs={0: 'w', 1: 'r', 2: 2, _IQ_FD: iq_read, _AUDIO_FD: audio_write})
+        finally:
+            # the child has its own copies; the blocks below take ownership of ours
+            os.close(iq_read)
+            os.close(audio_write)
+        self.__protocol.send(('init', {
+            'mode': mode,
+            'input_rate': input_rate,
+            'state': shadow.state_to_json(),
+        }))
+
+        self.__iq_sink = _DroppingFDSink(iq_write)
+        self.connect(self, self.__iq_sink)
+        if has_output:
+            audio_queue = gr.msg_queue(limit=_AUDIO_QUEUE_LIMIT)
+            audio_thread = threading.Thread(
+                name='WorkerDemodulator audio',
+                target=_read_audio,
+                args=(audio_read, _output_item_size(output_type), audio_queue))
+            audio_thread.daemon = True
+            audio_thread.start()
+            self.connect(
+                PacedMessageSource(_output_channels(output_type), audio_queue, output_type.get_sample_rate()),
+                self)
+        else:
+            os.close(audio_read)
+
+        freq_cell = context.get_absolute_frequency_cell()
+        self.__protocol.send(('freq', freq_cell.get()))
+        _, self.__freq_subscription = freq_cell.subscribe2(
+            lambda value: self.__protocol.send(('freq', value)),
+            the_subscription_context)
+
+    def __make_mirror_cell(self, key, cell):
+        metadata = cell.metadata()
+        naming = metadata.naming.to_json()
+        if cell.isWritable():
+            def post_hook(value):
+                cell.set(value)
+                self.__protocol.send(('set', key, value))
+        else:
+            post_hook = None
+        return LooseCell(
+            value=cell.get(),
+            type=metadata.value_type,
+            persists=metadata.persists,
+            writable=cell.isWritable(),
+            post_hook=post_hook,
+            label=naming['label'],
+            description=naming['description'],
+            sort_key=naming['sort_key'],
+            associated_key=key)
+
+    def state_def(self):
+        for d in super(WorkerDemodulator, self).state_def():
+            yield d
+        for d in self.__cells.iteritems():
+            yield d
+
+    def get_band_shape(self):
+        """implement IDemodulator"""
+        return self.__shadow.get_band_shape()
+
+    def get_output_type(self):
+        """implement IDemodulator"""
+        return self.__shadow.get_output_type()
+
+    def set_rec_freq(self, freq):
+        """implement ITunableDemodulator, if the shadow does"""
+        self.__shadow.set_rec_freq(freq)
+        self.__protocol.send(('rec_freq', freq))
+
+    def close(self):
+        """Stop the worker process. Call after disconnecting this block."""
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__freq_subscription.unsubscribe()
+        self.__protocol.close()
+        self.__iq_sink.close()
+
+    def _received(self, message):
+        """Called by _WorkerProtocol."""
+        verb = message[0]
+        if verb == 'cell':
+            _, key, value = message
+            cell = self.__cells.get(key)
+            if cell is not None:
+                cell.set_internal(value)
+        elif verb == 'message':
+            self.__context.output_message(message[1])
+        else:
+            log.msg('WorkerDemodulator: unknown message from worker: %r' % (verb,))
+
+    def _ended(self, reason):
+        """Called by _WorkerProtocol."""
+        if not self.__closed:
+            log.msg('WorkerDemodulator: worker process ended unexpectedly: %s' % (reason.getErrorMessage(),))
+            self.__iq_sink.close()
+            if self.__died is not None:
+                self.__died()
+
+
+__all__.append('WorkerDemodulator')
+
+
+class _WorkerProtocol(ProcessProtocol):
+    def __init__(self, demodulator):
+        self.__demodulator = demodulator
+        self.__decoder = _FrameDecoder()
+        self.__pending = []  # frames sent before the process has started
+
+    def connectionMade(self):
+        for frame in self.__pending:
+            self.transport.write(frame)
+        self.__pending = None
+
+    def send(self, message):
+        frame = _encode_frame(message)
+        if self.__pending is not None:
+            self.__pending.append(frame)
+        elif self.transport is not None:
+            self.transport.write(frame)
+
+    def close(self):
+        # Closing stdin tells the worker to exit.
+        if self.transport is not None:
+            self.transport.closeStdin()
+
+    def childDataReceived(self, childFD, data):
+        try:
+            messages = self.__decoder.feed(data)
+        except Exception:
+            log.err(None, 'WorkerDemodulator: bad data from worker')
+            self.transport.loseConnection()
+            return
+        for message in messages:
+            self.__demodulator._received(message)
+
+    def processEnded(self, reason):
+        self.__demodulator._ended(reason)
+
+
+@implementer(IDemodulatorContext)
+class _WorkerContext(object):
+    """The IDemodulatorContext of the demodulator in a worker process."""
+    def __init__(self, send):
+        self.__send = send
+        self._top_block = None  # assigned outside
+        self.freq_cell = LooseCell(value=0.0, type=float, writable=False, persists=False)
+
+    def rebuild_me(self):
+        # The shadow in the server process gets the same settings and will ask for the rebuild itself.
+        pass
+
+    def lock(self):
+        self._top_block.lock()
+
+    def unlock(self):
+        self._top_block.unlock()
+
+    def output_message(self, message):
+        self.__send(('message', message))
+
+    def get_absolute_frequency_cell(self):
+        return self.freq_cell
+
+
+def main():
+    """Worker process entry point; see WorkerDemodulator."""
+    log.startLogging(sys.stderr)
+    # Keep stdout for frames only; anything else printed goes to stderr.
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    write_lock = threading.Lock()
+
+    def send(message):
+        try:
+            frame = _encode_frame(message)
+        except Exception:
+            log.err(None, 'worker: could not encode message')
+            return
+        with write_lock:
+            out.write(frame)
+            out.flush()
+
+    decoder = _FrameDecoder()
+
+    def read_messages():
+        while True:
+            data = os.read(0, 65536)
+            if not data:
+                return
+            for message in decoder.feed(data):
+                yield message
+
+    messages = read_messages()
+    verb, init = next(messages)
+    assert verb == 'init'
+
+    mode_def = lookup_mode(init['mode'])
+    context = _WorkerContext(send)
+    demodulator = IDemodulator(unserialize_exported_state(
+        ctor=mode_def.demod_class,
+        state=init['state'],
+        kwargs=dict(mode=init['mode'], input_rate=init['input_rate'], context=context)))
+    if ITunableDemodulator.providedBy(demodulator):
+        # until told otherwise by a 'rec_freq' message
+        demodulator.set_rec_freq(0.0)
+
+    top_block = context._top_block = gr.top_block(b'WorkerDemodulator')
+    top_block.connect(blocks.file_descriptor_source(gr.sizeof_gr_complex, _IQ_FD, False), demodulator)
+    output_type = demodulator.get_output_type()
+    if output_type.get_kind() != 'NONE':
+        top_block.connect(demodulator, blocks.file_descriptor_sink(_output_item_size(output_type), _AUDIO_FD))
+    else:
+        os.close(_AUDIO_FD)
+    top_block.start()
+
+    cells = _mirrorable_cells(demodulator)
+    finished = threading.Event()
+
+    def control():
+        for message in messages:
+            verb = message[0]
+            if verb == 'set':
+                _, key, value = message
+                try:
+                    cells[key].set(value)
+                except Exception:
+                    log.err(None, 'worker: could not set %r' % (key,))
+            elif verb == 'freq':
+                context.freq_cell.set_internal(message[1])
+            elif verb == 'rec_freq':
+                demodulator.set_rec_freq(message[1])
+        finished.set()
+
+    control_thread = threading.Thread(target=control, name='WorkerDemodulator control')
+    control_thread.daemon = True
+    control_thread.start()
+
+    unset = object()
+    last_values = {}
+    while not finished.is_set():
+        for key, cell in cells.iteritems():
+            value = cell.get()
+            if last_values.get(key, unset) != value:
+                last_values[key] = value
+                send(('cell', key, value))
+        time.sleep(_POLL_INTERVAL)
+
+    top_block.stop()
+    # Don't wait for blocks which may be stuck on the pipes.
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -247,7 +247,9 @@ class ModeDef(object):
             info,
             demod_class,
             mod_class=None,
-            unavailability=None):
+            unavailability=None,
+            channelizable=False,
+            reusable=True):
         """
         mode: String uniquely identifying this mode, typically a standard abbreviation written in uppercase letters (e.g. "USB", "WFM").
         info: An EnumRow object with a label for the mode, or a string.
@@ -255,6 +257,8 @@ class ModeDef(object):
         demod_class: Class (or factory function) to instantiate to create a demodulator for this mode. Should provide IDemodulatorFactory but need not declare it.
         mod_class: Class (or factory function) to instantiate to create a modulator for this mode. Should provide IModulatorFactory but need not declare it.
         unavailability: This mode definition will be ignored if this is a string rather than None. The string should be an error message informative to the user (plain text, significant whitespace).
+        channelizable: If true, the demodulator works correctly given any input_rate which is much lower than a typical device's but comfortably greater than its own bandwidth, and its get_band_shape() does not depend on input_rate, so that receivers may give it a narrow channel or subband from shared front-end filtering as input. (Whether its band shape actually fits is still checked.)
+        reusable: If false, receivers will not keep demodulators of this mode which they have stopped using in order to use them again later. Set this if the demodulator has effects for as long as it exists, such as running an external process. Such demodulators are also never run in receiver worker processes, since that requires an idle instance in the server process.
         """
         if isinstance(unavailability, bool):
             raise Exception('unavailability should be a string or None')
@@ -264,6 +268,8 @@ class ModeDef(object):
         self.demod_class = demod_class
         self.mod_class = mod_class
         self.unavailability = None if unavailability is None else unicode(unavailability)
+        self.channelizable = bool(channelizable)
+        self.reusable = bool(reusable)
         
     @property
     def available(self):
@@ -94,6 +94,11 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
     execute_config(config_obj, args.config_path)
     yield config_obj._wait_and_validate()
     
+    from shinysdr.filters import save_filter_cache, use_filter_cache_file  # loads gnuradio
+    if config_obj._filter_cache_filename is not None:
+        use_filter_cache_file(config_obj._filter_cache_filename)
+    reactor.addSystemEventTrigger('during', 'shutdown', save_filter_cache)
+    
     log.msg('Constructing...')
     app = config_obj._create_app()
     
@@ -106,6 +111,9 @@ def _main_async(reactor, argv=None, _abort_for_test=False):
         filename=config_obj._state_filename,
         get_defaults=_app_defaults)
     
+    # Most filters have been designed by now.
+    save_filter_cache()
+    
     log.msg('Starting web server...')
     services = MultiService()
     for maker in config_obj._service_makers:
@@ -30,7 +30,7 @@ from gnuradio.filter import firdes
 
 from shinysdr.interfaces import BandShape, ModeDef, IDemodulator, IModulator, ITunableDemodulator
 from shinysdr.math import dB, to_dB
-from shinysdr.filters import MultistageChannelFilter, make_resampler, design_sawtooth_filter
+from shinysdr.filters import MultistageChannelFilter, TunableChannelFilterMixin, make_resampler, design_sawtooth_filter
 from shinysdr.signals import SignalType
 from shinysdr.types import EnumT, EnumRow, RangeT
 from shinysdr import units
@@ -102,8 +102,7 @@ class SquelchMixin(ExportedState):
         self.rf_squelch_block.set_threshold(level)
 
 
-@implementer(ITunableDemodulator)
-class SimpleAudioDemodulator(Demodulator, SquelchMixin):
+class SimpleAudioDemodulator(Demodulator, SquelchMixin, TunableChannelFilterMixin):
     def __init__(self, demod_rate=0, audio_rate=0, band_filter=None, band_filter_transition=None, stereo=False, **kwargs):
         assert audio_rate > 0
         
@@ -124,6 +123,7 @@ class SimpleAudioDemodulator(Demodulator, SquelchMixin):
             output_rate=demod_rate,
             cutoff_freq=band_filter,
             transition_width=band_filter_transition)
+        TunableChannelFilterMixin.__init__(self, self.band_filter_block)
     
     @exported_value(type=BandShape, changes='never')  # TODO not sure if this is the right change policy
     def get_band_shape(self):
@@ -134,10 +134,6 @@ class SimpleAudioDemodulator(Demodulator, SquelchMixin):
         """Implements IDemodulator."""
         return self.__signal_type
 
-    def set_rec_freq(self, freq):
-        """Implements ITunableDemodulator."""
-        self.band_filter_block.set_center_freq(freq)
-
 
 def design_lofi_audio_filter(rate, lowpass):
     """
@@ -418,7 +414,8 @@ class AMModulator(gr.hier_block2, ExportedState):
 pluginDef_am = ModeDef(mode='AM',
     info=EnumRow(label='AM', sort_key=BASIC_MODE_SORT_PREFIX + 'AM'),
     demod_class=AMDemodulator,
-    mod_class=AMModulator)
+    mod_class=AMModulator,
+    channelizable=True)
 pluginDef_am_entire = ModeDef(mode='AM-unsel',
     info=EnumRow(label='AM unselective', sort_key=BASIC_MODE_SORT_PREFIX + 'AM unsel'),
     demod_class=UnselectiveAMDemodulator)
@@ -537,7 +534,8 @@ pluginDef_nfm = ModeDef(mode='NFM',  # TODO also declare 'FM' mode, and be consi
         description='FM with 5 kHz deviation',
         sort_key=BASIC_MODE_SORT_PREFIX + 'FM'),
     demod_class=NFMDemodulator,
-    mod_class=NFMModulator)
+    mod_class=NFMModulator,
+    channelizable=True)
 
 
 class WFMDemodulator(FMDemodulator):
@@ -648,7 +646,8 @@ pluginDef_wfm = ModeDef(mode='WFM',
     info=EnumRow(label='Broadcast FM',
         description='FM with 75 kHz deviation and stereo subcarrier',
         sort_key=BASIC_MODE_SORT_PREFIX + 'FM W'),
-    demod_class=WFMDemodulator)
+    demod_class=WFMDemodulator,
+    channelizable=True)
 
 
 _ssb_max_agc = 40
@@ -778,17 +777,20 @@ pluginDef_lsb = ModeDef(mode='LSB',
         description='Single-sideband, lower sideband',
         sort_key=BASIC_MODE_SORT_PREFIX + 'SSB L'),
     demod_class=SSBDemodulator,
-    mod_class=DSBModulator)
+    mod_class=DSBModulator,
+    channelizable=True)
 pluginDef_usb = ModeDef(mode='USB',
     info=EnumRow(
         label='USB',
         description='Single-sideband, upper sideband',
         sort_key=BASIC_MODE_SORT_PREFIX + 'SSB U'),
     demod_class=SSBDemodulator,
-    mod_class=DSBModulator)
+    mod_class=DSBModulator,
+    channelizable=True)
 pluginDef_cw = ModeDef(mode='CW',
     info=EnumRow(
         label='CW',
         sort_key=BASIC_MODE_SORT_PREFIX + 'CW'),
     demod_class=SSBDemodulator,
-    mod_class=DSBModulator)
+    mod_class=DSBModulator,
+    channelizable=True)
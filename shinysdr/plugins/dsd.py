@@ -38,7 +38,7 @@ except ImportError:
         _available_version = None
 
 from shinysdr.filters import make_resampler
-from shinysdr.interfaces import BandShape, ModeDef, IDemodulator
+from shinysdr.interfaces import BandShape, ModeDef, IDemodulator, ITunableDemodulator
 from shinysdr.plugins.basic_demod import NFMDemodulator
 from shinysdr.signals import SignalType
 from shinysdr.types import EnumRow, RangeT, ReferenceT
@@ -50,7 +50,7 @@ _demod_rate = 48000  # hardcoded in gr-dsd
 _uvquality_range = RangeT([(1, 4)], integer=True)
 
 
-@implementer(IDemodulator)
+@implementer(IDemodulator, ITunableDemodulator)
 class DSDDemodulator(gr.hier_block2, ExportedState):
     def __init__(self, mode, input_rate=0, uvquality=3, context=None):
         assert input_rate > 0
@@ -125,6 +125,10 @@ class DSDDemodulator(gr.hier_block2, ExportedState):
     @exported_value(type=BandShape, changes='never')
     def get_band_shape(self):
         return self.__fm_demod.get_band_shape()
+    
+    def set_rec_freq(self, freq):
+        """implement ITunableDemodulator"""
+        self.__fm_demod.set_rec_freq(freq)
 
 
 _modeDef = ModeDef(mode=u'DSD',  # TODO: Ought to declare all the individual modes that DSD can decode -- once we have a way to not spam the mode selector with that.
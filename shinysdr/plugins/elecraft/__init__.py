@@ -169,7 +169,7 @@ class _ElecraftRadio(ExportedState):
         """For experimental use only."""
         return self.__protocol
     
-    @exported_value(type=NoticeT(always_visible=False), changes='continuous')  # TODO better changes
+    @exported_value(type=NoticeT(always_visible=False), changes='continuous', poll_interval=0.5)  # TODO better changes
     def get_errors(self):
         error = self.__protocol.get_communication_error()
         if not error:
@@ -38,7 +38,7 @@ try:
 except ImportError as e:
     _unavailability = unicode(e)
 
-from shinysdr.filters import MultistageChannelFilter
+from shinysdr.filters import MultistageChannelFilter, TunableChannelFilterMixin
 from shinysdr.interfaces import BandShape, ClientResourceDef, IDemodulator, ModeDef
 from shinysdr.math import LazyRateCalculator
 from shinysdr.signals import no_signal
@@ -60,7 +60,7 @@ _METERS_PER_FEET = (_CM_PER_INCH * _INCH_PER_FOOT) / 100
 
 
 @implementer(IDemodulator)
-class ModeSDemodulator(gr.hier_block2, ExportedState):
+class ModeSDemodulator(gr.hier_block2, ExportedState, TunableChannelFilterMixin):
     def __init__(self, mode='MODE-S', input_rate=0, context=None):
         assert input_rate > 0
         gr.hier_block2.__init__(
@@ -78,6 +78,7 @@ class ModeSDemodulator(gr.hier_block2, ExportedState):
             output_rate=demod_rate,
             cutoff_freq=demod_rate / 2,
             transition_width=transition_width)  # TODO optimize filter band
+        TunableChannelFilterMixin.__init__(self, self.__band_filter)
         self.__demod = air_modes.rx_path(
             rate=demod_rate,
             threshold=7.0,  # default used in air-modes code but not exposed
@@ -128,7 +129,7 @@ class ModeSDemodulator(gr.hier_block2, ExportedState):
     def set_decode_threshold(self, value):
         self.__demod.set_threshold(float(value))
     
-    @exported_value(float, changes='continuous', label='Messages/sec decoded')
+    @exported_value(float, changes='continuous', poll_interval=1, label='Messages/sec decoded')
     def get_message_rate(self):
         return round(self.__message_rate_calc.get(), 1)
     
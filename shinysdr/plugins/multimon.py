@@ -35,7 +35,7 @@ from gnuradio import blocks
 
 from shinysdr.filters import make_resampler
 from shinysdr.i.blocks import make_sink_to_process_stdin
-from shinysdr.interfaces import BandShape, ModeDef, IDemodulator
+from shinysdr.interfaces import BandShape, ModeDef, IDemodulator, ITunableDemodulator
 from shinysdr.plugins.basic_demod import NFMDemodulator
 from shinysdr.plugins.aprs import parse_tnc2
 from shinysdr.signals import SignalType
@@ -171,7 +171,7 @@ class APRSDemodulator(gr.hier_block2, ExportedState):
 
 
 # TODO: Eliminate this class and replace it with adapters available to any demodulator
-@implementer(IDemodulator)
+@implementer(IDemodulator, ITunableDemodulator)
 class FMAPRSDemodulator(gr.hier_block2, ExportedState):
     def __init__(self, mode, input_rate=0, context=None):
         assert input_rate > 0
@@ -210,6 +210,10 @@ class FMAPRSDemodulator(gr.hier_block2, ExportedState):
     def get_band_shape(self):
         return self.fm_demod.get_band_shape()
     
+    def set_rec_freq(self, freq):
+        """implement ITunableDemodulator"""
+        self.fm_demod.set_rec_freq(freq)
+    
     def get_output_type(self):
         return self.mm_demod.get_output_type()
     
@@ -258,4 +262,5 @@ _multimon_unavailability = test_subprocess('multimon-ng -h; exit 0', 'vailable d
 pluginDef_APRS = ModeDef(mode='APRS',  # TODO: Rename mode to be more accurate
     info='APRS',
     demod_class=FMAPRSDemodulator,
-    unavailability=_multimon_unavailability)
+    unavailability=_multimon_unavailability,
+    reusable=False)
@@ -34,14 +34,14 @@ except ImportError as e:
     _unavailability = unicode(e)
 
 from shinysdr.math import dB, rotator_inc
-from shinysdr.filters import MultistageChannelFilter
+from shinysdr.filters import MultistageChannelFilter, TunableChannelFilterMixin
 from shinysdr.interfaces import ModeDef, IDemodulator, BandShape
 from shinysdr.signals import SignalType
 from shinysdr.values import ExportedState, StringQueueCell, exported_value
 
 
 @implementer(IDemodulator)
-class PSK31Demodulator(gr.hier_block2, ExportedState):
+class PSK31Demodulator(gr.hier_block2, ExportedState, TunableChannelFilterMixin):
     '''Demodulate PSK31.'''
     
     __symbol_rate = 31.25
@@ -61,6 +61,7 @@ class PSK31Demodulator(gr.hier_block2, ExportedState):
             gr.io_signature(1, 1, gr.sizeof_float))
         
         channel_filter = self.__make_channel_filter()
+        TunableChannelFilterMixin.__init__(self, channel_filter)
 
         self.__char_queue = gr.msg_queue(limit=100)
         self.__char_sink = blocks.message_sink(gr.sizeof_char, self.__char_queue, True)
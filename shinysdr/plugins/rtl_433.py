@@ -30,7 +30,7 @@ from gnuradio import analog
 from gnuradio import gr
 
 from shinysdr.i.blocks import make_sink_to_process_stdin
-from shinysdr.filters import MultistageChannelFilter
+from shinysdr.filters import MultistageChannelFilter, TunableChannelFilterMixin
 from shinysdr.math import dB
 from shinysdr.interfaces import BandShape, ModeDef, IDemodulator
 from shinysdr.signals import no_signal
@@ -45,7 +45,7 @@ upper_preferred_demod_rate = 400000
 
 
 @implementer(IDemodulator)
-class RTL433Demodulator(gr.hier_block2, ExportedState):
+class RTL433Demodulator(gr.hier_block2, ExportedState, TunableChannelFilterMixin):
     def __init__(self, mode='433', input_rate=0, context=None):
         assert input_rate > 0
         assert context is not None
@@ -56,8 +56,7 @@ class RTL433Demodulator(gr.hier_block2, ExportedState):
         
         # The input bandwidth chosen is not primarily determined by the bandwidth of the input signals, but by the frequency error of the transmitters. Therefore it is not too critical, and we can choose the exact rate to make the filtering easy.
         if input_rate <= upper_preferred_demod_rate:
-            # Skip having a filter at all.
-            self.__band_filter = None
+            # No decimation; the filter then only does frequency translation.
             demod_rate = input_rate
         else:
             # TODO: This gunk is very similar to the stuff that MultistageChannelFilter does. See if we can share some code.
@@ -74,12 +73,13 @@ class RTL433Demodulator(gr.hier_block2, ExportedState):
                     lower_rate = upper_preferred_demod_rate
                     break
             demod_rate = lower_rate
-            
-            self.__band_filter = MultistageChannelFilter(
-                input_rate=input_rate,
-                output_rate=demod_rate,
-                cutoff_freq=demod_rate * 0.4,
-                transition_width=demod_rate * 0.2)
+        
+        self.__band_filter = MultistageChannelFilter(
+            input_rate=input_rate,
+            output_rate=demod_rate,
+            cutoff_freq=demod_rate * 0.4,
+            transition_width=demod_rate * 0.2)
+        TunableChannelFilterMixin.__init__(self, self.__band_filter)
         
         # Subprocess
         # using /usr/bin/env because twisted spawnProcess doesn't support path search
@@ -106,25 +106,16 @@ class RTL433Demodulator(gr.hier_block2, ExportedState):
         agc.set_attack_rate(200 / demod_rate)
         agc.set_decay_rate(200 / demod_rate)
         
-        if self.__band_filter:
-            self.connect(
-                self,
-                self.__band_filter,
-                agc)
-        else:
-            self.connect(
-                self,
-                agc)
-        self.connect(agc, sink)
+        self.connect(
+            self,
+            self.__band_filter,
+            agc,
+            sink)
     
     @exported_value(type=BandShape, changes='never')
     def get_band_shape(self):
         """implements IDemodulator"""
-        if self.__band_filter:
-            return self.__band_filter.get_shape()
-        else:
-            # TODO Reuse UnselectiveAMDemodulator's approach to this
-            return BandShape(stop_low=0, pass_low=0, pass_high=0, stop_high=0, markers={})
+        return self.__band_filter.get_shape()
     
     def get_output_type(self):
         """implements IDemodulator"""
@@ -325,4 +316,5 @@ _rtl_433_unavailability = test_subprocess(
 plugin_mode = ModeDef(mode='433',
     info=EnumRow(label='rtl_433', description='OOK telemetry decoded by rtl_433 mostly found at 433 MHz'),
     demod_class=RTL433Demodulator,
-    unavailability=_rtl_433_unavailability)
+    unavailability=_rtl_433_unavailability,
+    reusable=False)
@@ -37,7 +37,7 @@ except ImportError as e:
     _unavailability = unicode(e)
 
 from shinysdr.math import dB, rotator_inc
-from shinysdr.filters import MultistageChannelFilter
+from shinysdr.filters import MultistageChannelFilter, TunableChannelFilterMixin
 from shinysdr.interfaces import BandShape, ModeDef, IDemodulator, IModulator
 from shinysdr.signals import SignalType, no_signal
 from shinysdr.values import ExportedState, StringQueueCell, exported_value
@@ -56,7 +56,7 @@ _HALF_BITS_PER_CODE = (1 + _DATA_BITS) * 2 + 3
 
 
 @implementer(IDemodulator)
-class RTTYDemodulator(gr.hier_block2, ExportedState):
+class RTTYDemodulator(gr.hier_block2, ExportedState, TunableChannelFilterMixin):
     '''Demodulate typical amateur RTTY.
 
     Input should be centered on the mark frequency. (By convention, RTTY
@@ -87,6 +87,7 @@ class RTTYDemodulator(gr.hier_block2, ExportedState):
             gr.io_signature(1, 1, gr.sizeof_float * 1))
         
         channel_filter = self.__make_channel_filter()
+        TunableChannelFilterMixin.__init__(self, channel_filter)
 
         self.__char_queue = gr.msg_queue(limit=100)
         self.__char_sink = blocks.message_sink(gr.sizeof_char, self.__char_queue, True)
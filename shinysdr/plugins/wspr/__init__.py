@@ -27,7 +27,8 @@ from .demodulator import WSPRDemodulator, find_wsprd
 plugin_mode = ModeDef(mode='WSPR',
     info='WSPR',
     demod_class=WSPRDemodulator,
-    unavailability=None if find_wsprd() else 'wsprd not found.')
+    unavailability=None if find_wsprd() else 'wsprd not found.',
+    reusable=False)
 
 plugin_client = ClientResourceDef(
     key=__name__,
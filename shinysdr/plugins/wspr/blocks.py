@@ -167,14 +167,16 @@ class WSPRFilter(gr.hier_block2):
             gr.io_signature(1, 1, gr.sizeof_gr_complex),
             gr.io_signature(1, 1, gr.sizeof_float))
 
+        self.__channel_filter = MultistageChannelFilter(
+            input_rate=input_rate,
+            output_rate=output_rate,
+            cutoff_freq=width / 2,
+            transition_width=transition_width)
+
         self.connect(
             self,
 
-            MultistageChannelFilter(
-                input_rate=input_rate,
-                output_rate=output_rate,
-                cutoff_freq=width / 2,
-                transition_width=transition_width),
+            self.__channel_filter,
 
             blocks.rotator_cc(2 * pi * output_frequency / output_rate),
 
@@ -187,5 +189,12 @@ class WSPRFilter(gr.hier_block2):
 
             self)
 
+    def get_center_freq(self):
+        return self.__channel_filter.get_center_freq()
+
+    def set_center_freq(self, freq):
+        """Set the frequency in the input which is shifted to output_frequency."""
+        self.__channel_filter.set_center_freq(freq)
+
 
 __all__ = ['WAVIntervalSink', 'WSPRFilter']
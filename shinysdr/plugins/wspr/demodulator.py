@@ -33,6 +33,7 @@ from twisted.internet.protocol import ProcessProtocol
 from twisted.python import log
 from zope.interface import implementer
 
+from shinysdr.filters import TunableChannelFilterMixin
 from shinysdr.values import ExportedState, SubscriptionContext, exported_value
 from shinysdr.interfaces import IDemodulator, BandShape
 from shinysdr.signals import SignalType
@@ -53,7 +54,7 @@ def find_wsprd():
 
 
 @implementer(IDemodulator)
-class WSPRDemodulator(gr.hier_block2, ExportedState):
+class WSPRDemodulator(gr.hier_block2, ExportedState, TunableChannelFilterMixin):
     """Decode WSPR (Weak Signal Propagation Reporter).
 
     Requires `wsprd` to be installed, which is available as part of WSJT-X:
@@ -99,6 +100,7 @@ class WSPRDemodulator(gr.hier_block2, ExportedState):
         self.__recording_dir = _mkdtemp()
 
         wspr_filter = WSPRFilter(input_rate, output_frequency=self.__audio_frequency)
+        TunableChannelFilterMixin.__init__(self, wspr_filter)
 
         self.__listener = WAVIntervalListener(
             self.__recording_dir,
@@ -18,11 +18,12 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import json
+import struct
+import zlib
 
 from twisted.internet import defer
 from twisted.internet import reactor as the_reactor
 from twisted.internet.task import Clock, deferLater
-from twisted.test.proto_helpers import StringTransport
 from twisted.trial import unittest
 from zope.interface import Interface, implementer
 
@@ -45,13 +46,15 @@ class StateStreamTestCase(unittest.TestCase):
         # pylint: disable=attribute-defined-outside-init
         self.object = obj
         self.updates = []
+        self.frames = []
         self.st = SubscriptionTester()
         
         def send(value):
             if isinstance(value, unicode):
                 self.updates.extend(json.loads(value))
             elif isinstance(value, bytes):
-                self.updates.append(['actually_binary', value])
+                self.frames.append(value)
+                self.updates.extend(decode_frame(value))
         
         self.stream = StateStreamInner(
             send,
@@ -63,6 +66,7 @@ class StateStreamTestCase(unittest.TestCase):
         # pylint: disable=attribute-defined-outside-init
         
         self.st.advance()
+        self.stream._flush()  # deliver messages generated by polling
         u = self.updates
         self.updates = []
         return u
@@ -200,6 +204,144 @@ class TestStateStream(StateStreamTestCase):
             ['actually_binary', b'\x02\x00\x00\x00\x02d'],
         ]))
     
+    def test_bulk_data_single_frame(self):
+        """All bulk data elements from one reactor turn are sent as one frame."""
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        del self.frames[:]
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.getUpdates()
+        self.assertEqual(self.frames, [
+            b'\x06\x00\x00\x00\x02\x00\x00\x00\x01c'
+            b'\x06\x00\x00\x00\x02\x00\x00\x00\x01d'
+        ])
+    
+    def test_bulk_data_packed_once(self):
+        """Bulk data elements are packed once regardless of the number of streams."""
+        self.setUpForObject(BulkDataSpecimen(bulk_type=CountingBulkDataT('b', 'b')))
+        other_updates = []
+        StateStreamInner(
+            lambda value: other_updates.append(value),
+            self.object,
+            'urlroot',
+            subscription_context=self.st.context)
+        self.getUpdates()
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.getUpdates()
+        self.assertEqual(self.object.bulk_type.pack_count, 2)
+    
+    def test_bulk_data_coalesced_while_paused(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.set_flow_paused(True)
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.assertEqual(self.getUpdates(), [])
+        self.object.queue.insert_tail(make_bytes_msg(b'ef'))
+        self.assertEqual(self.getUpdates(), [])
+        self.stream.set_flow_paused(False)
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x02f'],
+        ]))
+    
+    def test_state_sent_while_paused(self):
+        self.setUpForObject(StateSpecimen())
+        self.getUpdates()
+        self.stream.set_flow_paused(True)
+        self.object.set_rw(2.0)
+        self.assertEqual(self.getUpdates(), [
+            ['value', 2, 2.0],
+        ])
+    
+    def test_bulk_view_rate(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, 0.5, None]))
+        self.object.queue.insert_tail(make_bytes_msg(b'ab'))
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x01b'],
+        ]))
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.assertEqual(self.getUpdates(), [])
+        self.object.queue.insert_tail(make_bytes_msg(b'ef'))
+        # 'd' was held back and is now due; 'ef' arrived after it was sent
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x02d'],
+        ]))
+        self.assertEqual(self.getUpdates(), [])
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x03f'],
+        ]))
+    
+    def test_bulk_view_rate_burst_then_silence(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, 0.25, None]))
+        self.object.queue.insert_tail(make_bytes_msg(b'ab'))
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x01b'],
+        ]))
+        for s in [b'cd', b'ef']:
+            self.object.queue.insert_tail(make_bytes_msg(s))
+            self.assertEqual(self.getUpdates(), [])
+        # no more elements arrive, but the newest is still delivered
+        self.assertEqual(self.getUpdates(), [])
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x03f'],
+        ]))
+        self.assertEqual(self.getUpdates(), [])
+    
+    def test_bulk_view_bins(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, None, 2]))
+        self.object.queue.insert_tail(gr.message().make_from_string(b'\x01\x05\x02\x03\x04', 0, 5, 1))
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x01\x05\x04'],
+        ]))
+    
+    def test_bulk_view_invalid(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_view', 99, 1, None]))  # unknown serial
+        self.stream.dataReceived(json.dumps(['bulk_view', 1, 1, None]))  # not a cell
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, 0, None]))
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, None, 0]))
+        self.stream.dataReceived(json.dumps(['bulk_view', 2, 'fast', None]))
+        # ignored, and still unlimited
+        self.object.queue.insert_tail(make_bytes_msg(b'ab'))
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.assertEqual(self.getUpdates(), transform_for_json([
+            ['actually_binary', b'\x02\x00\x00\x00\x01a'],
+            ['actually_binary', b'\x02\x00\x00\x00\x01b'],
+            ['actually_binary', b'\x02\x00\x00\x00\x01c'],
+            ['actually_binary', b'\x02\x00\x00\x00\x01d'],
+        ]))
+    
+    def test_bulk_encoding_delta_deflate(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_encoding', 'delta-deflate']))
+        del self.frames[:]
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.getUpdates()
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual(self.frames[0][:4], b'\xFE\xFF\xFF\xFF')
+        self.assertEqual(zlib.decompress(self.frames[0][4:]),
+            b'\x07\x00\x00\x00\x02\x00\x00\x00\x00\x01c'
+            b'\x07\x00\x00\x00\x02\x00\x00\x00\x01\x00\x01')
+    
+    def test_bulk_encoding_unknown(self):
+        self.setUpForObject(BulkDataSpecimen())
+        self.getUpdates()
+        self.stream.dataReceived(json.dumps(['bulk_encoding', 'delta-deflate']))
+        # ignored, keeping the current encoding
+        self.stream.dataReceived(json.dumps(['bulk_encoding', 'foo']))
+        del self.frames[:]
+        self.object.queue.insert_tail(make_bytes_msg(b'cd'))
+        self.getUpdates()
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual(self.frames[0][:4], b'\xFE\xFF\xFF\xFF')
+    
     def test_value_patch(self):
         queue = gr.msg_queue()
         queue.insert_tail(make_bytes_msg(b'ab'))
@@ -224,6 +366,22 @@ class TestStateStream(StateStreamTestCase):
         ]))
 
 
+def decode_frame(frame):
+    """Decode a binary state stream frame into the same form as the text messages, with bulk data records represented as ['actually_binary', <record bytes>]."""
+    messages = []
+    offset = 0
+    while offset < len(frame):
+        length, = struct.unpack('<I', frame[offset:offset + 4])
+        record = frame[offset + 4:offset + 4 + length]
+        offset += 4 + length
+        serial, = struct.unpack('<I', record[:4])
+        if serial == 0xFFFFFFFF:
+            messages.extend(json.loads(record[4:].decode('utf-8')))
+        else:
+            messages.append(['actually_binary', record])
+    return messages
+
+
 class IFoo(Interface):
     pass
 
@@ -262,9 +420,10 @@ class DuplicateReferenceSpecimen(ExportedState):
 class BulkDataSpecimen(ExportedState):
     """Helper for TestStateStream"""
     
-    def __init__(self):
+    def __init__(self, bulk_type=None):
         self.queue = gr.msg_queue()
         self.info_value = 0
+        self.bulk_type = bulk_type if bulk_type is not None else BulkDataT('b', 'b')
     
     def state_def(self):
         def info_getter():
@@ -273,7 +432,17 @@ class BulkDataSpecimen(ExportedState):
         yield 's', ElementQueueCell(
             queue=self.queue,
             info_getter=info_getter,
-            type=BulkDataT('b', 'b'))
+            type=self.bulk_type)
+
+
+class CountingBulkDataT(BulkDataT):
+    """Helper for TestStateStream"""
+    
+    pack_count = 0
+    
+    def pack(self, value):
+        self.pack_count += 1
+        return super(CountingBulkDataT, self).pack(value)
 
 
 def make_bytes_msg(s):
@@ -324,9 +493,14 @@ class TestOurStreamProtocol(unittest.TestCase):
         self.protocol.transport = self.transport
     
     def begin(self, url):
+        self.protocol.connectionMade()
         self.transport.location = bytes(url)
         self.protocol.dataReceived(b'{}')
     
+    def test_registers_producer(self):
+        self.begin('/foo/radio')
+        self.assertEqual(self.transport.producer, (self.protocol, True))
+    
     def test_dispatch(self):
         self.begin('/foo/radio')
         self.clock.advance(1)
@@ -338,6 +512,16 @@ class TestOurStreamProtocol(unittest.TestCase):
             ],
         ])
     
+    def test_paused_limit(self):
+        self.begin('/foo/radio')
+        self.protocol.pauseProducing()
+        self.clock.advance(1)
+        self.assertEqual(len(self.transport.messages()), 1)  # still sent
+        self.assertEqual(self.transport.closed_reason, None)
+        self.protocol.inner._send1(['dummy', b'x' * 1000001])
+        self.clock.advance(1)
+        self.assertEqual(self.transport.closed_reason, 'Too much data buffered')
+    
     @defer.inlineCallbacks
     def test_audio(self):
         self.begin('/foo/audio?rate=1')
@@ -364,14 +548,22 @@ class TestOurStreamProtocol(unittest.TestCase):
 class FakeWebSocketTransport(object):
     def __init__(self):
         self.__messages = []
-        # faking up stuff!!!
         self.location = None
-        self.transport = StringTransport()
-        self.transport.dataBuffer = []
+        self.producer = None
+        self.closed_reason = None
+    
+    def setBinaryMode(self, mode):
+        pass
+    
+    def registerProducer(self, producer, streaming):
+        self.producer = (producer, streaming)
     
     def write(self, data):
         self.__messages.append(data)
     
+    def close(self, reason):
+        self.closed_reason = reason
+    
     def messages(self):
         return [json.loads(m) if isinstance(m, unicode) else m for m in self.__messages]
 
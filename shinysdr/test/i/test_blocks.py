@@ -17,13 +17,17 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import time
+
+import numpy
 from twisted.trial import unittest
 
 from gnuradio import blocks
 from gnuradio import gr
 from gnuradio.fft import window as windows
 
-from shinysdr.i.blocks import Context, MonitorSink, RecursiveLockBlockMixin
+from shinysdr.i import blocks as blocks_module
+from shinysdr.i.blocks import Context, FlowgraphEdges, MonitorSink, PacedMessageSource, RecursiveLockBlockMixin, _OverlappedStreamToVector, _SpectrumIntegrator
 from shinysdr.signals import SignalType
 
 
@@ -58,6 +62,250 @@ class TestMonitorSink(unittest.TestCase):
         m.set_window_type(windows.WIN_FLATTOP)
         self.tb.stop()
         self.tb.wait()
+    
+    def test_frame_rate(self):
+        m = self.make()
+        m.set_frame_rate(10)
+        self.assertEqual(m.get_frame_rate(), 10)
+        # rounded to a whole number of samples per frame
+        m.set_frame_rate(300)
+        self.assertEqual(m.get_frame_rate(), 1000 / 3)
+    
+    def test_integration_keeps_frame_rate(self):
+        m = self.make()
+        m.set_frame_rate(10)
+        m.set_integration(u'mean')
+        m.set_integration_frames(5)
+        self.assertEqual(m.get_frame_rate(), 10)
+        self.tb.start()
+        m.set_integration(u'peak')
+        self.tb.stop()
+        self.tb.wait()
+    
+    def test_integration_streams_at_full_resolution(self):
+        signal_type = SignalType(kind='IQ', sample_rate=1e6)
+        m = MonitorSink(
+            context=self.context,
+            signal_type=signal_type,
+            freq_resolution=4096,
+            integration=u'mean',
+            integration_frames=64)
+        self.tb.connect(blocks.null_source(signal_type.get_itemsize()), m)
+        queue = m._MonitorSink__fft_queue
+        self.tb.start()
+        try:
+            deadline = time.time() + 10
+            while queue.count() < 3 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            self.tb.stop()
+            self.tb.wait()
+        self.assertGreaterEqual(queue.count(), 3)
+    
+    def test_integration_limits_fft_rate(self):
+        m = self.make()
+        m.set_frame_rate(100)
+        m.set_integration(u'mean')
+        m.set_integration_frames(50)
+        # 1000 samples/s allows at most one FFT per two samples
+        self.assertEqual(m.get_frame_rate(), 1000 / (2 * 50))
+    
+    def test_smoke_change_resolution(self):
+        m = self.make()
+        self.tb.start()
+        m.set_freq_resolution(1024)
+        m.set_time_length(512)
+        # back to previous resolutions, reusing the spectrum chains built for them
+        m.set_freq_resolution(4096)
+        m.set_freq_resolution(1024)
+        self.tb.stop()
+        self.tb.wait()
+
+
+class TestOverlappedStreamToVector(unittest.TestCase):
+    def run_with(self, size, hop, count):
+        tb = gr.top_block()
+        sink = blocks.vector_sink_f(vlen=size)
+        tb.connect(
+            blocks.vector_source_f([float(i) for i in xrange(count)]),
+            _OverlappedStreamToVector(size=size, hop=hop, itemsize=gr.sizeof_float),
+            sink)
+        tb.run()
+        data = sink.data()
+        return [list(data[i:i + size]) for i in xrange(0, len(data), size)]
+    
+    def test_overlapping(self):
+        self.assertEqual(self.run_with(4, 2, 10), [
+            [0, 1, 2, 3],
+            [2, 3, 4, 5],
+            [4, 5, 6, 7],
+            [6, 7, 8, 9],
+        ])
+    
+    def test_gaps(self):
+        self.assertEqual(self.run_with(2, 5, 14), [
+            [0, 1],
+            [5, 6],
+            [10, 11],
+        ])
+    
+    def test_hop_larger_than_buffer(self):
+        # e.g. a high sample rate at a low frame rate; the skip between vectors is far more than the input buffer holds
+        vectors = self.run_with(2, 100000, 350000)
+        self.assertEqual(vectors, [
+            [0, 1],
+            [100000, 100001],
+            [200000, 200001],
+            [300000, 300001],
+        ])
+
+
+class TestSpectrumIntegrator(unittest.TestCase):
+    def run_with(self, mode, count, vectors):
+        tb = gr.top_block()
+        sink = blocks.vector_sink_f(vlen=2)
+        tb.connect(
+            blocks.vector_source_f([x for vector in vectors for x in vector], vlen=2),
+            _SpectrumIntegrator(vlen=2, mode=mode, count=count),
+            sink)
+        tb.run()
+        data = sink.data()
+        return [list(data[i:i + 2]) for i in xrange(0, len(data), 2)]
+    
+    def test_none(self):
+        self.assertEqual(self.run_with(u'none', 2, [[1, 2], [3, 4]]), [[1, 2], [3, 4]])
+    
+    def test_mean(self):
+        self.assertEqual(self.run_with(u'mean', 2, [[1, 2], [3, 6], [5, 0], [7, 0]]), [[2, 4], [6, 0]])
+    
+    def test_peak_hold(self):
+        self.assertEqual(self.run_with(u'peak', 2, [[1, 5], [3, 4], [5, 0], [2, 1]]), [[3, 5], [5, 5]])
+    
+    def test_min_hold(self):
+        self.assertEqual(self.run_with(u'min', 2, [[1, 5], [3, 4], [5, 0], [2, 1]]), [[1, 4], [1, 0]])
+    
+    def test_average(self):
+        self.assertEqual(self.run_with(u'average', 2, [[2, 2], [4, 0], [4, 0], [4, 0]]), [[3, 1], [3.75, 0.25]])
+    
+    def test_large_vectors(self):
+        # more vectors per output than fit in the input buffer at once
+        vlen = 4096
+        count = 64
+        tb = gr.top_block()
+        sink = blocks.vector_sink_f(vlen=vlen)
+        tb.connect(
+            blocks.null_source(gr.sizeof_float * vlen),
+            blocks.head(gr.sizeof_float * vlen, count * 3),
+            _SpectrumIntegrator(vlen=vlen, mode=u'mean', count=count),
+            sink)
+        tb.run()
+        self.assertEqual(len(sink.data()), vlen * 3)
+
+
+class TestPacedMessageSource(unittest.TestCase):
+    def run_with(self, messages, count):
+        queue = gr.msg_queue()
+        for values in messages:
+            queue.insert_tail(gr.message().make_from_string(
+                numpy.array(values, dtype=numpy.float32).tostring(), 0, gr.sizeof_float * 2, len(values) // 2))
+        tb = gr.top_block()
+        sink = blocks.vector_sink_f(vlen=2)
+        tb.connect(
+            PacedMessageSource(channels=2, queue=queue, sample_rate=1000),
+            blocks.head(gr.sizeof_float * 2, count),
+            sink)
+        t0 = time.time()
+        tb.run()
+        return list(sink.data()), time.time() - t0
+    
+    def test_messages_then_silence(self):
+        data, _ = self.run_with([[1, 2, 3, 4], [5, 6]], 5)
+        self.assertEqual(data, [1, 2, 3, 4, 5, 6, 0, 0, 0, 0])
+    
+    def test_silence_paced(self):
+        data, elapsed = self.run_with([], 200)
+        self.assertEqual(data, [0] * 400)
+        self.assertGreater(elapsed, 0.15)
+
+
+class TestFlowgraphEdges(unittest.TestCase):
+    def setUp(self):
+        self.graph = _RecordingGraph()
+        self.edges = FlowgraphEdges(self.graph)
+    
+    def tearDown(self):
+        blocks_module._use_incremental_reconnect = True
+    
+    def reconnect(self, *chains):
+        self.graph.log = []
+        self.edges.begin()
+        for chain in chains:
+            self.edges.connect(*chain)
+        return self.edges.apply(lambda: self.graph.log.append('lock'), lambda: self.graph.log.append('unlock'))
+    
+    def test_initial(self):
+        self.assertEqual(3, self.reconnect(['a', 'b', ('c', 1)], ['a', 'd']))
+        self.assertEqual(self.graph.log, [
+            'lock',
+            ('connect', ('a', 0), ('b', 0)),
+            ('connect', ('b', 0), ('c', 1)),
+            ('connect', ('a', 0), ('d', 0)),
+            'unlock',
+        ])
+    
+    def test_unchanged_does_not_lock(self):
+        self.reconnect(['a', 'b'])
+        self.assertEqual(0, self.reconnect(['a', 'b']))
+        self.assertEqual(self.graph.log, [])
+    
+    def test_difference(self):
+        self.reconnect(['a', 'b'], ['a', 'c'])
+        self.assertEqual(2, self.reconnect(['a', 'b'], ['a', 'd']))
+        self.assertEqual(self.graph.log, [
+            'lock',
+            ('disconnect', ('a', 0), ('c', 0)),
+            ('connect', ('a', 0), ('d', 0)),
+            'unlock',
+        ])
+    
+    def test_retract(self):
+        self.reconnect(['a', 'b', 'c'], ['d', 'e'])
+        self.assertEqual(self.edges.get_blocks(), frozenset(['a', 'b', 'c', 'd', 'e']))
+        self.graph.log = []
+        self.edges.retract(frozenset(['b']), lambda: self.graph.log.append('lock'), lambda: self.graph.log.append('unlock'))
+        self.assertEqual(self.graph.log, [
+            'lock',
+            ('disconnect', ('a', 0), ('b', 0)),
+            ('disconnect', ('b', 0), ('c', 0)),
+            'unlock',
+        ])
+        self.assertEqual(self.edges.get_blocks(), frozenset(['d', 'e']))
+        self.assertEqual(1, self.reconnect(['d', 'e'], ['a', 'c']))
+    
+    def test_not_incremental(self):
+        blocks_module._use_incremental_reconnect = False
+        self.reconnect(['a', 'b'])
+        self.reconnect(['a', 'b'])
+        self.assertEqual(self.graph.log, [
+            'lock',
+            'disconnect_all',
+            ('connect', ('a', 0), ('b', 0)),
+            'unlock',
+        ])
+
+
+class _RecordingGraph(object):
+    def __init__(self):
+        self.log = []
+    
+    def connect(self, source, destination):
+        self.log.append(('connect', source, destination))
+    
+    def disconnect(self, source, destination):
+        self.log.append(('disconnect', source, destination))
+    
+    def disconnect_all(self):
+        self.log.append('disconnect_all')
 
 
 class RLTB(gr.top_block, RecursiveLockBlockMixin):
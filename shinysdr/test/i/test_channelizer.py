@@ -0,0 +1,101 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division, unicode_literals
+
+from twisted.trial import unittest
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.i.channelizer import ChannelPlan, ChannelizerBank, SubbandFilter, SubbandPlan, plan_channels, plan_subbands
+from shinysdr.interfaces import BandShape
+
+
+class TestChannelPlan(unittest.TestCase):
+    def setUp(self):
+        self.plan = ChannelPlan(input_rate=2.4e6, channel_count=48)
+    
+    def test_rates(self):
+        self.assertEqual(self.plan.get_channel_spacing(), 50e3)
+        self.assertEqual(self.plan.get_output_rate(), 100e3)
+    
+    def test_locate(self):
+        self.assertEqual(self.plan.locate(0), (0, 0))
+        self.assertEqual(self.plan.locate(60e3), (1, 10e3))
+        self.assertEqual(self.plan.locate(-60e3), (47, -10e3))
+        self.assertEqual(self.plan.locate(-1.19e6), (24, 10e3))
+        self.assertEqual(self.plan.locate(1.19e6), (24, -10e3))
+    
+    def test_fits(self):
+        half = self.plan.get_usable_half_bandwidth()
+        self.assertTrue(self.plan.fits(BandShape.lowpass_transition(cutoff=half - 1000, transition=1000)))
+        self.assertFalse(self.plan.fits(BandShape.lowpass_transition(cutoff=half, transition=1000)))
+    
+    def test_plan_channels(self):
+        self.assertEqual(plan_channels(2.4e6), self.plan)
+        self.assertEqual(plan_channels(200e3), None)
+    
+    def test_odd_count(self):
+        self.assertRaises(ValueError, lambda: ChannelPlan(input_rate=2.4e6, channel_count=47))
+
+
+class TestChannelizerBank(unittest.TestCase):
+    def test_smoke(self):
+        tb = gr.top_block()
+        bank = ChannelizerBank(ChannelPlan(input_rate=800e3, channel_count=16))
+        tb.connect(blocks.vector_source_c([0] * 1000), bank)
+        bank.connect_outputs(tb, {3: [blocks.null_sink(gr.sizeof_gr_complex)]})
+        tb.run()
+
+
+class TestSubbandPlan(unittest.TestCase):
+    def setUp(self):
+        self.plan = SubbandPlan(input_rate=2.4e6, decimation=4)
+        self.shape = BandShape.lowpass_transition(cutoff=80e3, transition=20e3)
+    
+    def test_rates(self):
+        self.assertEqual(self.plan.get_output_rate(), 600e3)
+        self.assertEqual(self.plan.get_usable_half_bandwidth(), 240e3)
+    
+    def test_plan_subbands(self):
+        self.assertEqual(plan_subbands(2.4e6), self.plan)
+        self.assertEqual(plan_subbands(800e3), None)
+    
+    def test_fits(self):
+        self.assertTrue(self.plan.fits(self.shape))
+        self.assertFalse(self.plan.fits(BandShape.lowpass_transition(cutoff=240e3, transition=20e3)))
+        self.assertTrue(self.plan.fits_at(140e3, self.shape))
+        self.assertFalse(self.plan.fits_at(160e3, self.shape))
+    
+    def test_group(self):
+        shape = self.shape
+        self.assertEqual(
+            self.plan.group([(300e3, shape, 'b'), (0, shape, 'a'), (-900e3, shape, 'c'), (100e3, shape, 'd')]),
+            [(-900e3, ['c']), (150e3, ['a', 'd', 'b'])])
+    
+    def test_group_empty(self):
+        self.assertEqual(self.plan.group([]), [])
+
+
+class TestSubbandFilter(unittest.TestCase):
+    def test_smoke(self):
+        tb = gr.top_block()
+        subband_filter = SubbandFilter(SubbandPlan(input_rate=2.4e6, decimation=4), center_freq=100e3)
+        tb.connect(blocks.vector_source_c([0] * 1000), subband_filter, blocks.null_sink(gr.sizeof_gr_complex))
+        tb.run()
+        self.assertEqual(subband_filter.get_center_freq(), 100e3)
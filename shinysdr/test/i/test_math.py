@@ -43,6 +43,16 @@ class TestFactorize(unittest.TestCase):
         self.assertEqual(smath.factorize(48000), [2] * 7 + [3] + [5] * 3)
 
 
+class TestDivisors(unittest.TestCase):
+    longMessages = True
+    
+    def test_cases(self):
+        self.assertEqual(smath.divisors(1), [1])
+        self.assertEqual(smath.divisors(7), [1, 7])
+        self.assertEqual(smath.divisors(12), [1, 2, 3, 4, 6, 12])
+        self.assertEqual(len(smath.divisors(48000)), 8 * 2 * 4)
+
+
 class TestSmallFactorAtLeast(unittest.TestCase):
     longMessages = True
     
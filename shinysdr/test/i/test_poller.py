@@ -17,10 +17,13 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+from twisted.internet.task import Clock
 from twisted.trial import unittest
+from zope.interface import implementer
 
-from shinysdr.i.poller import Poller
-from shinysdr.values import ExportedState, LooseCell, exported_value, setter
+from shinysdr.i.poller import AutomaticPoller, Poller
+from shinysdr.test.testutil import LoopbackInterestTracker
+from shinysdr.values import ExportedState, IPausableSubscriber, LooseCell, PollingCell, exported_value, setter
 
 
 class TestPoller(unittest.TestCase):
@@ -86,10 +89,121 @@ class TestPoller(unittest.TestCase):
         self.poller.poll(True)
         self.assertEqual(called, [])
     
+    def test_paused_subscriber_skipped(self):
+        cells = PollerCellsSpecimen()
+        subscriber = PausableSubscriberSpecimen()
+        self.poller.subscribe(cells.state()['foo'], subscriber, fast=True)
+        subscriber.paused = True
+        cells.set_foo('a')
+        self.poller.poll(True)
+        self.assertEqual([], subscriber.called)
+        subscriber.paused = False
+        self.poller.poll(True)
+        self.assertEqual(['a'], subscriber.called)
+    
+    def test_shared_target_interest(self):
+        tracker = LoopbackInterestTracker()
+        cell = PollingCell(
+            target=PollerCellsSpecimen(),
+            key='foo',
+            changes='continuous',
+            interest_tracker=tracker)
+        sub1 = self.poller.subscribe(cell, lambda value: None, fast=True)
+        sub2 = self.poller.subscribe(cell, lambda value: None, fast=True)
+        self.assertTrue(tracker.interested)
+        sub1.unsubscribe()
+        self.assertTrue(tracker.interested)
+        sub2.unsubscribe()
+        self.assertFalse(tracker.interested)
+    
+    def test_order_and_unsubscribe_during_poll(self):
+        called = []
+        cells = [PollerCellsSpecimen() for _ in xrange(3)]
+        subscriptions = []
+        
+        def make_callback(i):
+            def callback(value):
+                called.append(i)
+                if i == 0:
+                    subscriptions[1].unsubscribe()
+            return callback
+        
+        for i, cells_i in enumerate(cells):
+            subscriptions.append(self.poller.subscribe(cells_i.state()['foo'], make_callback(i), fast=True))
+        for cells_i in cells:
+            cells_i.set_foo('a')
+        self.poller.poll(True)
+        self.assertEqual([0, 2], called)
+    
+    def test_stats(self):
+        cells = PollerCellsSpecimen()
+        self.poller.subscribe(cells.state()['foo'], lambda value: None, fast=True)
+        self.poller.poll(True)
+        cells.set_foo('a')
+        self.poller.poll(True)
+        [stats] = self.poller.get_stats()
+        self.assertEqual(
+            (stats['polls'], stats['changes'], stats['exceptions']),
+            (2, 1, 0))
+        self.assertIn('foo', stats['cell'])
+    
+    def test_stats_exceptions(self):
+        bgs = BrokenGetterSpecimen(False)
+        self.poller.subscribe(bgs.state()['foo'], lambda value: None, fast=True)
+        bgs.broken = True
+        self.poller.poll(True)
+        self.poller.poll(True)
+        [stats] = self.poller.get_stats()
+        self.assertEqual(
+            (stats['polls'], stats['changes'], stats['exceptions']),
+            (2, 0, 2))
+    
     # TODO: test multiple subscription behavior wrt throwing
     # TODO: test interest updates on initial throw
 
 
+class TestAutomaticPoller(unittest.TestCase):
+    def test_loops_only_for_subscribed_rates(self):
+        clock = Clock()
+        poller = AutomaticPoller(reactor=clock)
+        cell = PollerCellsSpecimen().state()['foo']
+        sub = poller.subscribe(cell, lambda value: None, fast=False)
+        clock.advance(0)
+        self.assertEqual([call.getTime() for call in clock.getDelayedCalls()], [0.5])
+        sub.unsubscribe()
+        self.assertEqual(clock.getDelayedCalls(), [])
+    
+    def test_interval(self):
+        clock = Clock()
+        poller = AutomaticPoller(reactor=clock)
+        cells = PollerCellsSpecimen()
+        called = []
+        poller.subscribe(cells.state()['foo'], called.append, fast=True, interval=2)
+        clock.advance(0)
+        cells.set_foo('a')
+        clock.advance(1)
+        self.assertEqual([], called)
+        clock.advance(1)
+        self.assertEqual(['a'], called)
+    
+    def test_due_intervals_batched(self):
+        clock = Clock()
+        poller = AutomaticPoller(reactor=clock)
+        poller.subscribe(PollerCellsSpecimen().state()['foo'], lambda value: None, fast=False, interval=0.5)
+        poller.subscribe(PollerCellsSpecimen().state()['foo'], lambda value: None, fast=False, interval=1)
+        for _ in xrange(4):
+            clock.advance(0.5)
+            self.assertEqual(len(clock.getDelayedCalls()), 1)
+    
+    def test_unsubscribe_before_start(self):
+        clock = Clock()
+        poller = AutomaticPoller(reactor=clock)
+        cell = PollerCellsSpecimen().state()['foo']
+        poller.subscribe(cell, lambda value: None, fast=True).unsubscribe()
+        clock.advance(0)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+
 class PollerCellsSpecimen(ExportedState):
     """Helper for TestPoller"""
     foo = None
@@ -122,6 +236,19 @@ class PollerCellsSpecimen(ExportedState):
         self.subscribable.set(value)
 
 
+@implementer(IPausableSubscriber)
+class PausableSubscriberSpecimen(object):
+    def __init__(self):
+        self.called = []
+        self.paused = False
+    
+    def __call__(self, value):
+        self.called.append(value)
+    
+    def is_paused(self):
+        return self.paused
+
+
 class BrokenGetterSpecimen(ExportedState):
     def __init__(self, initially_broken):
         self.broken = initially_broken
@@ -19,8 +19,13 @@ from __future__ import absolute_import, division, unicode_literals
 
 from twisted.trial import unittest
 
+from shinysdr.i import receiver as receiver_module
 from shinysdr.i.modes import lookup_mode
+from shinysdr.i.receiver import _DemodulatorCache
 from shinysdr.i.top import Top
+from shinysdr.i.worker import WorkerDemodulator
+from shinysdr.interfaces import ModeDef
+from shinysdr.plugins.basic_demod import AMDemodulator
 from shinysdr.plugins.simulate import SimulatedDevice
 from shinysdr.test.testutil import state_smoke_test
 
@@ -45,3 +50,54 @@ class TestReceiver(unittest.TestCase):
                 break
         else:
             raise unittest.SkipTest('No no-audio mode available.')
+    
+    def test_mode_switch_reuses_demodulator(self):
+        am_demodulator = self.receiver.get_demodulator()
+        self.receiver.set_mode('USB')
+        self.assertIsNot(self.receiver.get_demodulator(), am_demodulator)
+        self.receiver.set_mode('AM')
+        self.assertIs(self.receiver.get_demodulator(), am_demodulator)
+
+
+class TestReceiverWorkers(unittest.TestCase):
+    def setUp(self):
+        self.top = Top(devices={'s1': SimulatedDevice()}, features={'receiver_workers': True})
+    
+    def tearDown(self):
+        self.top.close_all_devices()
+    
+    def test_process_backed_mode_not_in_worker(self):
+        started = []
+        
+        class ProcessBackedDemodulator(AMDemodulator):
+            # stands in for e.g. rtl_433, which starts an external process when constructed
+            def __init__(self, **kwargs):
+                AMDemodulator.__init__(self, **kwargs)
+                started.append(self)
+        
+        mode_def = ModeDef(mode='PROC', info='Process-backed', demod_class=ProcessBackedDemodulator, reusable=False)
+        real_lookup_mode = receiver_module.lookup_mode
+        self.patch(receiver_module, 'lookup_mode', lambda mode: mode_def if mode == 'PROC' else real_lookup_mode(mode))
+        (_key, receiver) = self.top.add_receiver('PROC', key='a')
+        del started[:]
+        receiver.set_worker(True)
+        self.assertNotIsInstance(receiver.get_demodulator(), WorkerDemodulator)
+        self.assertEqual(started, [receiver.get_demodulator()])
+
+
+class TestDemodulatorCache(unittest.TestCase):
+    def test_lru(self):
+        cache = _DemodulatorCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 3)  # replaces and refreshes 'a'
+        cache.put('c', 4)  # evicts 'b'
+        self.assertEqual(cache.take('b'), None)
+        self.assertEqual(cache.take('a'), 3)
+        self.assertEqual(cache.take('a'), None)
+        self.assertEqual(cache.take('c'), 4)
+    
+    def test_uncacheable(self):
+        cache = _DemodulatorCache(2)
+        cache.put(None, 1)
+        self.assertEqual(cache.take(None), None)
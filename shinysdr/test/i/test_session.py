@@ -39,6 +39,15 @@ class TestSession(unittest.TestCase):
     
     def test_state_smoke(self):
         state_smoke_test(self.session)
+    
+    def test_poller_diagnostics_feature(self):
+        self.assertNotIn('poller_diagnostics', self.session.state())
+        session = Session(
+            receive_flowgraph=Top(devices={'s1': SimulatedDevice()}),
+            read_only_dbs={},
+            writable_db=DatabaseModel(the_reactor, {}, writable=True),
+            features={'poller_diagnostics': True})
+        self.assertIn('poller_diagnostics', session.state())
 
     # TODO: Write more tests than this one of SessionResource linked to a real session
     def test_resource_smoke(self):
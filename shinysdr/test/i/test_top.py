@@ -26,7 +26,10 @@ from zope.interface import implementer  # available via Twisted
 from gnuradio import gr
 
 from shinysdr.devices import Device, IComponent, merge_devices
+from shinysdr.i.channelizer import SubbandPlan
 from shinysdr.i.poller import the_subscription_context
+from shinysdr.i import receiver as receiver_module
+from shinysdr.i import top as top_module
 from shinysdr.i.top import Top
 from shinysdr.plugins.simulate import SimulatedDeviceForTest
 from shinysdr.signals import SignalType
@@ -124,6 +127,156 @@ class TestTop(unittest.TestCase):
         top.add_audio_queue(queue, 48000)
         top.remove_audio_queue(queue)
     
+    @defer.inlineCallbacks
+    def test_reconnect_coalescing(self):
+        top = Top(devices={'s1': SimulatedDeviceForTest(freq=0)})
+        calls = []
+        real_do_connect = top._do_connect
+        
+        def counting_do_connect():
+            calls.append(None)
+            real_do_connect()
+        
+        top._do_connect = counting_do_connect
+        queue = gr.msg_queue()
+        top.add_audio_queue(queue, 48000)
+        top._schedule_reconnect(u'test')
+        self.assertEqual(calls, [])
+        yield deferLater(the_reactor, 0.1, lambda: None)
+        self.assertEqual(len(calls), 1)
+        top.remove_audio_queue(queue)
+        top._do_connect()  # synchronous, and supersedes the scheduled reconnect
+        yield deferLater(the_reactor, 0.1, lambda: None)
+        self.assertEqual(len(calls), 2)
+    
+    def test_channelized_receivers(self):
+        freq = 100e6
+        top = Top(devices={'s1': Device(
+            rx_driver=_WideTestRXDriver(),
+            vfo_cell=LooseCell(value=freq, type=RangeT([(-1e9, 1e9)]), writable=True, persists=False))})
+        receivers = [
+            top.add_receiver('NFM', key=str(i), state={'rec_freq': freq + (i - 10) * 77e3})[1]
+            for i in xrange(20)]
+        for receiver in receivers:
+            self.assertTrue(receiver.get_is_valid())
+            self.assertIsNotNone(receiver.get_input_channel())
+        (_key, wide_receiver) = top.add_receiver('WFM', key='w')
+        self.assertIsNone(wide_receiver.get_input_channel())
+        self.assertIsInstance(wide_receiver.get_input_plan(), SubbandPlan)
+        top.start()
+        top.stop()
+        top.wait()
+    
+    def test_channelizable_constructed_once(self):
+        self.patch(receiver_module, '_band_shapes', {})
+        real_unserialize = receiver_module.unserialize_exported_state
+        constructed = []
+        
+        def counting_unserialize(ctor, state, kwargs):
+            constructed.append(kwargs['input_rate'])
+            return real_unserialize(ctor=ctor, state=state, kwargs=kwargs)
+        
+        self.patch(receiver_module, 'unserialize_exported_state', counting_unserialize)
+        freq = 100e6
+        top = Top(devices={'s1': Device(
+            rx_driver=_WideTestRXDriver(),
+            vfo_cell=LooseCell(value=freq, type=RangeT([(-1e9, 1e9)]), writable=True, persists=False))})
+        (_key, first) = top.add_receiver('NFM', key='a', state={'rec_freq': freq})
+        self.assertIsNotNone(first.get_input_channel())
+        # the first one is also constructed at a wider rate to find its band shape
+        self.assertEqual(len(constructed), 2)
+        del constructed[:]
+        (_key, second) = top.add_receiver('NFM', key='b', state={'rec_freq': freq + 100e3})
+        self.assertEqual(constructed, [first.get_input_plan().get_output_rate()])
+    
+    def test_subband_regrouping(self):
+        freq = 100e6
+        top = Top(devices={'s1': Device(
+            rx_driver=_WideTestRXDriver(),
+            vfo_cell=LooseCell(value=freq, type=RangeT([(-1e9, 1e9)]), writable=True, persists=False))})
+        (_key, receiver) = top.add_receiver('WFM', key='w', state={'rec_freq': freq})
+        filters = top._Top__subband_filters['s1']
+        self.assertEqual(len(filters), 1)
+        self.assertAlmostEqual(filters[0].get_center_freq(), 0)
+        receiver.set_rec_freq(freq + 600e3)  # out of the subband
+        top._do_connect()  # instead of waiting for the scheduled reconnect
+        filters = top._Top__subband_filters['s1']
+        self.assertEqual(len(filters), 1)
+        self.assertAlmostEqual(filters[0].get_center_freq(), 600e3)
+        self.assertTrue(top._receiver_valid['w'])
+    
+    def test_subband_to_full_rate_reconnects(self):
+        freq = 100e6
+        top = Top(devices={'s1': Device(
+            rx_driver=_WideTestRXDriver(),
+            vfo_cell=LooseCell(value=freq, type=RangeT([(-1e9, 1e9)]), writable=True, persists=False))})
+        (_key, receiver) = top.add_receiver('WFM', key='w', state={'rec_freq': freq})
+        self.assertIsInstance(receiver.get_input_plan(), SubbandPlan)
+        top._do_connect()
+        reasons = []
+        self.patch(top, '_schedule_reconnect', reasons.append)
+        receiver.set_mode('AM-unsel')  # not channelizable
+        self.assertIsNone(receiver.get_input_plan())
+        self.assertIn(u'receiver w: needs different channel or subband', reasons)
+
+    def test_subband_limit(self):
+        self.patch(top_module, '_MAX_FULL_RATE_RECEIVERS', 2)
+        freq = 100e6
+        top = Top(devices={'s1': Device(
+            rx_driver=_WideTestRXDriver(),
+            vfo_cell=LooseCell(value=freq, type=RangeT([(-1e9, 1e9)]), writable=True, persists=False))})
+        for key, offset in [('a', -800e3), ('b', 0), ('c', 800e3)]:
+            top.add_receiver('WFM', key=key, state={'rec_freq': freq + offset})
+        self.assertEqual(len(top._Top__subband_filters['s1']), 2)
+        self.assertEqual(top._receiver_valid, {'a': True, 'b': True, 'c': False})
+    
+    def test_device_partitions(self):
+        top = Top(
+            devices={
+                's1': SimulatedDeviceForTest(freq=0),
+                's2': SimulatedDeviceForTest(freq=0),
+            },
+            features={'stereo': True, 'device_partitions': True})
+        (_key, receiver1) = top.add_receiver('AM', key='a')
+        (_key, receiver2) = top.add_receiver('AM', key='b')
+        receiver2.set_device_name('s2')
+        queue = gr.msg_queue()
+        top.add_audio_queue(queue, 48000)
+        top._do_connect()
+        top.start()
+        top.set_source_name('s2')  # moves the monitor between partitions
+        receiver1.set_device_name('s2')  # moves a receiver between partitions
+        top.stop()
+        top.wait()
+    
+    @defer.inlineCallbacks
+    def test_device_partition_stalled(self):
+        top = Top(
+            devices={
+                's1': SimulatedDeviceForTest(freq=0),
+                's2': SimulatedDeviceForTest(freq=0),
+            },
+            features={'stereo': True, 'device_partitions': True})
+        top.add_receiver('AM', key='a')
+        (_key, receiver2) = top.add_receiver('AM', key='b')
+        receiver2.set_device_name('s2')
+        queue = gr.msg_queue()
+        top.add_audio_queue(queue, 48000)
+        top.start()
+        partition = top._Top__partitions['s1']
+        try:
+            # as it would be while being reconfigured, or if it were stuck
+            partition.set_running(False)
+            yield deferLater(the_reactor, 0.5, lambda: None)
+            while not queue.empty_p():
+                queue.delete_head()
+            yield deferLater(the_reactor, 0.5, lambda: None)
+            self.assertFalse(queue.empty_p())
+        finally:
+            partition.set_running(True)
+            top.stop()
+            top.wait()
+    
     def test_close(self):
         log = []
         top = Top(devices={'m':
@@ -267,3 +420,12 @@ class _DeviceShutdownDetector(ExportedState):
         
     def close(self):
         self.__log.append('close')
+
+
+class _WideTestRXDriver(StubRXDriver):
+    def __init__(self):
+        super(_WideTestRXDriver, self).__init__()
+        self.__signal_type = SignalType(kind='IQ', sample_rate=2.4e6)
+    
+    def get_output_type(self):
+        return self.__signal_type
@@ -0,0 +1,129 @@
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import, division, unicode_literals
+
+from twisted.internet import defer
+from twisted.internet import reactor as the_reactor
+from twisted.internet.task import deferLater
+from twisted.trial import unittest
+from zope.interface import implementer  # available via Twisted
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.i.modes import lookup_mode
+from shinysdr.i.worker import WorkerDemodulator, _FrameDecoder, _encode_frame, _mirrorable_cells
+from shinysdr.interfaces import IDemodulatorContext
+from shinysdr.types import ReferenceT
+from shinysdr.values import ExportedState, LooseCell, exported_value, nullExportedState, setter
+
+
+class TestFrames(unittest.TestCase):
+    def test_round_trip(self):
+        messages = [('cell', 'level', -12.5), ('message', {'a': [1, 2]}), ('freq', 1e6)]
+        decoder = _FrameDecoder()
+        self.assertEqual(decoder.feed(b''.join(_encode_frame(m) for m in messages)), messages)
+    
+    def test_split(self):
+        data = _encode_frame(('set', 'squelch', -50)) + _encode_frame(('freq', 1e6))
+        decoder = _FrameDecoder()
+        received = []
+        for i in xrange(len(data)):
+            received.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual(received, [('set', 'squelch', -50), ('freq', 1e6)])
+
+
+class TestMirrorableCells(unittest.TestCase):
+    def test_excludes_references(self):
+        self.assertEqual(sorted(_mirrorable_cells(_Specimen()).keys()), ['level', 'squelch'])
+
+
+class TestWorkerDemodulator(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_worker_killed(self):
+        input_rate = 100000
+        died = defer.Deferred()
+        context = _StubDemodulatorContext()
+        worker = WorkerDemodulator(
+            mode='AM',
+            input_rate=input_rate,
+            shadow=lookup_mode('AM').demod_class(mode='AM', input_rate=input_rate, context=context),
+            context=context,
+            died=lambda: died.callback(None))
+        sink = blocks.vector_sink_f(vlen=2)
+        tb = gr.top_block()
+        tb.connect(
+            blocks.null_source(gr.sizeof_gr_complex),
+            blocks.throttle(gr.sizeof_gr_complex, input_rate),
+            worker,
+            sink)
+        tb.start()
+        try:
+            yield deferLater(the_reactor, 1.0, lambda: None)
+            worker._WorkerDemodulator__protocol.transport.signalProcess('KILL')
+            yield died
+            # the server's flow graph keeps running, with silence in place of the worker's audio
+            count = len(sink.data())
+            yield deferLater(the_reactor, 0.5, lambda: None)
+            self.assertGreater(len(sink.data()), count)
+        finally:
+            tb.stop()
+            tb.wait()
+            worker.close()
+
+
+@implementer(IDemodulatorContext)
+class _StubDemodulatorContext(object):
+    def __init__(self):
+        self.__freq_cell = LooseCell(value=0.0, type=float, writable=False, persists=False)
+    
+    def rebuild_me(self):
+        raise Exception('not implemented')
+    
+    def lock(self):
+        pass
+    
+    def unlock(self):
+        pass
+    
+    def output_message(self, message):
+        pass
+    
+    def get_absolute_frequency_cell(self):
+        return self.__freq_cell
+
+
+class _Specimen(ExportedState):
+    def __init__(self):
+        self.squelch = -50
+    
+    @exported_value(type=float, changes='continuous')
+    def get_level(self):
+        return 0.0
+    
+    @exported_value(type=float, changes='this_setter')
+    def get_squelch(self):
+        return self.squelch
+    
+    @setter
+    def set_squelch(self, value):
+        self.squelch = value
+    
+    @exported_value(type=ReferenceT(), changes='never')
+    def get_child(self):
+        return nullExportedState
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for demodulators tuned by a rotator in front of them, as the receiver does for demodulators which are not ITunableDemodulators, versus tuned by their own channel filter.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.grc import DemodulatorAdapter
+from shinysdr.i.modes import lookup_mode
+from shinysdr.interfaces import ITunableDemodulator
+from shinysdr.math import rotator_inc
+
+
+_INPUT_RATE = 2400000
+_OFFSET = 100000
+
+
+def run_one(mode, use_rotator, size):
+    adapter = DemodulatorAdapter(mode=mode, input_rate=_INPUT_RATE, output_rate=48000, quiet=True)
+    demodulator = adapter.get_demodulator()
+    top = gr.top_block()
+    source = blocks.vector_source_c([0.5] * size)
+    if use_rotator:
+        demodulator.set_rec_freq(0)
+        top.connect(source, blocks.rotator_cc(rotator_inc(rate=_INPUT_RATE, shift=-_OFFSET)), adapter)
+    else:
+        demodulator.set_rec_freq(_OFFSET)
+        top.connect(source, adapter)
+    top.connect((adapter, 0), blocks.null_sink(gr.sizeof_float))
+    top.connect((adapter, 1), blocks.null_sink(gr.sizeof_float))
+
+    t0 = time.clock()
+    top.start()
+    top.wait()
+    top.stop()
+    t1 = time.clock()
+    return t1 - t0
+
+
+def test_one_mode(mode, size=10000000):
+    print '------ %s -------' % (mode,)
+    mode_def = lookup_mode(mode)
+    if mode_def is None:
+        print 'not available'
+        return
+    if not ITunableDemodulator.implementedBy(mode_def.demod_class):
+        print 'not an ITunableDemodulator'
+        return
+    before = run_one(mode, True, size)
+    after = run_one(mode, False, size)
+    print size, 'samples processed in', before, 'CPU-seconds with rotator'
+    print size, 'samples processed in', after, 'CPU-seconds tuned by demodulator'
+
+
+if __name__ == '__main__':
+    for m in ['AM', 'NFM', 'WFM', 'USB', 'VOR', 'PSK31', 'RTTY']:
+        test_one_mode(m)
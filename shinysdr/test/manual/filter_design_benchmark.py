@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for constructing MultistageChannelFilters and resamplers with and without previously computed filter designs.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from shinysdr.filters import MultistageChannelFilter, _tap_cache, make_resampler
+
+
+_CONSTRUCTIONS = 20
+
+
+def test_one_construction(label, construct):
+    print '------ %s -------' % (label,)
+    _tap_cache.clear()
+    t0 = time.clock()
+    construct()
+    t1 = time.clock()
+    for _ in xrange(_CONSTRUCTIONS):
+        construct()
+    t2 = time.clock()
+
+    print (t1 - t0) * 1e3, 'CPU-milliseconds cold'
+    print (t2 - t1) / _CONSTRUCTIONS * 1e3, 'CPU-milliseconds warm'
+
+
+def test_cutoff_drag(steps=100):
+    print '------ cutoff drag -------'
+    f = MultistageChannelFilter(input_rate=2400000, output_rate=48000, cutoff_freq=5000, transition_width=1000)
+    cutoffs = [3000 + i * 100 for i in xrange(steps)]
+    times = []
+    for _ in xrange(2):
+        t0 = time.clock()
+        for cutoff in cutoffs:
+            f.set_cutoff_freq(cutoff)
+        times.append(time.clock() - t0)
+
+    print times[0] / steps * 1e3, 'CPU-milliseconds per step, first drag'
+    print times[1] / steps * 1e3, 'CPU-milliseconds per step, repeated drag'
+
+
+if __name__ == '__main__':
+    # like SSB
+    test_one_construction('SSB channel filter', lambda: MultistageChannelFilter(input_rate=3200000, output_rate=8000, cutoff_freq=3000, transition_width=1200))
+    
+    # like WFM
+    test_one_construction('WFM channel filter', lambda: MultistageChannelFilter(input_rate=2400000, output_rate=240000, cutoff_freq=80000, transition_width=20000))
+    
+    # requires non-decimation resampling
+    test_one_construction('resampling channel filter', lambda: MultistageChannelFilter(input_rate=1000000, output_rate=48000, cutoff_freq=5000, transition_width=1000))
+    
+    test_one_construction('audio resampler', lambda: make_resampler(44100, 48000))
+    test_one_construction('fractional resampler', lambda: make_resampler(44100.5, 48000))
+    
+    test_cutoff_drag()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for MonitorSink (spectrum display) CPU usage at various sample rates, resolutions and frame rates.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from gnuradio import blocks
+from gnuradio import gr
+
+from shinysdr.i.blocks import Context, MonitorSink
+from shinysdr.signals import SignalType
+
+
+def test_one(sample_rate, freq_resolution, frame_rate, seconds=5):
+    print '------ %s samples/s, %s bins, %s frames/s -------' % (sample_rate, freq_resolution, frame_rate)
+    size = int(sample_rate * seconds)
+    top = gr.top_block()
+    monitor = MonitorSink(
+        signal_type=SignalType(kind='IQ', sample_rate=sample_rate),
+        freq_resolution=freq_resolution,
+        frame_rate=frame_rate,
+        context=Context(top))
+    top.connect(
+        blocks.null_source(gr.sizeof_gr_complex),
+        blocks.head(gr.sizeof_gr_complex, size),
+        monitor)
+    
+    t0 = time.clock()
+    top.start()
+    top.wait()
+    top.stop()
+    t1 = time.clock()
+
+    print size, 'samples processed in', t1 - t0, 'CPU-seconds'
+    print (t1 - t0) / seconds * 100, '% CPU at real-time rate'
+
+
+if __name__ == '__main__':
+    for rate in [250000, 2400000, 10000000]:
+        for resolution in [1024, 4096]:
+            for fps in [30, 500]:
+                test_one(rate, resolution, fps)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Microbenchmark for Poller subscription bookkeeping and polling overhead.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from shinysdr.i.poller import Poller
+from shinysdr.values import ExportedState, exported_value
+
+
+class _Specimen(ExportedState):
+    @exported_value(changes='continuous', persists=False)
+    def get_value(self):
+        return 0
+
+
+def test_one_count(count, polls=100):
+    print '------ %s subscriptions -------' % (count,)
+    poller = Poller()
+    cells = [_Specimen().state()['value'] for _ in xrange(count)]
+
+    def subscriber(value):
+        pass
+
+    t0 = time.clock()
+    subscriptions = [poller.subscribe(cell, subscriber, fast=True) for cell in cells]
+    t1 = time.clock()
+    for _ in xrange(polls):
+        poller.poll(True)
+    t2 = time.clock()
+    # unsubscribe from the middle outward, which is the worst case for a sorted list
+    middle = count // 2
+    for i in xrange(middle):
+        subscriptions[middle + i].unsubscribe()
+        subscriptions[middle - i - 1].unsubscribe()
+    for subscription in subscriptions[middle * 2:]:
+        subscription.unsubscribe()
+    t3 = time.clock()
+
+    print (t1 - t0) / count * 1e6, 'CPU-microseconds per subscribe'
+    print (t2 - t1) / polls * 1e3, 'CPU-milliseconds per poll of all'
+    print (t3 - t2) / count * 1e6, 'CPU-microseconds per unsubscribe'
+
+
+if __name__ == '__main__':
+    test_one_count(1000)
+    test_one_count(10000)
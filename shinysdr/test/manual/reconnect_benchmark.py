@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for Top's flow graph reconnection, with and without incremental reconnection.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+from shinysdr.i import blocks
+from shinysdr.i.top import Top
+from shinysdr.plugins.simulate import SimulatedDevice
+
+
+def test_one(incremental, receivers=5, iterations=20):
+    print '------ incremental=%s, %s receivers -------' % (incremental, receivers)
+    blocks._use_incremental_reconnect = incremental
+    top = Top(devices={'s1': SimulatedDevice()})
+    for _ in xrange(receivers):
+        top.add_receiver('AM')
+    top.start()
+    try:
+        t0 = time.time()
+        for _ in xrange(iterations):
+            top._trigger_reconnect('benchmark (no change)')
+        t1 = time.time()
+        for _ in xrange(iterations):
+            key, _ = top.add_receiver('AM')
+            top.delete_receiver(key)
+        t2 = time.time()
+    finally:
+        top.stop()
+        top.wait()
+    
+    print (t1 - t0) / iterations * 1e3, 'ms per reconnect with no change'
+    print (t2 - t1) / iterations / 2 * 1e3, 'ms per reconnect adding or removing one receiver'
+
+
+if __name__ == '__main__':
+    test_one(False)
+    test_one(True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Kevin Reid <kpreid@switchb.org>
+#
+# This file is part of ShinySDR.
+#
+# ShinySDR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ShinySDR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ShinySDR.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for the state stream's 'delta-deflate' bulk encoding, as applied to spectrum frames.
+
+Usage: spectrum_compression_benchmark.py [FILE BINS]
+
+FILE, if given, should contain consecutive recorded spectrum frames of BINS signed bytes each (the same form as MonitorSink's FFT output, e.g. as written by a GNU Radio file_sink attached after its float_to_char). Otherwise, synthetic frames are used.
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import sys
+import time
+import zlib
+
+import numpy
+
+from shinysdr.i.network.export_ws import _BulkRecord, _delta_encode_element, _encode_frame
+from shinysdr.types import BulkDataElement, BulkDataT
+
+
+_FRAME_RATE = 30
+_SPECTRUM_TYPE = BulkDataT(array_format='b', info_format='dff')
+
+
+def synthetic_frames(count=300, bins=4096, averaging=0.9):
+    # Noise floor with exponential averaging over time like MonitorSink's, plus slowly drifting carriers.
+    rng = numpy.random.RandomState(0)
+    x = numpy.arange(bins)
+    carriers = [(bins * 0.2, 40), (bins * 0.5, 60), (bins * 0.73, 25)]
+    noise = rng.normal(0, 3, bins)
+    frames = []
+    for i in xrange(count):
+        noise = averaging * noise + (1 - averaging) * rng.normal(0, 3, bins)
+        spectrum = -100 + noise
+        for center, height in carriers:
+            spectrum += height * numpy.exp(-((x - center - i * 0.1) / 8) ** 2)
+        frames.append(numpy.clip(spectrum, -128, 127).astype(numpy.int8).tostring())
+    return frames
+
+
+def recorded_frames(path, bins):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [data[i:i + bins] for i in xrange(0, len(data) - bins + 1, bins)]
+
+
+def test_one_encoding(packed_frames, delta, level):
+    print '------ delta=%s level=%s -------' % (delta, level)
+    previous = None
+    total_bytes = 0
+    t0 = time.clock()
+    for packed in packed_frames:
+        if level is None:
+            frame = _encode_frame([_BulkRecord(1, packed)])
+        else:
+            if delta:
+                encoded = _delta_encode_element(previous, packed)
+                previous = packed
+            else:
+                encoded = packed
+            frame = zlib.compress(_encode_frame([_BulkRecord(1, encoded)]), level)
+        total_bytes += len(frame)
+    t1 = time.clock()
+
+    count = len(packed_frames)
+    print total_bytes / count, 'bytes/frame,', total_bytes / count * _FRAME_RATE, 'bytes/s at', _FRAME_RATE, 'frames/s'
+    print (t1 - t0) / count * 1e6, 'CPU-microseconds/frame'
+
+
+def main(argv):
+    if len(argv) > 2:
+        frames = recorded_frames(argv[1], int(argv[2]))
+    else:
+        frames = synthetic_frames()
+    packed_frames = [
+        _SPECTRUM_TYPE.pack(BulkDataElement(data=data, info=(0.0, 100e6, 0.0)))
+        for data in frames]
+    print len(packed_frames), 'frames of', len(frames[0]), 'bins'
+
+    test_one_encoding(packed_frames, delta=False, level=None)
+    for level in [1, 6, 9]:
+        test_one_encoding(packed_frames, delta=False, level=level)
+        test_one_encoding(packed_frames, delta=True, level=level)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -84,6 +84,19 @@ class TestConfigObject(unittest.TestCase):
         self.assertRaises(ConfigException, lambda: self.config.persist_to_file('bar'))
         self.assertEqual('foo', self.config._state_filename)
 
+    # --- Filter cache ---
+    
+    @defer.inlineCallbacks
+    def test_filter_cache_too_late(self):
+        yield self.config._wait_and_validate()
+        self.assertRaises(ConfigTooLateException, lambda:
+            self.config.set_filter_cache_file('foo'))
+    
+    def test_filter_cache_ok(self):
+        self.assertEqual(None, self.config._filter_cache_filename)
+        self.config.set_filter_cache_file('foo')
+        self.assertEqual('foo', self.config._filter_cache_filename)
+
     # --- Devices ---
     
     @defer.inlineCallbacks
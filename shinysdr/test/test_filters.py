@@ -17,6 +17,9 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import os.path
+import shutil
+import tempfile
 import textwrap
 
 from twisted.trial import unittest
@@ -24,7 +27,8 @@ from twisted.trial import unittest
 from gnuradio import blocks
 from gnuradio import gr
 
-from shinysdr.filters import MultistageChannelFilter
+from shinysdr import filters
+from shinysdr.filters import MultistageChannelFilter, _FilterPlanCommentStage, _FilterPlanDecimatingStage, _FilterPlanFinalDecimatingStage, _MultistageChannelFilterPlan, _TapCache, _make_filter_plan_1, _prefer_fft_filter
 
 
 class TestMultistageChannelFilter(unittest.TestCase):
@@ -38,16 +42,29 @@ class TestMultistageChannelFilter(unittest.TestCase):
         self.assertEqual(1000, filt.get_transition_width())
         self.assertEqual(10000, filt.get_center_freq())
         self.assertEqual(filt.explain(), textwrap.dedent("""\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
-              final filter and decimate by 2 using  77 taps (1232000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000, estimated 5.1 MACs per input sample
+              freq xlate and decimate by 50 using 247 taps (158080000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  65 taps (4160000) in fir_filter_ccc_sptr
+              final filter and decimate by 4 using 155 taps (2480000) in fft_filter_ccc_sptr
               No final resampler stage."""))
     
+    def test_retap_only_final_stage(self):
+        filt = MultistageChannelFilter(input_rate=32000000, output_rate=16000, cutoff_freq=3000, transition_width=1200)
+        taps_before = [list(stage.taps()) for stage in filt.stages if stage is not None]
+        filt.set_cutoff_freq(2500)
+        filt.explain()  # applies any coalesced change
+        taps_after = [list(stage.taps()) for stage in filt.stages if stage is not None]
+        self.assertEqual(taps_before[:-1], taps_after[:-1])
+        self.assertNotEqual(taps_before[-1], taps_after[-1])
+    
+    def test_pfb_resampler_taps(self):
+        self.patch(filters, '_use_rational_resampler', False)
+        f = MultistageChannelFilter(input_rate=8000, output_rate=21234, cutoff_freq=8000, transition_width=5000)
+        self.__run(f, 4000, 21234 / 8000, """\
+            2 stages from 8000 to 21234, estimated 112.0 MACs per input sample
+              freq xlation only using   1 taps (8000) in freq_xlating_fir_filter_ccc_sptr
+              arb_resampler 21234/8000 = 2.65425 using arb_resampler_ccf""")
+    
     def test_too_wide_cutoff(self):
         self.assertRaisesRegexp(ValueError, '500.*182', MultistageChannelFilter, input_rate=200000, output_rate=182, cutoff_freq=500, transition_width=18.2)
     
@@ -55,28 +72,20 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=32000000, output_rate=16000, cutoff_freq=3000, transition_width=1200)
         self.__run(f, 400000, 16000 / 32000000, """\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
-              final filter and decimate by 2 using  65 taps (1040000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000, estimated 5.1 MACs per input sample
+              freq xlate and decimate by 50 using 247 taps (158080000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  65 taps (4160000) in fir_filter_ccc_sptr
+              final filter and decimate by 4 using 129 taps (2064000) in fft_filter_ccc_sptr
               No final resampler stage.""")
     
     def test_float_rates(self):
         # Either float or int rates should be accepted
         f = MultistageChannelFilter(input_rate=32000000.0, output_rate=16000.0, cutoff_freq=3000, transition_width=1200)
         self.__run(f, 400000, 16000 / 32000000, """\
-            7 stages from 32000000 to 16000
-              freq xlate and decimate by 5 using  25 taps (160000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 5 using  25 taps (32000000) in fft_filter_ccc_sptr
-              decimate by 5 using  25 taps (6400000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1408000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (704000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (352000) in fft_filter_ccc_sptr
-              final filter and decimate by 2 using  65 taps (1040000) in fft_filter_ccc_sptr
+            3 stages from 32000000 to 16000, estimated 5.1 MACs per input sample
+              freq xlate and decimate by 50 using 247 taps (158080000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 10 using  65 taps (4160000) in fir_filter_ccc_sptr
+              final filter and decimate by 4 using 129 taps (2064000) in fft_filter_ccc_sptr
               No final resampler stage.""")
     
     def test_interpolating(self):
@@ -84,7 +93,7 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=8000, output_rate=20000, cutoff_freq=8000, transition_width=5000)
         self.__run(f, 4000, 20000 / 8000, """\
-            2 stages from 8000 to 20000
+            2 stages from 8000 to 20000, estimated 83.5 MACs per input sample
               freq xlation only using   1 taps (8000) in freq_xlating_fir_filter_ccc_sptr
               rational_resampler by 5/2 (stage rates 20000/8000) using 165 taps (3300000) in rational_resampler_base_ccf_sptr""")
     
@@ -93,7 +102,7 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=8000, output_rate=21234, cutoff_freq=8000, transition_width=5000)
         self.__run(f, 4000, 21234 / 8000, """\
-            2 stages from 8000 to 21234
+            2 stages from 8000 to 21234, estimated 88.6 MACs per input sample
               freq xlation only using   1 taps (8000) in freq_xlating_fir_filter_ccc_sptr
               rational_resampler by 10617/4000 (stage rates 21234/8000) using 350361 taps (7439565474) in rational_resampler_base_ccf_sptr""")
     
@@ -102,15 +111,11 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # TODO: Test filter functionality more
         f = MultistageChannelFilter(input_rate=8000000, output_rate=48000, cutoff_freq=10000, transition_width=5000)
         self.__run(f, 400000, 48000 / 8000000, """\
-            8 stages from 8000000 to 48000
-              freq xlate and decimate by 2 using   9 taps (36000000) in freq_xlating_fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (18000000) in fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (9000000) in fir_filter_ccc_sptr
-              decimate by 2 using   9 taps (4500000) in fir_filter_ccc_sptr
-              decimate by 2 using  11 taps (2750000) in fft_filter_ccc_sptr
-              decimate by 2 using  11 taps (1375000) in fft_filter_ccc_sptr
-              final filter and decimate by 2 using  61 taps (3812500) in fft_filter_ccc_sptr
-              rational_resampler by 96/125 (stage rates 48000/62500) using 4128 taps (198144000) in rational_resampler_base_ccf_sptr""")
+            4 stages from 8000000 to 48000, estimated 6.3 MACs per input sample
+              freq xlate and decimate by 16 using  85 taps (42500000) in freq_xlating_fir_filter_ccc_sptr
+              decimate by 5 using  47 taps (4700000) in fir_filter_ccc_sptr
+              final filter and decimate by 2 using  49 taps (2450000) in fft_filter_ccc_sptr
+              rational_resampler by 24/25 (stage rates 48000/50000) using 840 taps (40320000) in rational_resampler_base_ccf_sptr""")
     
     def test_center_freq_decimating(self):
         f = MultistageChannelFilter(input_rate=10000, output_rate=1000, cutoff_freq=400, transition_width=200, center_freq=1)
@@ -128,8 +133,8 @@ class TestMultistageChannelFilter(unittest.TestCase):
         # this test was written before __run checke everything; kept around for just another example
         f = MultistageChannelFilter(input_rate=10000, output_rate=1000, cutoff_freq=500, transition_width=100)
         self.assertEqual(f.explain(), textwrap.dedent("""\
-            2 stages from 10000 to 1000
-              freq xlate and decimate by 5 using  43 taps (86000) in freq_xlating_fir_filter_ccc_sptr
+            2 stages from 10000 to 1000, estimated 12.4 MACs per input sample
+              freq xlate and decimate by 5 using  49 taps (98000) in freq_xlating_fir_filter_ccc_sptr
               final filter and decimate by 2 using  49 taps (49000) in fft_filter_ccc_sptr
               No final resampler stage."""))
     
@@ -158,3 +163,93 @@ class TestMultistageChannelFilter(unittest.TestCase):
         top.stop()
         reference_out_size = in_size * ratio
         return reference_out_size - len(sink.data())
+
+
+class TestFilterPlanner(unittest.TestCase):
+    def test_cheaper_than_prime_stages(self):
+        """The chosen plan should be no more costly than decimating by each prime factor in turn."""
+        plan = _make_filter_plan_1(input_rate=2400000, output_rate=48000, cutoff_freq=5000, transition_width=1000)
+        prime_stages = _MultistageChannelFilterPlan(
+            stage_designs=[
+                _FilterPlanDecimatingStage(freq_xlating=True, decimation=5, protected_freq=24000, input_rate=2400000, output_rate=480000),
+                _FilterPlanDecimatingStage(freq_xlating=False, decimation=5, protected_freq=24000, input_rate=480000, output_rate=96000),
+                _FilterPlanFinalDecimatingStage(freq_xlating=False, decimation=2, input_rate=96000, output_rate=48000),
+                _FilterPlanCommentStage(comment='', rate=48000),
+            ],
+            freq_xlate_stage=0,
+            cutoff_freq=5000,
+            transition_width=1000)
+        self.assertLessEqual(plan.get_cost(), prime_stages.get_cost())
+        self.assertEqual(plan.get_stage_designs()[-1].output_rate, 48000)
+    
+    def test_fft_choice(self):
+        self.assertTrue(_prefer_fft_filter(200, 2))
+        self.assertFalse(_prefer_fft_filter(11, 2))
+
+
+class TestTapCache(unittest.TestCase):
+    def setUp(self):
+        self.__temp_dir = tempfile.mkdtemp(prefix='shinysdr_test_filters')
+        self.__designs = []
+    
+    def tearDown(self):
+        shutil.rmtree(self.__temp_dir)
+    
+    def __design(self, value):
+        def design():
+            self.__designs.append(value)
+            return [value, value]
+        return design
+    
+    def test_memoized(self):
+        cache = _TapCache(2)
+        self.assertEqual(cache.get(('a', 1.0), self.__design(1.0)), [1.0, 1.0])
+        self.assertEqual(cache.get(('a', 1.0), self.__design(1.0)), [1.0, 1.0])
+        self.assertEqual(self.__designs, [1.0])
+    
+    def test_lru(self):
+        cache = _TapCache(2)
+        cache.get(('a', 1), self.__design(1))
+        cache.get(('a', 2), self.__design(2))
+        cache.get(('a', 1), self.__design(1))
+        cache.get(('a', 3), self.__design(3))  # evicts 2
+        cache.get(('a', 1), self.__design(1))
+        cache.get(('a', 2), self.__design(2))
+        self.assertEqual(self.__designs, [1, 2, 3, 2])
+    
+    def test_file(self):
+        filename = os.path.join(self.__temp_dir, 'cache.json')
+        cache = _TapCache(2)
+        cache.use_file(filename)
+        cache.get(('a', 1.5), self.__design(1.5))
+        cache.save()
+        cache = _TapCache(2)
+        cache.use_file(filename)
+        self.assertEqual(cache.get(('a', 1.5), self.__design(1.5)), [1.5, 1.5])
+        self.assertEqual(self.__designs, [1.5])
+    
+    def test_file_trimmed(self):
+        filename = os.path.join(self.__temp_dir, 'cache.json')
+        cache = _TapCache(3)
+        cache.use_file(filename)
+        cache.get(('a', 1), self.__design(1))
+        cache.get(('a', 2), self.__design(2))
+        cache.get(('a', 3), self.__design(3))
+        cache.save()
+        cache = _TapCache(2)
+        cache.use_file(filename)  # keeps the most recently used 2 and 3
+        cache.get(('a', 3), self.__design(3))
+        cache.get(('a', 2), self.__design(2))
+        cache.get(('a', 1), self.__design(1))
+        self.assertEqual(self.__designs, [1, 2, 3, 1])
+    
+    def test_file_unreadable(self):
+        cache = _TapCache(2)
+        cache.use_file(os.path.join(self.__temp_dir, 'cache.json'))  # nonexistent is fine
+        self.assertEqual(self.flushLoggedErrors(), [])
+        filename = os.path.join(self.__temp_dir, 'bad.json')
+        with open(filename, 'w') as f:
+            f.write('{')
+        cache.use_file(filename)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertEqual(cache.get(('a', 1), self.__design(1)), [1, 1])
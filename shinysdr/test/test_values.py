@@ -18,13 +18,20 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import Queue
+import time
 import unittest
 
+from twisted.internet.interfaces import IReactorThreads
+from twisted.internet.task import Clock
+from zope.interface import implementer
+
 from gnuradio import gr
 
+from shinysdr.i.poller import Poller
 from shinysdr.test.testutil import CellSubscriptionTester, LoopbackInterestTracker
 from shinysdr.types import BulkDataElement, BulkDataT, EnumRow, RangeT, ReferenceT, to_value_type
-from shinysdr.values import CellDict, CollectionState, ElementQueueCell, ExportedState, LooseCell, PollingCell, StringQueueCell, ViewCell, command, exported_value, nullExportedState, setter, unserialize_exported_state
+from shinysdr.values import CellDict, CollectionState, ElementQueueCell, ExportedState, LooseCell, PollingCell, StringQueueCell, SubscriptionContext, ViewCell, command, exported_value, nullExportedState, setter, unserialize_exported_state, _MsgQueueReader
 
 
 class TestExportedState(unittest.TestCase):
@@ -212,6 +219,13 @@ class TestPollingCell(unittest.TestCase):
             key='value',
             changes='never')
         self.assertEqual(repr(cell), '<PollingCell <NoInherentCellSpecimen repr>.value>')
+    
+    def test_poll_interval_requires_continuous(self):
+        self.assertRaises(ValueError, lambda: PollingCell(
+            target=NoInherentCellSpecimen(),
+            key='value',
+            changes='explicit',
+            poll_interval=1))
 
 
 class NoInherentCellSpecimen(object):
@@ -325,6 +339,34 @@ class TestGRMsgQueueCell(unittest.TestCase):
         self.queue.insert_tail(make_bytes_msg(b'ignored'))
         st.advance()
     
+    def test_element_history(self):
+        self.setUpForBulkData()
+        self.cell = ElementQueueCell(
+            queue=self.queue,
+            info_getter=self.info_getter,
+            type=BulkDataT(array_format='f', info_format='d'),
+            history_length=3,
+            interest_tracker=LoopbackInterestTracker())
+        st = CellSubscriptionTester(self.cell, delta=True)
+        self.queue.insert_tail(make_bytes_msg(b'ab'))
+        self.queue.insert_tail(make_bytes_msg(b'cd'))
+        st.advance()
+        self.assertEqual([e.data for e in self.cell.get()], [b'b', b'c', b'd'])
+        self.queue.insert_tail(make_bytes_msg(b'efgh'))
+        st.advance()
+        self.assertEqual([e.data for e in self.cell.get()], [b'f', b'g', b'h'])
+        self.queue.insert_tail(make_bytes_msg(b'i'))
+        self.queue.insert_tail(make_bytes_msg(b'jklmnopq'))
+        st.advance()
+        self.assertEqual([e.data for e in self.cell.get()], [b'o', b'p', b'q'])
+    
+    def test_element_identity(self):
+        self.setUpForBulkData()
+        st = CellSubscriptionTester(self.cell, delta=True)
+        self.queue.insert_tail(make_bytes_msg(b'ab'))
+        st.advance()
+        self.assertIs(self.cell.get()[-1], self.cell.get()[-1])
+    
     def test_string_get(self):
         self.setUpForUnicodeString()
         self.queue.insert_tail(make_bytes_msg('abç'.encode('utf-8')))
@@ -367,6 +409,72 @@ class TestGRMsgQueueCell(unittest.TestCase):
         # TODO: This is not the correct result; it should match get().
         # Poller currently does not deal with attaching simple subscribers correctly
         st.expect_now('deƒ')
+    
+    def test_push_delivery(self):
+        self.setUpForBulkData()
+        reactor = ThreadedClock()
+        poller = Poller()
+        gotten = []
+        _, subscription = self.cell.subscribe2(gotten.append, SubscriptionContext(reactor=reactor, poller=poller))
+        self.assertEqual(poller.count_subscriptions(), 0)
+        self.queue.insert_tail(make_bytes_msg(b'ab'))
+        reactor.run_one_from_thread()
+        self.assertEqual(gotten, [[
+            BulkDataElement(data=b'a', info=(1001,)),
+            BulkDataElement(data=b'b', info=(1001,))
+        ]])
+        subscription.unsubscribe()
+
+
+class TestMsgQueueReader(unittest.TestCase):
+    def setUp(self):
+        self.reactor = ThreadedClock()
+        self.delivered = []
+    
+    def deliver(self, messages):
+        self.delivered.append([m.to_string() for m in messages])
+    
+    def wait_for_empty(self, queue):
+        deadline = time.time() + 10
+        while not queue.empty_p():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+    
+    def test_pending_limit(self):
+        queue = gr.msg_queue()
+        reader = _MsgQueueReader(queue, self.reactor, self.deliver, max_pending=2)
+        for s in [b'a', b'b', b'c', b'd', b'e']:
+            queue.insert_tail(make_bytes_msg(s))
+        queue.insert_tail(gr.message())  # skipped, so all the above are pending when it has been taken
+        reader.start()
+        self.wait_for_empty(queue)
+        self.reactor.run_one_from_thread()
+        self.assertEqual(self.delivered, [[b'd', b'e']])
+        reader.stop()
+    
+    def test_stop_with_full_queue(self):
+        queue = gr.msg_queue(limit=1)
+        reader = _MsgQueueReader(queue, self.reactor, self.deliver)
+        queue.insert_tail(make_bytes_msg(b'a'))
+        reader.start()
+        reader.stop()  # must not block, whether or not the thread has taken the message yet
+        self.reactor.run_one_from_thread()
+        self.assertEqual(self.delivered, [[b'a']])
+
+
+@implementer(IReactorThreads)
+class ThreadedClock(Clock):
+    """Clock which accepts callFromThread, queueing the calls to be run explicitly."""
+    def __init__(self):
+        Clock.__init__(self)
+        self.__from_thread = Queue.Queue()
+    
+    def callFromThread(self, f, *args, **kwargs):
+        self.__from_thread.put((f, args, kwargs))
+    
+    def run_one_from_thread(self):
+        f, args, kwargs = self.__from_thread.get(timeout=10)
+        f(*args, **kwargs)
 
 
 def make_bytes_msg(s):
@@ -38,7 +38,7 @@ from shinysdr.devices import Device, IComponent, IRXDriver, ITXDriver
 from shinysdr.grc import DemodulatorAdapter
 from shinysdr.i.modes import lookup_mode
 from shinysdr.i.poller import Poller
-from shinysdr.interfaces import IDemodulator
+from shinysdr.interfaces import IDemodulator, ITunableDemodulator
 from shinysdr.signals import SignalType
 from shinysdr.types import RangeT
 from shinysdr.values import ExportedState, InterestTracker, IDeltaSubscriber, ISubscription, SubscriptionContext, nullExportedState
@@ -325,6 +325,14 @@ class DemodulatorTestCase(unittest.TestCase):
         if self.__noop: return
         verifyObject(IDemodulator, self.demodulator)
     
+    def test_tunable(self):
+        if self.__noop: return
+        if not ITunableDemodulator.providedBy(self.demodulator):
+            return
+        verifyObject(ITunableDemodulator, self.demodulator)
+        self.demodulator.set_rec_freq(1000)
+        self.demodulator.set_rec_freq(-1000)
+    
     def test_state(self):
         if self.__noop: return
         state_smoke_test(self.demodulator)
@@ -484,6 +484,7 @@ class BulkDataT(ValueType):
         self.__info_format = info_format
         # str() is for Python 2.7.6 compatibility (array.array requires a str rather than unicode string)
         self.__array_format = str(array_format)
+        self.__info_struct = struct.Struct(str(info_format))
     
     def to_json(self):
         return {
@@ -499,7 +500,7 @@ class BulkDataT(ValueType):
         return self.__array_format
     
     def pack(self, value):
-        return struct.pack(self.get_info_format(), *value.info) + value.data
+        return self.__info_struct.pack(*value.info) + value.data
     
     def __call__(self, specimen):
         raise Exception('Coerce not implemented for BulkDataT')
@@ -23,12 +23,16 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import codecs
-from collections import namedtuple
+from collections import deque, namedtuple
+import threading
 import weakref
 
+from twisted.internet.interfaces import IReactorThreads
 from twisted.python import log
 from zope.interface import Interface, implementer  # available via Twisted
 
+from gnuradio import gr
+
 from shinysdr.gr_ext import safe_delete_head_nowait
 from shinysdr.types import BulkDataElement, BulkDataT, EnumRow, ReferenceT, to_value_type
 
@@ -102,6 +106,19 @@ class IDeltaSubscriber(ISubscriber):
         """
 
 
+class IPausableSubscriber(ISubscriber):
+    """Interface for subscribers which may temporarily have no use for new values, such as those sending to a network connection which is not accepting data.
+    
+    Polling on behalf of such subscribers may be skipped while they are paused.
+    """
+    
+    def is_paused():
+        """Return whether new values are currently unwanted.
+        
+        A subscriber must accept new values even while paused; this is only a hint.
+        """
+
+
 class InterestTracker(object):
     """Collects expressions of interest in some cells' values to track whether there currently are any."""
     
@@ -258,7 +275,7 @@ class ValueCell(BaseCell):
 # The possible values of the 'changes' parameter to a cell of type PollingCell, which determine when the cell's getter is polled to check for changes.
 _cell_value_change_schedules = [
     u'never',  # never changes at all for the lifetime of the cell
-    u'continuous',  # a different value almost every time
+    u'continuous',  # a different value almost every time; polled frequently, or every poll_interval seconds if specified
     u'explicit',  # implementation will self-report via ExportedState.state_changed
     u'this_setter',  # changes when and only when the setter for this cell is called
 ]
@@ -277,6 +294,7 @@ class PollingCell(TargetingMixin, ValueCell):
             writable=False,
             persists=None,
             interest_tracker=nullInterestTracker,
+            poll_interval=None,
             **kwargs):
         assert changes in _cell_value_change_schedules
         type = to_value_type(type)
@@ -290,6 +308,8 @@ class PollingCell(TargetingMixin, ValueCell):
             raise ValueError('persists=True changes={!r} is not allowed'.format(changes))
         if changes == u'never' and writable:
             raise ValueError('writable=True changes={!r} doesn\'t make sense'.format(changes))
+        if poll_interval is not None and changes != u'continuous':
+            raise ValueError('poll_interval is only meaningful with changes=\'continuous\', not {!r}'.format(changes))
         
         TargetingMixin.__init__(self, target, key)
         ValueCell.__init__(self,
@@ -301,6 +321,7 @@ class PollingCell(TargetingMixin, ValueCell):
             **kwargs)
         
         self.__changes = changes
+        self.__poll_interval = poll_interval
         if changes == u'explicit' or changes == u'this_setter':
             self.__explicit_subscriptions = set()
             self.__last_polled_value = object()
@@ -326,7 +347,7 @@ class PollingCell(TargetingMixin, ValueCell):
         if changes == u'never':
             subscription = never_subscription
         elif changes == u'continuous':
-            subscription = context.poller.subscribe(self, subscriber, fast=True)
+            subscription = context.poller.subscribe(self, subscriber, fast=True, interval=self.__poll_interval)
         elif changes == u'explicit' or changes == u'this_setter':
             subscription = _SimpleSubscription(subscriber, context, self.__explicit_subscriptions, self.interest_tracker)
         else:
@@ -351,6 +372,8 @@ class PollingCell(TargetingMixin, ValueCell):
 class GRMsgQueueCell(ValueCell):
     """A cell which consumes a gr.msg_queue, with items in the format blocks.message_sink generates, and provides its contents as the streaming cell value.
     
+    If the subscription context's reactor supports threads, then the queue is read by a thread which wakes the reactor only when messages arrive; otherwise it is polled.
+    
     Abstract; use ElementQueueCell or StringQueueCell directly.
     """
     
@@ -370,6 +393,10 @@ class GRMsgQueueCell(ValueCell):
         # parameters
         self.__queue = queue
         self.__info_getter = info_getter
+        
+        # state for push delivery
+        self.__reader = None
+        self.__push_subscriptions = set()
     
     def get(self):
         # still abstract
@@ -382,8 +409,24 @@ class GRMsgQueueCell(ValueCell):
     
     def subscribe2(self, subscriber, context):
         """implement abstract"""
+        reactor = context.reactor
+        if IReactorThreads.providedBy(reactor):
+            if self.__reader is None:
+                self.__reader = _MsgQueueReader(self.__queue, reactor, self.__deliver_pushed)
+            if self.__reader.reactor is reactor:
+                return self.get(), _GRMsgQueueCellSubscription(self, subscriber)
         return self.get(), context.poller.subscribe(self, subscriber, fast=True, delegate_polling_to_me=True)
     
+    def _add_push_subscription(self, subscription):
+        if not self.__push_subscriptions:
+            self.__reader.start()
+        self.__push_subscriptions.add(subscription)
+    
+    def _remove_push_subscription(self, subscription):
+        self.__push_subscriptions.remove(subscription)
+        if not self.__push_subscriptions:
+            self.__reader.stop()
+    
     def _deliver_message(self, grmessage, info, fire):
         """Implement this method to handle the gr.message objects from the queue."""
         raise NotImplementedError(self)
@@ -400,6 +443,110 @@ class GRMsgQueueCell(ValueCell):
                 got_info = True
                 latest_info = self.__info_getter()
             self._deliver_message(message, latest_info, fire)
+    
+    def __deliver_pushed(self, messages):
+        info = self.__info_getter()
+        patches = []
+        for message in messages:
+            self._deliver_message(message, info, patches)
+        if not patches:
+            return
+        value = None
+        for subscription in list(self.__push_subscriptions):
+            subscriber = subscription._subscriber
+            if IDeltaSubscriber.providedBy(subscriber):
+                for patch in patches:
+                    subscriber.append(patch)
+            else:
+                if value is None:
+                    value = self.get()
+                subscriber(value)
+
+
+@implementer(ISubscription)
+class _GRMsgQueueCellSubscription(object):
+    def __init__(self, cell, subscriber):
+        self._subscriber = subscriber
+        self.__cell = cell
+        self.__interest_token = object()
+        cell.interest_tracker.set(self.__interest_token, True)
+        cell._add_push_subscription(self)
+    
+    def unsubscribe(self):
+        self.__cell._remove_push_subscription(self)
+        self.__cell.interest_tracker.set(self.__interest_token, False)
+    
+    def __repr__(self):
+        return u'<{} calling {}>'.format(type(self).__name__, self._subscriber)
+
+
+# Number of messages a _MsgQueueReader holds while waiting for the reactor; beyond this the oldest are dropped, as they would be by a full gr.msg_queue.
+_MAX_PENDING_MESSAGES = 100
+
+
+class _MsgQueueReader(object):
+    """Reads a gr.msg_queue on a thread and delivers lists of messages on the reactor thread.
+    
+    Messages which arrive while a delivery is already pending are added to it rather than waking the reactor again.
+    """
+    
+    def __init__(self, queue, reactor, deliver, max_pending=_MAX_PENDING_MESSAGES):
+        self.reactor = reactor
+        self.__queue = queue
+        self.__deliver = deliver
+        self.__lock = threading.Lock()
+        self.__pending = deque(maxlen=max_pending)
+        self.__running = None
+    
+    def start(self):
+        # Each thread has its own flag so that a thread which has been stopped but not yet unblocked cannot be confused with its replacement.
+        self.__running = [True]
+        thread = threading.Thread(
+            name='{!r} reader thread'.format(self.__queue),
+            target=self.__read_loop,
+            args=(self.__running,))
+        thread.daemon = True  # Allow clean process shutdown without waiting for us
+        thread.start()
+    
+    def stop(self):
+        self.__running[0] = False
+        # Insert an empty message, which the loop skips, to ensure the loop thread unblocks. gr.msg_queue has no non-blocking insert, and checking full_p() first would race with the flowgraph filling the queue, so insert from another thread; the loop empties the queue before exiting, so that thread cannot wait for long.
+        waker = threading.Thread(
+            name='{!r} reader wakeup thread'.format(self.__queue),
+            target=self.__queue.insert_tail,
+            args=(gr.message(),))
+        waker.daemon = True
+        waker.start()
+    
+    def __read_loop(self, running):
+        # RUNS IN A SEPARATE THREAD.
+        queue = self.__queue
+        while True:
+            self.__take(queue.delete_head())  # blocking call
+            if not running[0]:
+                break
+        # Make room for the wakeup message, if the queue was full.
+        while True:
+            message = safe_delete_head_nowait(queue)
+            if not message:
+                break
+            self.__take(message)
+    
+    def __take(self, message):
+        # RUNS IN A SEPARATE THREAD.
+        if message.length():
+            # Even if we have been stopped, this message is not lost: it is delivered along with those of the next thread, if any.
+            with self.__lock:
+                schedule = not self.__pending
+                self.__pending.append(message)
+            if schedule:
+                self.reactor.callFromThread(self.__flush)
+    
+    def __flush(self):
+        with self.__lock:
+            messages = list(self.__pending)
+            self.__pending.clear()
+        self.__deliver(messages)
 
 
 class ElementQueueCell(GRMsgQueueCell):
@@ -415,30 +562,82 @@ class ElementQueueCell(GRMsgQueueCell):
             **kwargs)
         
         self.__history_length = history_length
-        self.__latest = []  # caution, mutable
+        self.__batches = deque()  # _ElementBatch for each recent message, oldest first
+        self.__batched_count = 0  # total len of self.__batches
     
     def get(self):
         """implement abstract"""
-        return self.__latest[:]
+        # Walk back from the newest batch so that elements older than the history are not built.
+        parts = []
+        remaining = self.__history_length
+        for batch in reversed(self.__batches):
+            if remaining <= 0:
+                break
+            parts.append(batch[max(0, len(batch) - remaining):])
+            remaining -= len(batch)
+        latest = []
+        for part in reversed(parts):
+            latest.extend(part)
+        return latest
     
     def _deliver_message(self, grmessage, info, fire):
-        string = grmessage.to_string()
-        itemsize = int(grmessage.arg1())
         count = int(grmessage.arg2())
         if not count: return
+        batch = _ElementBatch(grmessage.to_string(), int(grmessage.arg1()), count, info)
         
-        parsed_items = []
-        for index in xrange(count):
-            # extract value
-            item_string = string[itemsize * index:itemsize * (index + 1)]
-            parsed_items.append(BulkDataElement(
-                data=item_string,
-                info=info))
-        
-        self.__latest.extend(parsed_items)
-        self.__latest[:-self.__history_length] = []
+        batches = self.__batches
+        batches.append(batch)
+        self.__batched_count += count
+        # Discard messages only once they are entirely out of the history, so that this costs nothing per element.
+        while self.__batched_count - len(batches[0]) >= self.__history_length:
+            self.__batched_count -= len(batches.popleft())
         
-        fire.append(parsed_items)
+        fire.append(batch)
+
+
+class _ElementBatch(object):
+    """Read-only sequence of the BulkDataElements in one message from a gr.msg_queue.
+    
+    Elements are sliced out of the message string only when accessed, so that consumers which use only some of them (such as a connection with a bulk_view rate limit, which sends only the latest) do not pay for the rest; by default every element is sent and so built. The same element object is returned on every access so that consumers may cache by identity.
+    """
+    
+    def __init__(self, string, itemsize, count, info):
+        self.__string = string
+        self.__itemsize = itemsize
+        self.__info = info
+        self.__elements = [None] * count
+    
+    def __len__(self):
+        return len(self.__elements)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        element = self.__elements[index]
+        if element is None:
+            if index < 0:
+                index += len(self)
+            itemsize = self.__itemsize
+            element = self.__elements[index] = BulkDataElement(
+                data=self.__string[itemsize * index:itemsize * (index + 1)],
+                info=self.__info)
+        return element
+    
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+    
+    def __eq__(self, other):
+        return list(self) == other
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    # compares by value, so must not hash by identity
+    __hash__ = None
+    
+    def __repr__(self):
+        return '<{type} {elements!r}>'.format(type=type(self).__name__, elements=list(self))
 
 
 class StringQueueCell(GRMsgQueueCell):
@@ -793,23 +992,32 @@ class ExportedState(object):
             cells[key].set_state(state[key])
 
 
-def unserialize_exported_state(ctor, kwargs=None, state=None):
-    all_kwargs = {}
-    if kwargs is not None:
-        # note that persistence overrides provided kwargs
-        all_kwargs.update(kwargs)
-    not_yet_set_state = {}
-    if state is not None:
-        not_yet_set_state.update(state)
-    for key, value in not_yet_set_state.items():
+def split_exported_state(ctor, state):
+    """Divide state for an object to be constructed by ctor into the constructor keyword arguments it provides and the remainder, which must be set after construction.
+    
+    Returns a tuple (kwargs, remaining_state).
+    """
+    state_kwargs = {}
+    not_yet_set_state = dict(state)
+    for key, value in state.iteritems():
         getter_name = 'get_' + key  # TODO centralize or eliminate naming scheme
         if not hasattr(ctor, getter_name): continue
         getter = getattr(ctor, getter_name)
         if not isinstance(getter, ExportedGetter): continue
         this_kwargs = getter.state_to_kwargs(value)
         if this_kwargs is None: continue
-        all_kwargs.update(this_kwargs)
+        state_kwargs.update(this_kwargs)
         del not_yet_set_state[key]
+    return state_kwargs, not_yet_set_state
+
+
+def unserialize_exported_state(ctor, kwargs=None, state=None):
+    all_kwargs = {}
+    if kwargs is not None:
+        all_kwargs.update(kwargs)
+    # note that persistence overrides provided kwargs
+    state_kwargs, not_yet_set_state = split_exported_state(ctor, state or {})
+    all_kwargs.update(state_kwargs)
     obj = ctor(**all_kwargs)
     if len(not_yet_set_state) > 0:
         obj.state_from_json(not_yet_set_state)